@@ -3,6 +3,14 @@ ASGI config for appointments project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Besides the regular views, this entry point serves the scheduler's
+Server-Sent Events stream (``/admin/scheduler/appointment/stream/``), which
+pushes appointment changes to open calendars. Each stream is an idle
+coroutine, so a worker can hold hundreds of them; under WSGI the stream
+answers 501 and the calendar keeps working without live updates. To fan out
+across several workers set ``SCHEDULER_PUBSUB_BACKEND`` to
+``scheduler.pubsub.RedisBroker`` and ``SCHEDULER_PUBSUB_URL``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
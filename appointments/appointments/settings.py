@@ -50,6 +50,7 @@ JAZZMIN_SETTINGS = {
 
 
 MIDDLEWARE = [
+    'scheduler.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -85,13 +86,99 @@ WSGI_APPLICATION = 'appointments.wsgi.application'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
 # Database
+DB_POOL = config('DB_POOL', default=False, cast=bool)
+# wsgi o asgi, el mismo valor con el que se levanta gunicorn.conf.py
+SERVER_MODE = config('SERVER_MODE', default='wsgi').lower()
+
 DATABASES = {
     'default': dj_database_url.config(
         default=config('DATABASE_URL'),
-        conn_max_age=600,
+        # Con ASGI las consultas asíncronas corren en hilos distintos y una
+        # conexión persistente por hilo nunca se cierra: siempre 0. Con pool
+        # las conexiones las administra el pool y no pueden ser persistentes.
+        conn_max_age=0 if DB_POOL or SERVER_MODE == 'asgi' else config('CONN_MAX_AGE', default=600, cast=int),
+        # Verificar la conexión antes de reutilizarla (p. ej. tras reiniciar PostgreSQL)
+        conn_health_checks=True,
     )
 }
 
+# Pool de conexiones de psycopg 3 (solo PostgreSQL, requiere psycopg-pool).
+# Cada worker mantiene entre DB_POOL_MIN_SIZE y DB_POOL_MAX_SIZE conexiones;
+# una petición espera hasta DB_POOL_TIMEOUT segundos por una libre.
+if DB_POOL and DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+        'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+        'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+        'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+    }
+
+# statement_timeout (ms) de las vistas interactivas del calendario y de
+# reportes/exportaciones; 0 desactiva el límite.
+SCHEDULER_STATEMENT_TIMEOUT = config('DB_STATEMENT_TIMEOUT', default=3000, cast=int)
+SCHEDULER_REPORT_STATEMENT_TIMEOUT = config('DB_REPORT_STATEMENT_TIMEOUT', default=120000, cast=int)
+
+# Segundos que un cambio de cita tarda en contar para el cursor de changes/:
+# cubre transacciones que se confirman fuera del orden de sus ids.
+SCHEDULER_CHANGES_SETTLE_SECONDS = config('CHANGES_SETTLE_SECONDS', default=10, cast=int)
+
+
+# Caché compartida entre workers (horarios, servicios, doctores del scheduler).
+# CACHE_BACKEND: locmem (por defecto, por proceso), file o redis.
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': config('CACHE_URL', default='redis://127.0.0.1:6379/1'),
+            'KEY_PREFIX': 'smilecore',
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': config('CACHE_LOCATION', default=os.path.join(BASE_DIR, '.cache')),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
+# Métricas por petición (tiempo, consultas, tiempo en base de datos) y log
+# de consultas lentas. /metrics/ las expone en formato de Prometheus.
+SCHEDULER_METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+SCHEDULER_SLOW_QUERY_MS = config('SLOW_QUERY_MS', default=200, cast=int)
+# Incluir los valores de los parámetros en el log de consultas lentas. Traen
+# datos de pacientes: activarlo solo para depurar.
+SCHEDULER_SLOW_QUERY_LOG_PARAMS = config('SLOW_QUERY_LOG_PARAMS', default=False, cast=bool)
+SCHEDULER_METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'scheduler.metrics.JSONFormatter'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'json'},
+    },
+    'loggers': {
+        # Una línea por petición y por vista del scheduler
+        'scheduler.metrics': {
+            'handlers': ['console'],
+            'level': config('METRICS_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+        'scheduler.slow_queries': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+        # Depuración del scheduler: LOG_LEVEL=DEBUG
+        'scheduler': {'handlers': ['console'], 'level': config('LOG_LEVEL', default='INFO')},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -0,0 +1,38 @@
+"""Configuración de gunicorn.
+
+WSGI (workers síncronos, modo por defecto)::
+
+    gunicorn -c gunicorn.conf.py
+
+ASGI con workers de uvicorn, necesario para el stream SSE del calendario y
+para que las vistas asíncronas no ocupen un worker mientras esperan a la
+base de datos::
+
+    SERVER_MODE=asgi gunicorn -c gunicorn.conf.py
+
+Con ``SERVER_MODE=asgi`` los settings usan ``CONN_MAX_AGE=0`` sin importar
+la variable: las consultas asíncronas corren en hilos de Django y las
+conexiones persistentes no se reutilizan entre ellos.
+"""
+import multiprocessing
+import os
+
+
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi').lower()
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+accesslog = '-'
+
+if SERVER_MODE == 'asgi':
+    wsgi_app = 'appointments.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+    # Un worker asíncrono atiende muchas conexiones: menos procesos bastan
+    workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() + 1))
+    # Al reiniciar no esperar de más a que los streams SSE abiertos terminen
+    graceful_timeout = 10
+else:
+    wsgi_app = 'appointments.wsgi:application'
+    worker_class = 'sync'
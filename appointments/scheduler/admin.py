@@ -1,14 +1,31 @@
+from django.conf import settings
+from django import forms
 from django.contrib import admin
 from django.urls import path
 from django.template.response import TemplateResponse
-from django.http import JsonResponse
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.core.paginator import InvalidPage, Paginator
+from django.utils import timezone
+from django.db import IntegrityError, connection
+from django.db.models import Count, Max, Q
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
-from .models import Weekday, WorkingHour, Service, Doctor, Patient, Appointment, ClinicalHistory
+from asgiref.sync import sync_to_async
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import ACTIVE_STATUSES, Weekday, WorkingHour, Service, Doctor, Patient, Appointment, AppointmentChange, ClinicalHistory
+from . import cache, changes, engine, events, exports, metrics, pagination, postgres, pubsub, stats, streaming
+import asyncio
+import hashlib
 import json
+import logging
 from datetime import datetime, timedelta
 
+logger = logging.getLogger(__name__)
+
 @admin.register(Weekday)
 class WeekdayAdmin(admin.ModelAdmin):
     list_display = ('id', 'day', 'status')
@@ -20,11 +37,32 @@ class WeekdayAdmin(admin.ModelAdmin):
 class WorkingHourAdmin(admin.ModelAdmin):
     list_display = ('doctor', 'day', 'start_time', 'end_time')
     list_filter = ('doctor', 'day')
+    list_select_related = ('doctor', 'day')
     ordering = ['doctor', 'day', 'start_time']
 
 
+class ServiceForm(forms.ModelForm):
+    class Meta:
+        model = Service
+        fields = '__all__'
+
+    def clean_duration(self):
+        """Rechazar una duración que traslape citas activas futuras"""
+        duration = self.cleaned_data['duration']
+        if self.instance.pk and 'duration' in self.changed_data:
+            conflicts = engine.duration_conflicts(self.instance.pk, duration, timezone.now())
+            if conflicts:
+                ids = ', '.join(map(str, conflicts[:10]))
+                raise forms.ValidationError(
+                    f'Con esta duración {len(conflicts)} citas programadas se traslapan con otras (ids: {ids}). '
+                    'Reprograme esas citas o cree un servicio nuevo.'
+                )
+        return duration
+
+
 @admin.register(Service)
 class ServiceAdmin(admin.ModelAdmin):
+    form = ServiceForm
     list_display = ('name', 'duration', 'price')
     search_fields = ('name',)
     ordering = ['name']
@@ -33,28 +71,23 @@ class ServiceAdmin(admin.ModelAdmin):
 @admin.register(Doctor)
 class DoctorAdmin(admin.ModelAdmin):
     list_display = ('full_name', 'specialty', 'license_number', 'phone')
-    search_fields = ('user__username', 'user__first_name', 'user__last_name')
-
-    def full_name(self, obj):
-        return obj.user.get_full_name()
-    full_name.short_description = 'Name'
+    # Búsqueda sobre columnas propias (con índice trigram en PostgreSQL)
+    search_fields = ('full_name', 'specialty', '=license_number')
 
 
 @admin.register(Patient)
 class PatientAdmin(admin.ModelAdmin):
     list_display = ('full_name', 'date_of_birth', 'gender', 'phone')
-    search_fields = ('user__username', 'user__first_name', 'user__last_name')
-
-    def full_name(self, obj):
-        return obj.user.get_full_name()
-    full_name.short_description = 'Name'
+    search_fields = ('full_name', '^phone')
 
 
 @admin.register(ClinicalHistory)
 class ClinicalHistoryAdmin(admin.ModelAdmin):
     list_display = ('appointment', 'reason', 'follow_up_needed', 'created_at')
     list_filter = ('follow_up_needed',)
-    search_fields = ('appointment__patient__user__first_name', 'diagnosis')
+    # El __str__ de la cita usa paciente y doctor
+    list_select_related = ('appointment__patient', 'appointment__doctor')
+    search_fields = ('appointment__patient__full_name', 'diagnosis')
     ordering = ['-created_at']
 
 
@@ -62,159 +95,339 @@ class ClinicalHistoryAdmin(admin.ModelAdmin):
 class AppointmentAdmin(admin.ModelAdmin):
     list_display = ('date', 'time', 'patient', 'doctor', 'status')
     list_filter = ('status', 'doctor', 'date')
-    search_fields = ('patient__user__first_name', 'patient__user__last_name', 'doctor__user__first_name')
+    list_select_related = ('patient', 'doctor')
+    search_fields = ('patient__full_name', 'doctor__full_name')
+    actions = ['export_json', 'export_csv', 'export_jsonl']
+
+    # Sin COUNT(*) de la tabla completa en cada página: conteo acotado,
+    # sin facetas y paginación por llave (ver scheduler/pagination.py)
+    paginator = pagination.ApproximateCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
     
     # Sobrescribir el template de changelist
     change_list_template = 'admin/scheduler/appointment/change_list.html'
 
+    # Rango máximo (en días) para la búsqueda de horarios libres
+    slot_search_max_days = 62
+
+    # Segundos entre comentarios de keep-alive en el stream SSE
+    stream_heartbeat = 15
+
+    # Estados aceptados en el filtro ?status= de get-events/
+    event_statuses = {value for value, _ in Appointment._meta.get_field('status').choices} | set(ACTIVE_STATUSES)
+
+    # Resultados por página del autocompletado de doctores y pacientes
+    autocomplete_page_size = 10
+    autocomplete_max_pages = 5
+
     def get_urls(self):
         urls = super().get_urls()
         custom_urls = [
             path('check-availability/', self.check_availability_view, name='scheduler_appointment_check_availability'),
             path('create-appointment/', self.create_appointment_view, name='scheduler_appointment_create'),
             path('get-events/', self.get_events_view, name='scheduler_appointment_get_events'),  # Nueva URL
+            path('find-slots/', self.admin_site.admin_view(self.find_slots_view), name='scheduler_appointment_find_slots'),
+            path('create-series/', self.admin_site.admin_view(self.create_series_view), name='scheduler_appointment_create_series'),
+            path('autocomplete/', self.admin_site.admin_view(self.autocomplete_view), name='scheduler_appointment_autocomplete'),
+            path('changes/', self.admin_site.admin_view(self.get_changes_view), name='scheduler_appointment_changes'),
+            # Vista asíncrona: no pasa por admin_view (síncrono), valida al usuario ella misma
+            path('stream/', self.stream_view, name='scheduler_appointment_stream'),
+            path('cache-stats/', self.admin_site.admin_view(self.cache_stats_view), name='scheduler_appointment_cache_stats'),
+            path('report/', self.admin_site.admin_view(self.report_view), name='scheduler_appointment_report'),
         ]
         return custom_urls + urls
 
-    def get_events_view(self, request):
-        """Vista para obtener eventos del calendario"""
+    @metrics.instrument('get_events')
+    @postgres.interactive_timeout
+    async def get_events_view(self, request):
+        """Vista para obtener eventos del calendario.
+
+        Acepta los parámetros ``start`` y ``end`` que envía FullCalendar
+        (y opcionalmente ``doctor_id`` y ``status``) para devolver solo las
+        citas que se traslapan con el rango visible.
+        """
         try:
-            # Obtener todas las citas
-            appointments = Appointment.objects.select_related(
-                'patient__user', 'doctor__user', 'service'
-            ).all()
-            
-            events = []
-            print(f"Cargando {appointments.count()} eventos para el calendario")
-            
-            for appt in appointments:
-                try:
-                    # Formatear la fecha y hora a una única cadena ISO 8601
-                    start_iso = datetime.combine(appt.date, appt.time).isoformat()
-                    
-                    # Calcular duración y hora de fin
-                    duration = getattr(appt.service, 'duration', timedelta(minutes=30)) if hasattr(appt, 'service') and appt.service else timedelta(minutes=30)
-                    
-                    if not isinstance(duration, timedelta):
-                        # Asumir que es un entero y convertirlo
-                        duration = timedelta(minutes=duration)
-                    
-                    end_dt = datetime.combine(appt.date, appt.time) + duration
-                    end_iso = end_dt.isoformat()
-                    
-                    # Nombres completos
-                    patient_name = appt.patient.user.get_full_name() or appt.patient.user.username
-                    doctor_name = appt.doctor.user.get_full_name() or appt.doctor.user.username
-                    
-                    # Crear el evento con los campos 'start' y 'end' corregidos
-                    event = {
-                        'id': str(appt.id),
-                        'title': f"{patient_name} - {doctor_name}",  # Título más completo para el calendario
-                        'start': start_iso,
-                        'end': end_iso,
-                        'backgroundColor': self.get_status_color(appt.status),
-                        'borderColor': self.get_status_color(appt.status),
-                        'textColor': '#ffffff',
-                        'url': f"/admin/scheduler/appointment/{appt.id}/change/",
-                        'extendedProps': {
-                            'doctor': doctor_name,
-                            'patient': patient_name,
-                            'status': appt.status,
-                            'service': appt.service.name if appt.service else 'Consulta General',
-                            'time': appt.time.strftime('%H:%M')
-                        }
-                    }
-                    
-                    events.append(event)
-                    
-                except Exception as e:
-                    print(f"Error procesando cita {appt.id}: {e}")
-                    continue
+            range_start = self.parse_range_param(request.GET.get('start'))
+            range_end = self.parse_range_param(request.GET.get('end'))
+            if (request.GET.get('start') and not range_start) or (request.GET.get('end') and not range_end):
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Formato de rango inválido (start/end)',
+                    'events': []
+                }, status=400)
+
+            appointments = Appointment.objects.all()
+
+            # Citas que se traslapan con [start, end): un rango sobre
+            # starts_at/ends_at (FullCalendar es exclusivo al final)
+            if range_start and range_end:
+                appointments = engine.overlapping(appointments, range_start, range_end)
+            elif range_start:
+                appointments = appointments.filter(ends_at__gt=range_start)
+            elif range_end:
+                appointments = appointments.filter(starts_at__lt=range_end)
+            try:
+                doctor_id = int(request.GET['doctor_id']) if request.GET.get('doctor_id') else None
+            except ValueError:
+                doctor_id = None
+            statuses = request.GET['status'].split(',') if request.GET.get('status') else []
+            if (request.GET.get('doctor_id') and doctor_id is None) or not set(statuses) <= self.event_statuses:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Parámetros doctor_id/status inválidos',
+                    'events': []
+                }, status=400)
+            if doctor_id:
+                appointments = appointments.filter(doctor_id=doctor_id)
+            if statuses:
+                appointments = appointments.filter(status__in=statuses)
+
+            # Versión barata del rango y cursor de cambios, en paralelo. El
+            # cursor se lee antes que las citas para no perder cambios.
+            (etag, last_modified), cursor = await asyncio.gather(
+                self.get_schedule_version(request, appointments),
+                changes.asettled_cursor(),
+            )
+            # Si el rango no cambió, responder 304 sin serializar
+            not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if not_modified is not None:
+                return self.set_version_headers(not_modified, etag, last_modified)
+
+            # stream=1: mismo JSON escrito por bloques, con memoria constante
+            if request.GET.get('stream') == '1':
+                response = streaming.stream_queryset(
+                    request, events.event_rows(appointments), events.build_event,
+                    extra={'cursor': cursor}
+                )
+                return self.set_version_headers(response, etag, last_modified)
+
+            logger.debug("Cargando eventos para el calendario (%s - %s)", range_start, range_end)
+
+            # Solo las columnas del evento, sin hidratar modelos
+            feed = [events.build_event(row) async for row in events.event_rows(appointments)]
             
-            print(f"Eventos procesados: {len(events)}")
+            logger.debug("Eventos procesados: %s", len(feed))
             
-            return JsonResponse({
+            response = JsonResponse({
                 'success': True,
-                'events': events,
-                'count': len(events)
+                'events': feed,
+                'count': len(feed),
+                # Punto de partida para pedir cambios incrementales a changes/
+                'cursor': cursor
             })
+            return self.set_version_headers(response, etag, last_modified)
             
         except Exception as e:
-            print(f"Error en get_events_view: {e}")
+            logger.exception("Error en get_events_view")
             return JsonResponse({
                 'success': False,
                 'error': str(e),
                 'events': []
             }, status=500)
 
-    def changelist_view(self, request, extra_context=None):
-        # Obtener las citas para el template (fallback)
-        appointments = Appointment.objects.select_related('patient__user', 'doctor__user', 'service')
-        events = []
+    @admin.action(description='Exportar citas seleccionadas (JSON)')
+    @metrics.instrument('export_json')
+    @postgres.report_timeout
+    def export_json(self, request, queryset):
+        """Descargar las citas seleccionadas en streaming, sin cargarlas en memoria"""
+        rows = queryset.order_by('date', 'time', 'id').values(
+            'id', 'date', 'time', 'status', 'description',
+            'doctor_id', 'doctor__full_name', 'patient_id', 'patient__full_name',
+            'service__name', 'service__duration',
+        )
+        return streaming.stream_queryset(
+            request, rows, self.export_row, key='appointments',
+            filename=f"citas-{timezone.localdate():%Y%m%d}.json"
+        )
 
-        print(f"Total de citas encontradas para template: {appointments.count()}")
+    def export_row(self, row):
+        return {
+            'id': row['id'],
+            'date': row['date'],
+            'time': row['time'].strftime('%H:%M'),
+            'status': row['status'],
+            'doctor_id': row['doctor_id'],
+            'doctor': row['doctor__full_name'],
+            'patient_id': row['patient_id'],
+            'patient': row['patient__full_name'],
+            'service': row['service__name'],
+            'duration_minutes': int(row['service__duration'].total_seconds() // 60),
+            'description': row['description'],
+        }
 
-        for appt in appointments:
-            try:
-                start_dt = datetime.combine(appt.date, appt.time)
-                
-                # Obtener la duración del servicio o usar 30 minutos por defecto
-                duration = getattr(appt.service, 'duration', timedelta(minutes=30)) if hasattr(appt, 'service') and appt.service else timedelta(minutes=30)
-                
-                # Asegurar que `duration` es un objeto timedelta
-                if not isinstance(duration, timedelta):
-                    duration = timedelta(minutes=duration)
-                
-                end_dt = start_dt + duration
-                
-                patient_name = appt.patient.user.get_full_name() or appt.patient.user.username
-                doctor_name = appt.doctor.user.get_full_name() or appt.doctor.user.username
-
-                event = {
-                    'id': appt.id,
-                    'title': f"{patient_name}",
-                    'start': start_dt.isoformat(),
-                    'end': end_dt.isoformat(),
-                    'url': f"/admin/scheduler/appointment/{appt.id}/change/",
-                    'backgroundColor': '#417690',  # Azul, color de tus botones
-                    'borderColor': '#417690',
-                    'textColor': '#ffffff' if appt.status in ['scheduled', 'completed', 'cancelled'] else '#000000',
-                    'doctor': doctor_name,
-                    'patient': patient_name,
-                    'status': appt.status,
-                    'time': appt.time.strftime('%H:%M')
-                }
-                events.append(event)
-            except Exception as e:
-                print(f"Error procesando cita {appt.id}: {e}")
-
-        # Obtener doctores, pacientes y servicios para el formulario
-        doctors = Doctor.objects.select_related('user').all().order_by('user__first_name')
-        patients = Patient.objects.select_related('user').all().order_by('user__first_name')
-        services = Service.objects.all().order_by('name')
-        
-        # Convertir doctores a lista serializable para JSON
-        doctors_data = []
-        for doctor in doctors:
-            doctors_data.append({
-                'id': doctor.id,
-                'name': doctor.user.get_full_name() or doctor.user.username,
-                'specialty': getattr(doctor, 'specialty', '') or ''
-            })
+    @admin.action(description='Exportar citas e historiales (CSV)')
+    @metrics.instrument('export_csv')
+    @postgres.report_timeout
+    def export_csv(self, request, queryset):
+        """Citas seleccionadas con su historial clínico, en CSV y en streaming"""
+        return exports.export_response(request, queryset, 'csv')
+
+    @admin.action(description='Exportar citas e historiales (JSONL)')
+    @metrics.instrument('export_jsonl')
+    @postgres.report_timeout
+    def export_jsonl(self, request, queryset):
+        """Citas seleccionadas con su historial clínico, una por línea"""
+        return exports.export_response(request, queryset, 'jsonl')
+
+    @metrics.instrument('changes')
+    @postgres.interactive_timeout
+    def get_changes_view(self, request):
+        """Cambios de citas desde un cursor, para parchar el calendario.
+
+        Parámetros GET: ``since`` (cursor devuelto por get-events/ o por esta
+        misma vista) y ``limit``. Cada cita aparece una sola vez con su último
+        estado: ``deleted`` o ``created``/``updated`` con el evento completo.
+        Los cambios de los últimos segundos se repiten en la siguiente
+        consulta (ver ``changes.SETTLE_WINDOW``).
+        """
+        try:
+            since = int(request.GET.get('since', 0))
+            limit = max(1, min(int(request.GET.get('limit', 500)), 1000))
+        except ValueError:
+            return JsonResponse({
+                'success': False,
+                'error': 'Parámetros since/limit inválidos'
+            }, status=400)
+
+        rows, cursor, has_more = changes.changes_since(since, limit)
+
+        # Solo importa la última acción de cada cita
+        latest = {}
+        for change_id, appointment_id, action in rows:
+            latest.pop(appointment_id, None)
+            latest[appointment_id] = action
+
+        alive = [appt_id for appt_id, action in latest.items() if action != AppointmentChange.DELETED]
+        rows = {row['id']: row for row in events.event_rows(Appointment.objects.filter(id__in=alive))}
+
+        items = []
+        for appointment_id, action in latest.items():
+            row = rows.get(appointment_id)
+            if row is None:
+                items.append({'id': str(appointment_id), 'action': AppointmentChange.DELETED})
+            else:
+                items.append({'id': str(appointment_id), 'action': action, 'event': events.build_event(row)})
+
+        return JsonResponse({
+            'success': True,
+            'changes': items,
+            'cursor': cursor,
+            'has_more': has_more,
+        })
+
+    async def stream_view(self, request):
+        """Stream SSE con los cambios de agenda (``?doctor_id=`` para un solo doctor).
+
+        Cada mensaje trae el cursor del cambio; el calendario pide el detalle
+        a changes/. Requiere un servidor ASGI (ver ``appointments/asgi.py``):
+        cada conexión es una corrutina en espera, no un hilo.
+        """
+        user = await request.auser()
+        if not (user.is_active and user.is_staff):
+            return JsonResponse({'error': 'No autorizado'}, status=403)
+
+        if not isinstance(request, ASGIRequest):
+            return JsonResponse({'error': 'El stream requiere un servidor ASGI'}, status=501)
+
+        doctor_id = request.GET.get('doctor_id')
+        if doctor_id and not doctor_id.isdigit():
+            return JsonResponse({'error': 'doctor_id inválido'}, status=400)
+        channels = [pubsub.doctor_channel(doctor_id)] if doctor_id else [pubsub.CLINIC_CHANNEL]
+
+        response = StreamingHttpResponse(self.event_stream(channels), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Sin buffer en nginx
+        return response
+
+    async def event_stream(self, channels):
+        """Generador SSE: reenvía los mensajes del broker y manda keep-alives"""
+        queue = asyncio.Queue()
+
+        async def pump():
+            async for data in pubsub.get_broker().subscribe(channels):
+                await queue.put(data)
+
+        task = asyncio.create_task(pump())
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    data = await asyncio.wait_for(queue.get(), timeout=self.stream_heartbeat)
+                    yield f'event: change\ndata: {data}\n\n'
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+        finally:
+            task.cancel()
+
+    def cache_stats_view(self, request):
+        """Aciertos y fallos de la caché de referencia en este worker"""
+        return JsonResponse({
+            'success': True,
+            'backend': settings.CACHES['default']['BACKEND'],
+            'namespaces': cache.stats(),
+        })
+
+    @metrics.instrument('report')
+    @postgres.report_timeout
+    def report_view(self, request):
+        """Reporte por doctor y por servicio de un mes o un año.
+
+        Parámetros GET: ``year`` (por defecto el actual), ``month`` (sin él
+        se reporta el año completo, mes por mes), ``doctor_id`` y
+        ``format=json``. Lee solo las estadísticas diarias pre-agregadas.
+        """
+        today = timezone.localdate()
+        try:
+            year = int(request.GET.get('year') or today.year)
+            month = int(request.GET['month']) if request.GET.get('month') else None
+            doctor_id = int(request.GET['doctor_id']) if request.GET.get('doctor_id') else None
+            start, end = stats.period_range(year, month)
+        except ValueError:
+            return JsonResponse({
+                'success': False,
+                'error': 'Parámetros year/month/doctor_id inválidos'
+            }, status=400)
+
+        report = stats.report(start, end, doctor_id=doctor_id, by_month=month is None)
+        if request.GET.get('format') == 'json':
+            return JsonResponse({'success': True, **report})
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Reporte de citas',
+            'report': report,
+            'year': year,
+            'month': month,
+            'doctor_id': doctor_id,
+            'months': range(1, 13),
+            'doctors': cache.get_doctor_roster(),
+        }
+        return TemplateResponse(request, 'admin/scheduler/appointment/report.html', context)
+
+    def get_changelist(self, request, **kwargs):
+        return pagination.KeysetChangeList
+
+    def changelist_view(self, request, extra_context=None):
+        # Los eventos del calendario ya no se incrustan en la página: el
+        # calendario los pide por rango a get-events/ una sola vez.
+
+        # Doctores y pacientes se buscan con autocomplete/ mientras se escribe;
+        # solo los servicios (pocos) se incluyen en el formulario.
+        services = cache.get_services()
         
         extra_context = extra_context or {}
         extra_context.update({
-            'events': events,
-            'doctors': doctors,  # Para usar en el template HTML
-            'patients': patients,  # Para usar en el template HTML
             'services': services,  # Para usar en el template HTML
-            'doctors_data': doctors_data,  # Para serializar a JSON
         })
         
         return super().changelist_view(request, extra_context=extra_context)
 
     @method_decorator(csrf_exempt, name='dispatch')
-    def check_availability_view(self, request):
+    @metrics.instrument('check_availability')
+    @postgres.interactive_timeout
+    async def check_availability_view(self, request):
         """Verificar disponibilidad de una fecha y hora específica"""
         if request.method != 'POST':
             return JsonResponse({'error': 'Método no permitido'}, status=405)
@@ -225,7 +438,7 @@ class AppointmentAdmin(admin.ModelAdmin):
             time_str = data.get('time')
             doctor_id = data.get('doctor_id')
             
-            print(f"Verificando disponibilidad: {data}")  # Debug
+            logger.debug("Verificando disponibilidad: %s", data)
             
             # Validar que todos los campos estén presentes
             if not all([date_str, time_str, doctor_id]):
@@ -247,58 +460,42 @@ class AppointmentAdmin(admin.ModelAdmin):
             appointment_datetime = datetime.combine(appointment_date, appointment_time)
             
             # Validar que no sea una fecha/hora pasada
-            if appointment_datetime <= datetime.now():
+            if engine.to_aware(appointment_datetime) <= timezone.now():
                 return JsonResponse({
                     'available': False,
                     'message': 'No se pueden crear citas en fechas y horas pasadas'
                 })
             
-            # Verificar si el doctor existe
-            try:
-                doctor = Doctor.objects.get(id=doctor_id)
-            except Doctor.DoesNotExist:
+            # Doctor y servicio se buscan en paralelo; la duración del
+            # servicio define el intervalo a verificar
+            if data.get('service_id'):
+                service_lookup = sync_to_async(cache.get_service)(data['service_id'])
+            else:
+                service_lookup = sync_to_async(engine.default_service)()
+            doctor, service = await asyncio.gather(
+                self.get_or_none(Doctor.objects.select_related('user'), id=doctor_id),
+                service_lookup,
+            )
+            if not doctor:
                 return JsonResponse({
                     'available': False,
                     'message': 'Doctor no encontrado'
                 }, status=400)
-            
-            # Verificar si ya existe una cita en esa fecha/hora para ese doctor
-            existing_appointment = Appointment.objects.filter(
-                date=appointment_date,
-                time=appointment_time,
-                doctor_id=doctor_id,
-                status__in=['scheduled', 'pending']  # Solo citas activas
-            ).exists()
-            
-            if existing_appointment:
+            if data.get('service_id') and not service:
                 return JsonResponse({
                     'available': False,
-                    'message': 'Ya hay una cita programada en este horario para este doctor'
-                })
-            
-            # Verificar horario de trabajo del doctor
-            weekday = appointment_date.weekday() + 1  # Django usa 1-7, Python 0-6
-            
-            # Verificar si el día está habilitado
-            day_enabled = Weekday.objects.filter(id=weekday, status=True).exists()
-            if not day_enabled:
-                return JsonResponse({
-                    'available': False,
-                    'message': 'El día seleccionado no está habilitado para citas'
-                })
-            
-            # Verificar horario de trabajo específico del doctor
-            working_hour = WorkingHour.objects.filter(
-                doctor_id=doctor_id,
-                day_id=weekday,
-                start_time__lte=appointment_time,
-                end_time__gte=appointment_time
-            ).exists()
-            
-            if not working_hour:
+                    'message': 'Servicio no encontrado'
+                }, status=400)
+            duration = service.duration if service else engine.DEFAULT_DURATION
+
+            availability = await sync_to_async(engine.check_availability)(
+                doctor.id, appointment_date, appointment_time, duration
+            )
+            if not availability:
                 return JsonResponse({
                     'available': False,
-                    'message': f'El Dr. {doctor.user.get_full_name()} no tiene horario de trabajo en esta fecha y hora'
+                    'reason': availability.reason,
+                    'message': self.get_availability_message(availability, doctor)
                 })
             
             return JsonResponse({
@@ -312,21 +509,27 @@ class AppointmentAdmin(admin.ModelAdmin):
                 'message': 'Datos JSON inválidos'
             }, status=400)
         except Exception as e:
-            print(f"Error en check_availability: {e}")
+            logger.exception("Error en check_availability")
             return JsonResponse({
                 'available': False,
                 'message': 'Error interno del servidor'
             }, status=500)
 
     @method_decorator(csrf_exempt, name='dispatch')  
-    def create_appointment_view(self, request):
-        """Crear una nueva cita"""
+    @metrics.instrument('create_appointment')
+    @postgres.interactive_timeout
+    async def create_appointment_view(self, request):
+        """Crear una nueva cita.
+
+        Si el horario ya está ocupado responde 409 con ``conflict: true``;
+        el cliente puede buscar otro horario y reintentar.
+        """
         if request.method != 'POST':
             return JsonResponse({'error': 'Método no permitido'}, status=405)
 
         try:
             data = json.loads(request.body)
-            print(f"Datos recibidos para crear cita: {data}")  # Debug
+            logger.debug("Datos recibidos para crear cita: %s", data)
             
             # Validar datos requeridos
             required_fields = ['date', 'time', 'doctor_id', 'patient_id']
@@ -350,91 +553,66 @@ class AppointmentAdmin(admin.ModelAdmin):
             appointment_datetime = datetime.combine(appointment_date, appointment_time)
             
             # Validar que no sea una fecha/hora pasada
-            if appointment_datetime <= datetime.now():
+            if engine.to_aware(appointment_datetime) <= timezone.now():
                 return JsonResponse({
                     'success': False,
                     'error': 'No se pueden crear citas en fechas y horas pasadas'
                 }, status=400)
             
-            # Verificar que el doctor existe
-            try:
-                doctor = Doctor.objects.get(id=data['doctor_id'])
-            except Doctor.DoesNotExist:
+            # Doctor y paciente son independientes: buscarlos en paralelo
+            doctor, patient = await asyncio.gather(
+                self.get_or_none(Doctor.objects.select_related('user'), id=data['doctor_id']),
+                self.get_or_none(Patient.objects.select_related('user'), id=data['patient_id']),
+            )
+            if not doctor:
                 return JsonResponse({
                     'success': False,
                     'error': 'Doctor no encontrado'
                 }, status=400)
-            
-            # Verificar que el paciente existe
-            try:
-                patient = Patient.objects.get(id=data['patient_id'])
-            except Patient.DoesNotExist:
+            if not patient:
                 return JsonResponse({
                     'success': False,
                     'error': 'Paciente no encontrado'
                 }, status=400)
-            
-            # Obtener o asignar un servicio
-            service = None
+
+            # El servicio va después: sin servicio se crea uno genérico y una
+            # petición con doctor o paciente inválido no debe escribir nada
             if data.get('service_id'):
-                try:
-                    service = Service.objects.get(id=data['service_id'])
-                except Service.DoesNotExist:
-                    return JsonResponse({
-                        'success': False,
-                        'error': 'Servicio no encontrado'
-                    }, status=400)
+                service = await sync_to_async(cache.get_service)(data['service_id'])
             else:
-                # Asignar un servicio por defecto o crear uno genérico
-                service = Service.objects.first()
-                if not service:
-                    # Si no hay servicios, crear uno genérico
-                    service = Service.objects.create(
-                        name='Consulta General',
-                        duration=30,
-                        price=0.00
-                    )
-            
-            # Verificar disponibilidad nuevamente antes de crear
-            existing = Appointment.objects.filter(
-                date=appointment_date,
-                time=appointment_time,
-                doctor_id=data['doctor_id'],
-                status__in=['scheduled', 'pending']
-            ).exists()
-            
-            if existing:
+                service = await sync_to_async(engine.default_service)(create=True)
+            if not service:
                 return JsonResponse({
                     'success': False,
-                    'error': 'Ya existe una cita en este horario'
+                    'error': 'Servicio no encontrado'
                 }, status=400)
             
-            # Verificar horario de trabajo
-            weekday = appointment_date.weekday() + 1
-            working_hour = WorkingHour.objects.filter(
-                doctor_id=data['doctor_id'],
-                day_id=weekday,
-                start_time__lte=appointment_time,
-                end_time__gte=appointment_time
-            ).exists()
-            
-            if not working_hour:
+            # Verificar y crear en una sola transacción con bloqueo por doctor.
+            # Las transacciones no existen en el ORM asíncrono: la reserva
+            # corre completa en el hilo de base de datos.
+            try:
+                appointment = await sync_to_async(engine.book_appointment)(
+                    doctor, patient, service, appointment_date, appointment_time,
+                    description=data.get('description', '')
+                )
+            except engine.SlotUnavailable as e:
+                # 409: otra cita ocupa el horario; la UI puede elegir otro y reintentar
+                return JsonResponse({
+                    'success': False,
+                    'conflict': e.conflict,
+                    'reason': e.availability.reason,
+                    'error': self.get_availability_message(e.availability, doctor)
+                }, status=409 if e.conflict else 400)
+            except IntegrityError:
+                # No es un traslape: el doctor, paciente o servicio se borró
+                # entre la validación y la inserción
+                logger.warning("Cita no creada por una restricción distinta al traslape", exc_info=True)
                 return JsonResponse({
                     'success': False,
-                    'error': 'El doctor no tiene horario de trabajo en esta fecha y hora'
+                    'error': 'No se pudo crear la cita: el doctor, paciente o servicio ya no existe'
                 }, status=400)
             
-            # Crear la cita CON el servicio
-            appointment = Appointment.objects.create(
-                date=appointment_date,
-                time=appointment_time,
-                doctor=doctor,
-                patient=patient,
-                service=service,  # Importante: incluir el servicio
-                status='scheduled'
-            )
-            
-            print(f"Cita creada exitosamente: ID {appointment.id}")  # Debug
+            logger.debug("Cita creada exitosamente: ID %s", appointment.id)
             
             return JsonResponse({
                 'success': True,
@@ -456,23 +634,352 @@ class AppointmentAdmin(admin.ModelAdmin):
                 'error': 'Datos JSON inválidos'
             }, status=400)
         except Exception as e:
-            print(f"Error en create_appointment: {e}")
+            logger.exception("Error en create_appointment")
             return JsonResponse({
                 'success': False,
                 'error': f'Error interno del servidor: {str(e)}'
             }, status=500)
 
-    def get_status_color(self, status):
-        """Obtener color según el estado de la cita"""
-        status_colors = {
-            'scheduled': '#007bff',    # Azul para programadas
-            'completed': '#28a745',    # Verde para completadas
-            'cancelled': '#dc3545',    # Rojo para canceladas
-            'pending': '#ffc107',      # Amarillo para pendientes
-            'in_progress': '#17a2b8',  # Cian para en progreso
-            'no_show': '#6c757d',      # Gris para no presentados
-        }
-        return status_colors.get(status, '#6c757d')
+    @metrics.instrument('autocomplete')
+    @postgres.interactive_timeout
+    def autocomplete_view(self, request):
+        """Buscar pacientes o doctores mientras se escribe.
+
+        Parámetros GET: ``model`` (``patient`` o ``doctor``), ``q`` (al menos
+        dos caracteres) y ``page``. Regresa pocos resultados por página y
+        nunca cuenta la tabla completa.
+        """
+        term = request.GET.get('q', '').strip()
+        model = request.GET.get('model', 'patient')
+        try:
+            page = max(1, min(int(request.GET.get('page', 1)), self.autocomplete_max_pages))
+        except ValueError:
+            page = 1
+
+        if len(term) < 2:
+            return JsonResponse({'results': [], 'page': page, 'has_more': False})
+
+        # En PostgreSQL icontains usa el índice trigram; en otros motores la
+        # búsqueda por prefijo es la que puede aprovechar el orden del índice.
+        name_lookup = 'icontains' if connection.vendor == 'postgresql' else 'istartswith'
+        if model == 'doctor':
+            queryset = Doctor.objects.filter(
+                Q(**{f'full_name__{name_lookup}': term}) | Q(**{f'specialty__{name_lookup}': term})
+            ).values_list('id', 'full_name', 'specialty')
+        elif model == 'patient':
+            queryset = Patient.objects.filter(
+                Q(**{f'full_name__{name_lookup}': term}) | Q(phone__startswith=term)
+            ).values_list('id', 'full_name', 'phone')
+        else:
+            return JsonResponse({'error': 'Modelo inválido'}, status=400)
+
+        offset = (page - 1) * self.autocomplete_page_size
+        rows = list(queryset.order_by('full_name', 'id')[offset:offset + self.autocomplete_page_size + 1])
+        has_more = len(rows) > self.autocomplete_page_size and page < self.autocomplete_max_pages
+
+        results = []
+        for obj_id, name, detail in rows[:self.autocomplete_page_size]:
+            if model == 'doctor':
+                text = f"Dr. {name} - {detail}"
+            else:
+                text = f"{name} ({detail})" if detail else name
+            results.append({'id': obj_id, 'text': text})
+
+        return JsonResponse({'results': results, 'page': page, 'has_more': has_more})
+
+    @metrics.instrument('find_slots')
+    @postgres.interactive_timeout
+    def find_slots_view(self, request):
+        """Buscar los próximos horarios libres por doctor (o especialidad) y servicio.
+
+        Parámetros GET: ``doctor_id`` o ``specialty``, ``service_id``,
+        ``start``/``end`` (fechas, por defecto hoy y 30 días después),
+        ``step`` (minutos entre horarios), ``page`` y ``page_size``. Una
+        página fuera de rango responde 400 con ``num_pages``.
+        """
+        start_date = parse_date(request.GET.get('start', '')) or timezone.localdate()
+        end_date = parse_date(request.GET.get('end', '')) or start_date + timedelta(days=30)
+        if end_date < start_date or (end_date - start_date).days > self.slot_search_max_days:
+            return JsonResponse({
+                'success': False,
+                'error': f'Rango de fechas inválido (máximo {self.slot_search_max_days} días)'
+            }, status=400)
+
+        roster = cache.get_doctor_roster()
+        if request.GET.get('doctor_id'):
+            doctor_names = {doctor_id: name for doctor_id, name, _ in roster if str(doctor_id) == request.GET['doctor_id']}
+        elif request.GET.get('specialty'):
+            specialty = request.GET['specialty'].casefold()
+            doctor_names = {doctor_id: name for doctor_id, name, spec in roster if spec.casefold() == specialty}
+        else:
+            return JsonResponse({
+                'success': False,
+                'error': 'Indique un doctor o una especialidad'
+            }, status=400)
+
+        if request.GET.get('service_id'):
+            service = cache.get_service(request.GET['service_id'])
+            if not service:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Servicio no encontrado'
+                }, status=400)
+        else:
+            service = engine.default_service()
+        duration = service.duration if service else engine.DEFAULT_DURATION
+
+        try:
+            step = timedelta(minutes=int(request.GET['step'])) if request.GET.get('step') else None
+            page_size = min(int(request.GET.get('page_size', 20)), 100)
+        except ValueError:
+            return JsonResponse({
+                'success': False,
+                'error': 'Parámetros step/page_size inválidos'
+            }, status=400)
+        if (step is not None and step <= timedelta(0)) or page_size <= 0:
+            return JsonResponse({
+                'success': False,
+                'error': 'Parámetros step/page_size inválidos'
+            }, status=400)
+
+        slots = engine.find_free_slots(
+            doctor_names.keys(), start_date, end_date, duration,
+            step=step,
+            not_before=timezone.localtime().replace(tzinfo=None),
+        )
+        paginator = Paginator(slots, page_size)
+        try:
+            page = paginator.page(request.GET.get('page') or 1)
+        except InvalidPage:
+            # Sin ajustar en silencio a otra página: el cliente la pidió mal
+            return JsonResponse({
+                'success': False,
+                'error': f'Página inválida (hay {paginator.num_pages})',
+                'num_pages': paginator.num_pages,
+            }, status=400)
+
+        return JsonResponse({
+            'success': True,
+            'slots': [{
+                'doctor_id': doctor_id,
+                'doctor': doctor_names[doctor_id],
+                'date': slot_start.date().isoformat(),
+                'time': slot_start.strftime('%H:%M'),
+                'end': slot_end.strftime('%H:%M'),
+            } for doctor_id, slot_start, slot_end in page],
+            'service': service.name if service else None,
+            'page': page.number,
+            'num_pages': page.paginator.num_pages,
+            'count': page.paginator.count,
+            'has_next': page.has_next(),
+        })
+
+    @metrics.instrument('create_series')
+    @postgres.interactive_timeout
+    def create_series_view(self, request):
+        """Crear varias citas (lista explícita o serie recurrente) en una sola operación.
+
+        Cuerpo JSON: ``doctor_id``, ``patient_id``, ``service_id`` (opcional),
+        ``skip_conflicts`` (opcional) y además:
+
+        * ``occurrences``: lista de ``{"date": "YYYY-MM-DD", "time": "HH:MM"}``, o
+        * ``time`` y ``recurrence``: ``{"start", "until", "interval" (semanas),
+          "weekdays" (1-7), "count"}``.
+
+        Sin ``skip_conflicts`` no se crea nada si alguna ocurrencia choca y se
+        responde 409. La respuesta reporta el resultado de cada ocurrencia.
+        """
+        if request.method != 'POST':
+            return JsonResponse({'error': 'Método no permitido'}, status=405)
+
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            data = None
+        if not isinstance(data, dict):
+            return JsonResponse({
+                'success': False,
+                'error': 'Datos JSON inválidos'
+            }, status=400)
+
+        for field in ['doctor_id', 'patient_id']:
+            if not data.get(field):
+                return JsonResponse({
+                    'success': False,
+                    'error': f'Campo requerido faltante: {field}'
+                }, status=400)
+
+        try:
+            if data.get('occurrences'):
+                occurrences = [
+                    (datetime.strptime(item['date'], '%Y-%m-%d').date(),
+                     datetime.strptime(item['time'], '%H:%M').time())
+                    for item in data['occurrences']
+                ]
+            elif data.get('recurrence') and data.get('time'):
+                recurrence = data['recurrence']
+                start_time = datetime.strptime(data['time'], '%H:%M').time()
+                dates = engine.expand_weekly_recurrence(
+                    datetime.strptime(recurrence['start'], '%Y-%m-%d').date(),
+                    datetime.strptime(recurrence['until'], '%Y-%m-%d').date(),
+                    interval=int(recurrence.get('interval', 1)),
+                    weekdays=[int(day) for day in recurrence.get('weekdays') or []],
+                    count=recurrence.get('count') and int(recurrence['count']),
+                )
+                occurrences = [(day, start_time) for day in dates]
+            else:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Indique occurrences o time + recurrence'
+                }, status=400)
+        except (KeyError, TypeError, ValueError) as e:
+            return JsonResponse({
+                'success': False,
+                'error': f'Serie inválida: {str(e)}'
+            }, status=400)
+
+        if not occurrences or len(occurrences) > engine.MAX_SERIES_LENGTH:
+            return JsonResponse({
+                'success': False,
+                'error': f'La serie debe tener entre 1 y {engine.MAX_SERIES_LENGTH} citas'
+            }, status=400)
+
+        doctor = Doctor.objects.select_related('user').filter(id=data['doctor_id']).first()
+        patient = Patient.objects.filter(id=data['patient_id']).first()
+        if data.get('service_id'):
+            service = cache.get_service(data['service_id'])
+        else:
+            service = engine.default_service(create=True)
+        if not (doctor and patient and service):
+            return JsonResponse({
+                'success': False,
+                'error': 'Doctor, paciente o servicio no encontrado'
+            }, status=400)
+
+        try:
+            created, results = engine.book_series(
+                doctor, patient, service, occurrences,
+                skip_conflicts=bool(data.get('skip_conflicts')),
+                description=data.get('description', ''),
+                not_before=timezone.localtime().replace(tzinfo=None),
+            )
+        except engine.SlotUnavailable as e:
+            return JsonResponse({
+                'success': False,
+                'conflict': True,
+                'error': self.get_availability_message(e.availability, doctor)
+            }, status=409)
+        except IntegrityError:
+            logger.warning("Serie no creada por una restricción distinta al traslape", exc_info=True)
+            return JsonResponse({
+                'success': False,
+                'error': 'No se pudo crear la serie: el doctor, paciente o servicio ya no existe'
+            }, status=400)
+
+        created_ids = {(appt.date, appt.time): appt.id for appt in created}
+        report = []
+        for day, start_time, availability in results:
+            item = {
+                'date': day.strftime('%Y-%m-%d'),
+                'time': start_time.strftime('%H:%M'),
+                'appointment_id': created_ids.get((day, start_time)),
+            }
+            if (day, start_time) in created_ids:
+                item['status'] = 'created'
+            elif availability:
+                # Disponible, pero la serie no se creó por los demás choques
+                item['status'] = 'available'
+            else:
+                item['status'] = 'conflict'
+                item['reason'] = availability.reason
+                item['message'] = self.get_availability_message(availability, doctor)
+            report.append(item)
+
+        conflicts = sum(1 for _, _, availability in results if not availability)
+        return JsonResponse({
+            'success': bool(created) or not conflicts,
+            'created': len(created),
+            'conflicts': conflicts,
+            'occurrences': report,
+        }, status=409 if conflicts and not created else 200)
+
+    def get_availability_message(self, availability, doctor):
+        """Mensaje para el usuario según el motivo de no disponibilidad"""
+        doctor_name = doctor.user.get_full_name() or doctor.user.username
+        if availability.reason == engine.Availability.PAST:
+            return 'No se pueden crear citas en fechas y horas pasadas'
+        if availability.reason == engine.Availability.DAY_DISABLED:
+            return 'El día seleccionado no está habilitado para citas'
+        if availability.reason == engine.Availability.OUTSIDE_WORKING_HOURS:
+            return f'El Dr. {doctor_name} no tiene horario de trabajo que cubra toda la cita'
+        if availability.reason == engine.Availability.OVERLAP:
+            if not availability.conflicts:
+                return 'Otra recepción acaba de reservar este horario, elija otro'
+            _, start, end = availability.conflicts[0]
+            return (
+                f'Ya hay una cita programada de {start:%H:%M} a {end:%H:%M} '
+                f'que se traslapa con este horario para este doctor'
+            )
+        return 'Horario no disponible'
+
+    async def get_or_none(self, queryset, **lookup):
+        """``aget`` que regresa None si el objeto no existe"""
+        try:
+            return await queryset.aget(**lookup)
+        except ObjectDoesNotExist:
+            return None
+
+    async def get_schedule_version(self, request, appointments):
+        """ETag y Last-Modified de un rango del calendario.
+
+        Se calculan con una agregación (última modificación y número de citas
+        del rango, más la última modificación de sus pacientes y doctores) y
+        los nombres de los servicios: cambian con altas, ediciones y bajas de
+        citas y también al renombrar a alguien que aparece en los eventos.
+        """
+        version, services = await asyncio.gather(
+            appointments.order_by().aaggregate(
+                last=Max('updated_at'), total=Count('id'),
+                patients=Max('patient__updated_at'), doctors=Max('doctor__updated_at'),
+            ),
+            sync_to_async(list)(Service.objects.order_by('id').values_list('id', 'name')),
+        )
+        stamps = [version[key] for key in ('last', 'patients', 'doctors')]
+        raw = '|'.join([
+            request.GET.urlencode(),
+            *(stamp.isoformat() if stamp else '' for stamp in stamps),
+            str(version['total']),
+            repr(services),
+        ])
+        etag = '"%s"' % hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()
+        last = max((stamp for stamp in stamps if stamp), default=None)
+        last_modified = int(last.timestamp()) if last else None
+        return etag, last_modified
+
+    def set_version_headers(self, response, etag, last_modified):
+        """Agregar validadores y obligar al navegador a revalidar"""
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def parse_range_param(self, value):
+        """Convertir un parámetro de rango (fecha o fecha-hora ISO) a datetime con zona"""
+        if not value:
+            return None
+        # Los '+' del offset llegan como espacios si no vienen codificados
+        value = value.strip().replace(' ', '+')
+        parsed = parse_datetime(value)
+        if parsed is None:
+            parsed_date = parse_date(value)
+            if parsed_date is None:
+                return None
+            parsed = datetime.combine(parsed_date, datetime.min.time())
+        # Sin offset se interpreta en la hora de la clínica
+        if timezone.is_naive(parsed):
+            parsed = engine.to_aware(parsed)
+        return parsed
 
     def has_add_permission(self, request):
         """Permitir agregar citas"""
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class SchedulerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'scheduler'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import metrics, signals  # noqa: F401
+        from .postgres import install_postgres_extras
+
+        # Primero los intervalos: la restricción de PostgreSQL los necesita
+        post_migrate.connect(signals.fill_missing_intervals, sender=self)
+        post_migrate.connect(install_postgres_extras, sender=self)
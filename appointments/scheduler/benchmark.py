@@ -0,0 +1,34 @@
+"""Resumen común de las pruebas de carga y benchmarks (``loadtest``, ``run_benchmarks``)."""
+
+
+def percentile(sorted_values, p):
+    """Percentil ``p`` (0-100) de una lista ya ordenada, por rango más cercano"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(results, elapsed):
+    """Resumir ``[(status, segundos), ...]`` medidos en ``elapsed`` segundos"""
+    latencies = sorted(latency for _, latency in results)
+    statuses = {}
+    for status, _ in results:
+        key = str(status) if status else 'error'
+        statuses[key] = statuses.get(key, 0) + 1
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        'requests': len(results),
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(len(results) / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1] if latencies else None),
+        },
+        'status': statuses,
+    }
@@ -0,0 +1,305 @@
+"""Caché de datos de referencia del scheduler.
+
+Horarios laborales, días habilitados, servicios y la lista de doctores
+cambian muy poco, así que se guardan en dos niveles (cache-aside):
+
+* un LRU en memoria del proceso, sin I/O en el caso común;
+* el backend de caché de Django (``CACHES``: locmem, archivo o Redis),
+  compartido entre workers.
+
+Cada tipo de dato vive en un espacio de nombres con su propio TTL y su
+generación: invalidar un espacio incrementa la generación y deja huérfanas
+todas sus llaves. Cada entrada del LRU local guarda la generación con la que
+se leyó y solo se usa si sigue siendo la del backend compartido (una lectura
+de una llave pequeña), así una invalidación hecha en otro worker se ve en la
+siguiente consulta. Con ``locmem`` el backend es por proceso y no hay forma
+de enterarse: con varios workers use ``file`` o ``redis``.
+
+``stats()`` reporta aciertos por nivel y fallos de cada espacio (por proceso).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Doctor, Service, Weekday, WorkingHour
+
+
+# Espacios de nombres
+SCHEDULES = 'schedule'
+WEEKDAYS = 'weekdays'
+SERVICES = 'services'
+DOCTORS = 'doctors'
+
+TTLS = {
+    SCHEDULES: getattr(settings, 'SCHEDULER_SCHEDULE_CACHE_TTL', 60 * 60 * 24),
+    WEEKDAYS: 60 * 60 * 24,
+    SERVICES: 60 * 60,
+    DOCTORS: 60 * 60,
+    **getattr(settings, 'SCHEDULER_CACHE_TTLS', {}),
+}
+LOCAL_TTL = getattr(settings, 'SCHEDULER_SCHEDULE_LOCAL_TTL', 60)
+LOCAL_SIZE = getattr(settings, 'SCHEDULER_SCHEDULE_LOCAL_SIZE', 1024)
+
+KEY_PREFIX = 'scheduler'
+
+
+class LRUCache:
+    """LRU en memoria con TTL por entrada, seguro entre hilos"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self, namespace=None):
+        """Vaciar todo o solo las llaves ``(namespace, ...)``"""
+        with self._lock:
+            if namespace is None:
+                self._data.clear()
+            else:
+                for key in [key for key in self._data if key[0] == namespace]:
+                    del self._data[key]
+
+
+class CacheStats:
+    """Contadores de aciertos (local/compartido) y fallos por espacio"""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, namespace, outcome, count=1):
+        with self._lock:
+            counts = self._counts.setdefault(namespace, {'local': 0, 'shared': 0, 'miss': 0})
+            counts[outcome] += count
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for namespace, counts in self._counts.items():
+                total = sum(counts.values())
+                hits = counts['local'] + counts['shared']
+                result[namespace] = {**counts, 'hit_rate': round(hits / total, 4) if total else None}
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+_local = LRUCache(LOCAL_SIZE, LOCAL_TTL)
+_stats = CacheStats()
+
+
+def stats():
+    """Aciertos y fallos de este proceso: ``{espacio: {local, shared, miss, hit_rate}}``"""
+    return _stats.snapshot()
+
+
+def reset_stats():
+    _stats.reset()
+
+
+def _generation_key(namespace):
+    return f'{KEY_PREFIX}:{namespace}:generation'
+
+
+def _generation(namespace):
+    """Generación del espacio; cambiarla invalida todas sus llaves"""
+    key = _generation_key(namespace)
+    generation = cache.get(key)
+    if generation is None:
+        generation = 1
+        cache.add(key, generation, None)
+    return generation
+
+
+def make_key(namespace, *parts, generation=None):
+    """Llave compartida ``scheduler:<espacio>:<generación>:<partes>``"""
+    if generation is None:
+        generation = _generation(namespace)
+    return ':'.join([KEY_PREFIX, namespace, str(generation), *map(str, parts)])
+
+
+def _local_get(key, generation):
+    """Valor del LRU local si se leyó en la generación vigente, o None"""
+    item = _local.get(key)
+    if item is not None and item[0] == generation:
+        return item[1]
+    return None
+
+
+def get_or_load(namespace, parts, loader):
+    """Leer ``(namespace, *parts)`` de la caché o cargarlo con ``loader()``"""
+    local_key = (namespace, *parts)
+    generation = _generation(namespace)
+    value = _local_get(local_key, generation)
+    if value is not None:
+        _stats.record(namespace, 'local')
+        return value
+
+    key = make_key(namespace, *parts, generation=generation)
+    value = cache.get(key)
+    if value is None:
+        _stats.record(namespace, 'miss')
+        value = loader()
+        cache.set(key, value, TTLS[namespace])
+    else:
+        _stats.record(namespace, 'shared')
+    _local.set(local_key, (generation, value))
+    return value
+
+
+def invalidate(namespace):
+    """Descartar todo un espacio de nombres en ambos niveles"""
+    _local.clear(namespace)
+    try:
+        cache.incr(_generation_key(namespace))
+    except ValueError:
+        cache.set(_generation_key(namespace), 2, None)
+
+
+# ─────────────────────────────
+#   Horarios y días habilitados
+# ─────────────────────────────
+
+def load_schedules(doctor_ids):
+    """Leer de la base los horarios de varios doctores en una consulta.
+
+    Regresa ``{doctor_id: {weekday_id: ((inicio, fin), ...)}}`` solo con los
+    días habilitados y los bloques ordenados por inicio.
+    """
+    schedules = {doctor_id: {} for doctor_id in doctor_ids}
+    for doctor_id, day_id, start_time, end_time in WorkingHour.objects.filter(
+        doctor_id__in=doctor_ids,
+        day__status=True,
+    ).order_by('start_time').values_list('doctor_id', 'day_id', 'start_time', 'end_time'):
+        schedules[doctor_id].setdefault(day_id, []).append((start_time, end_time))
+    return {
+        doctor_id: {day_id: tuple(blocks) for day_id, blocks in days.items()}
+        for doctor_id, days in schedules.items()
+    }
+
+
+def get_schedules(doctor_ids):
+    """Horarios semanales de varios doctores, leyendo de la caché cuando se puede"""
+    generation = _generation(SCHEDULES)
+    schedules = {}
+    missing = []
+    for doctor_id in doctor_ids:
+        schedule = _local_get((SCHEDULES, doctor_id), generation)
+        if schedule is None:
+            missing.append(doctor_id)
+        else:
+            schedules[doctor_id] = schedule
+    _stats.record(SCHEDULES, 'local', len(schedules))
+    if not missing:
+        return schedules
+
+    keys = {make_key(SCHEDULES, doctor_id, generation=generation): doctor_id for doctor_id in missing}
+    shared = cache.get_many(list(keys))
+    _stats.record(SCHEDULES, 'shared', len(shared))
+    for key, schedule in shared.items():
+        schedules[keys[key]] = schedule
+        _local.set((SCHEDULES, keys[key]), (generation, schedule))
+
+    to_load = [doctor_id for doctor_id in missing if doctor_id not in schedules]
+    if to_load:
+        _stats.record(SCHEDULES, 'miss', len(to_load))
+        loaded = load_schedules(to_load)
+        cache.set_many({
+            make_key(SCHEDULES, doctor_id, generation=generation): schedule
+            for doctor_id, schedule in loaded.items()
+        }, TTLS[SCHEDULES])
+        for doctor_id, schedule in loaded.items():
+            _local.set((SCHEDULES, doctor_id), (generation, schedule))
+        schedules.update(loaded)
+    return schedules
+
+
+def get_schedule(doctor_id):
+    """Horario semanal de un doctor: ``{weekday_id: ((inicio, fin), ...)}``"""
+    return get_schedules([doctor_id])[doctor_id]
+
+
+def working_blocks(doctor_id, weekday_id):
+    """Bloques laborales ordenados de un doctor para un día de la semana"""
+    return get_schedule(doctor_id).get(weekday_id, ())
+
+
+def active_weekdays():
+    """Ids de los días de la semana habilitados para citas"""
+    return get_or_load(WEEKDAYS, (), lambda: frozenset(
+        Weekday.objects.filter(status=True).values_list('id', flat=True)
+    ))
+
+
+def invalidate_schedule(doctor_id):
+    """Descartar el horario en caché de un doctor.
+
+    Borrar solo su llave compartida no alcanzaría al LRU de los demás
+    workers: se cambia la generación de todos los horarios, que se recargan
+    en una consulta (los cambios de horario son raros).
+    """
+    invalidate(SCHEDULES)
+
+
+def invalidate_all_schedules():
+    """Descartar todos los horarios y días (por ejemplo al cambiar un ``Weekday``)"""
+    invalidate(SCHEDULES)
+    invalidate(WEEKDAYS)
+
+
+# ─────────────────────────────
+#   Servicios y doctores
+# ─────────────────────────────
+
+def get_services():
+    """Servicios ordenados por nombre (instancias de ``Service``)"""
+    return get_or_load(SERVICES, ('all',), lambda: tuple(Service.objects.order_by('name')))
+
+
+def get_service(service_id):
+    """Servicio por id desde la lista en caché, o None"""
+    try:
+        service_id = int(service_id)
+    except (TypeError, ValueError):
+        return None
+    for service in get_services():
+        if service.id == service_id:
+            return service
+    return None
+
+
+def get_doctor_roster():
+    """Doctores como tuplas ``(id, full_name, specialty)`` ordenadas por nombre"""
+    return get_or_load(DOCTORS, ('roster',), lambda: tuple(
+        Doctor.objects.order_by('full_name', 'id').values_list('id', 'full_name', 'specialty')
+    ))
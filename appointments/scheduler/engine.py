@@ -0,0 +1,471 @@
+"""Motor de agenda: intervalos de citas, traslapes y horarios laborales.
+
+Cada cita se modela como el intervalo semiabierto
+``[inicio, inicio + service.duration)``. Dos citas chocan si sus intervalos
+se traslapan, no solo si empiezan exactamente a la misma hora.
+
+El intervalo vive en la base como ``starts_at``/``ends_at`` (con zona
+horaria), así que los traslapes se resuelven en SQL con un rango sobre el
+índice. Hacia fuera el motor sigue hablando en datetimes ingenuos en la hora
+local de la clínica.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import cache, changes, stats
+from .models import ACTIVE_STATUSES, Appointment, AppointmentChange, Doctor, Service
+
+
+# Duración usada cuando la cita no tiene servicio asociado
+DEFAULT_DURATION = timedelta(minutes=30)
+
+# Máximo de citas que se pueden crear en una serie
+MAX_SERIES_LENGTH = 100
+
+# Ninguna cita dura más que esto (no cruzan la medianoche); acota por abajo
+# los rangos sobre ``starts_at``
+MAX_APPOINTMENT_LENGTH = timedelta(days=1)
+
+
+class Availability:
+    """Resultado de verificar un horario para un doctor"""
+
+    AVAILABLE = 'available'
+    DAY_DISABLED = 'day_disabled'
+    OUTSIDE_WORKING_HOURS = 'outside_working_hours'
+    OVERLAP = 'overlap'
+    PAST = 'past'
+
+    def __init__(self, reason, conflicts=None):
+        self.reason = reason
+        self.conflicts = conflicts or []
+
+    @property
+    def available(self):
+        return self.reason == self.AVAILABLE
+
+    def __bool__(self):
+        return self.available
+
+    def __repr__(self):
+        return f"<Availability {self.reason}>"
+
+
+class SlotUnavailable(Exception):
+    """El horario pedido no se puede reservar"""
+
+    def __init__(self, availability):
+        super().__init__(availability.reason)
+        self.availability = availability
+
+    @property
+    def conflict(self):
+        """``True`` si otra cita ocupa el horario (la UI puede reintentar con otro)"""
+        return self.availability.reason == Availability.OVERLAP
+
+
+# Restricciones que solo fallan cuando otra cita activa ocupa el horario
+SLOT_CONSTRAINTS = ('appt_unique_active_slot', 'appt_no_active_overlap')
+
+
+def is_slot_conflict(error):
+    """``True`` si el ``IntegrityError`` viene de un traslape y no de otra
+    restricción (p. ej. una llave foránea a un doctor o servicio borrado).
+
+    PostgreSQL reporta el nombre de la restricción; SQLite solo las columnas
+    del índice único.
+    """
+    constraint = getattr(getattr(error.__cause__, 'diag', None), 'constraint_name', None)
+    if constraint:
+        return constraint in SLOT_CONSTRAINTS
+    message = str(error)
+    return (
+        any(name in message for name in SLOT_CONSTRAINTS)
+        or message.startswith('UNIQUE constraint failed: scheduler_appointment.doctor_id, ')
+    )
+
+
+def weekday_id(day):
+    """Id de ``Weekday`` para una fecha (1 = lunes ... 7 = domingo)"""
+    return day.weekday() + 1
+
+
+def normalize_duration(duration):
+    """Asegurar que la duración sea un ``timedelta`` (enteros = minutos)"""
+    if duration is None:
+        return DEFAULT_DURATION
+    if not isinstance(duration, timedelta):
+        return timedelta(minutes=duration)
+    return duration
+
+
+def appointment_interval(day, start_time, duration):
+    """Intervalo ``(inicio, fin)`` de una cita como datetimes ingenuos"""
+    start = datetime.combine(day, start_time)
+    return start, start + normalize_duration(duration)
+
+
+def to_aware(value):
+    """Datetime ingenuo en hora de la clínica a datetime con zona"""
+    return timezone.make_aware(value, timezone.get_default_timezone())
+
+
+def to_local(value):
+    """Datetime con zona a datetime ingenuo en hora de la clínica"""
+    return timezone.localtime(value, timezone.get_default_timezone()).replace(tzinfo=None)
+
+
+def overlapping(queryset, start, end):
+    """Citas de ``queryset`` que se traslapan con ``[start, end)`` (con zona).
+
+    ``ends_at > start`` por sí solo no acota el índice; como ninguna cita dura
+    más de ``MAX_APPOINTMENT_LENGTH``, se agrega el límite inferior sobre
+    ``starts_at`` y la consulta queda como un solo rango del índice.
+    """
+    return queryset.filter(
+        starts_at__gte=start - MAX_APPOINTMENT_LENGTH,
+        starts_at__lt=end,
+        ends_at__gt=start,
+    )
+
+
+def day_range(first_day, last_day):
+    """Rango ``[first_day 00:00, last_day + 1 00:00)`` con zona"""
+    return (
+        to_aware(datetime.combine(first_day, time.min)),
+        to_aware(datetime.combine(last_day + timedelta(days=1), time.min)),
+    )
+
+
+def sync_intervals(queryset, batch_size=2000, progress=None):
+    """Recalcular ``starts_at``/``ends_at`` por lotes, recorriendo por id.
+
+    Sirve para llenar las citas que existían antes de las columnas y para
+    cargas masivas que no pasaron por ``sync_interval``. Regresa cuántas
+    citas actualizó.
+    """
+    total = 0
+    last_id = 0
+    while True:
+        batch = list(
+            queryset.filter(id__gt=last_id).order_by('id')
+            .select_related('service').only('id', 'date', 'time', 'service__duration')[:batch_size]
+        )
+        if not batch:
+            return total
+        for appointment in batch:
+            appointment.sync_interval(normalize_duration(appointment.service.duration))
+        Appointment.objects.using(queryset.db).bulk_update(batch, ['starts_at', 'ends_at'], batch_size=500)
+        total += len(batch)
+        last_id = batch[-1].pk
+        if progress:
+            progress(total)
+
+
+def default_service(create=False):
+    """Servicio usado cuando la cita no indica uno"""
+    services = cache.get_services()
+    service = services[0] if services else None
+    if service is None and create:
+        service = Service.objects.create(
+            name='Consulta General',
+            duration=DEFAULT_DURATION,
+            price=0
+        )
+    return service
+
+
+def find_overlaps(doctor_id, day, start_time, duration, exclude_id=None):
+    """Citas activas del doctor que se traslapan con el intervalo pedido.
+
+    Una sola consulta de rango sobre ``(doctor, starts_at, ends_at)``, sin
+    JOIN con servicios. Regresa una lista de tuplas ``(id, inicio, fin)``.
+    """
+    start, end = appointment_interval(day, start_time, duration)
+
+    appointments = overlapping(
+        Appointment.objects.filter(doctor_id=doctor_id, status__in=ACTIVE_STATUSES),
+        to_aware(start), to_aware(end),
+    )
+    if exclude_id:
+        appointments = appointments.exclude(id=exclude_id)
+
+    return [
+        (appt_id, to_local(appt_start), to_local(appt_end))
+        for appt_id, appt_start, appt_end in appointments.order_by('starts_at').values_list('id', 'starts_at', 'ends_at')
+    ]
+
+
+def fits_working_hours(doctor_id, day, start_time, duration):
+    """Verificar que el intervalo completo cabe en un bloque laboral del doctor.
+
+    Lee los bloques de la caché de horarios, sin consultar la base.
+    """
+    start, end = appointment_interval(day, start_time, duration)
+    if end.date() != day:
+        return False
+    return any(
+        block_start <= start.time() and end.time() <= block_end
+        for block_start, block_end in cache.working_blocks(doctor_id, weekday_id(day))
+    )
+
+
+def duration_conflicts(service_id, duration, since):
+    """Citas activas que chocarían si el servicio pasara a durar ``duration``.
+
+    Solo se recalculan las citas del servicio que empiezan desde ``since``;
+    las demás conservan su intervalo. Un barrido por doctor sobre sus citas
+    activas ordenadas por inicio. Regresa los ids de las citas en conflicto.
+    """
+    active = Appointment.objects.filter(status__in=ACTIVE_STATUSES)
+    doctor_ids = active.filter(service_id=service_id, starts_at__gte=since).values('doctor_id')
+    rows = active.filter(doctor_id__in=doctor_ids, ends_at__gt=since).order_by('doctor_id', 'starts_at').values_list(
+        'id', 'doctor_id', 'service_id', 'starts_at', 'ends_at'
+    )
+    conflicts = []
+    current_doctor = latest_end = None
+    for appt_id, doctor_id, appt_service_id, starts_at, ends_at in rows:
+        if appt_service_id == service_id and starts_at >= since:
+            ends_at = starts_at + duration
+        if doctor_id != current_doctor:
+            current_doctor, latest_end = doctor_id, None
+        if latest_end is not None and starts_at < latest_end:
+            conflicts.append(appt_id)
+        latest_end = ends_at if latest_end is None else max(latest_end, ends_at)
+    return conflicts
+
+
+def check_availability(doctor_id, day, start_time, duration, exclude_id=None):
+    """Verificar si el doctor puede atender una cita en ese intervalo"""
+    if weekday_id(day) not in cache.active_weekdays():
+        return Availability(Availability.DAY_DISABLED)
+
+    if not fits_working_hours(doctor_id, day, start_time, duration):
+        return Availability(Availability.OUTSIDE_WORKING_HOURS)
+
+    conflicts = find_overlaps(doctor_id, day, start_time, duration, exclude_id=exclude_id)
+    if conflicts:
+        return Availability(Availability.OVERLAP, conflicts)
+
+    return Availability(Availability.AVAILABLE)
+
+
+def book_appointment(doctor, patient, service, day, start_time, description=''):
+    """Crear una cita de forma atómica y segura ante reservas concurrentes.
+
+    Bloquea la fila del doctor (``SELECT ... FOR UPDATE``) durante la
+    verificación y la inserción, así dos reservas simultáneas del mismo
+    doctor se serializan. La restricción única de citas activas queda como
+    última defensa. Lanza ``SlotUnavailable`` si el horario no está libre;
+    cualquier otro ``IntegrityError`` (las llaves foráneas se verifican al
+    confirmar) se propaga.
+    """
+    try:
+        with transaction.atomic():
+            list(Doctor.objects.select_for_update().filter(pk=doctor.pk).values_list('pk', flat=True))
+
+            availability = check_availability(doctor.pk, day, start_time, service.duration)
+            if not availability:
+                raise SlotUnavailable(availability)
+
+            return Appointment.objects.create(
+                date=day,
+                time=start_time,
+                doctor=doctor,
+                patient=patient,
+                service=service,
+                description=description,
+                status='scheduled'
+            )
+    except IntegrityError as e:
+        if is_slot_conflict(e):
+            raise SlotUnavailable(Availability(Availability.OVERLAP))
+        raise
+
+
+def expand_weekly_recurrence(start, until, interval=1, weekdays=None, count=None):
+    """Fechas de una serie semanal al estilo RRULE (FREQ=WEEKLY).
+
+    ``interval`` es cada cuántas semanas se repite, ``weekdays`` los días
+    (1 = lunes ... 7 = domingo; por defecto el día de ``start``) y la serie
+    termina en ``until`` (inclusive) o al llegar a ``count`` fechas.
+    """
+    if interval < 1:
+        raise ValueError('El intervalo debe ser de al menos una semana')
+    weekdays = sorted(set(weekdays or [weekday_id(start)]))
+    if any(day not in range(1, 8) for day in weekdays):
+        raise ValueError('Los días de la semana van de 1 (lunes) a 7 (domingo)')
+    limit = min(count or MAX_SERIES_LENGTH, MAX_SERIES_LENGTH)
+
+    dates = []
+    week_start = start - timedelta(days=start.weekday())
+    while week_start <= until and len(dates) < limit:
+        for day_id in weekdays:
+            day = week_start + timedelta(days=day_id - 1)
+            if start <= day <= until and len(dates) < limit:
+                dates.append(day)
+        week_start += timedelta(weeks=interval)
+    return dates
+
+
+def check_series(doctor_id, occurrences, duration, not_before=None):
+    """Verificar una serie completa de ``(fecha, hora)`` en una sola pasada.
+
+    Carga con una consulta todas las citas activas del doctor en el rango de
+    la serie y valida cada ocurrencia en memoria, incluyendo los choques
+    entre ocurrencias de la misma serie. Regresa una lista de tuplas
+    ``(fecha, hora, Availability)`` en el mismo orden.
+    """
+    if not occurrences:
+        return []
+    duration = normalize_duration(duration)
+    dates = [day for day, _ in occurrences]
+
+    busy = {}
+    for appt_id, appt_start, appt_end in overlapping(
+        Appointment.objects.filter(doctor_id=doctor_id, status__in=ACTIVE_STATUSES),
+        *day_range(min(dates), max(dates)),
+    ).values_list('id', 'starts_at', 'ends_at'):
+        appt_start, appt_end = to_local(appt_start), to_local(appt_end)
+        busy.setdefault(appt_start.date(), []).append((appt_id, appt_start, appt_end))
+
+    active_days = cache.active_weekdays()
+    results = []
+    for day, start_time in occurrences:
+        start, end = appointment_interval(day, start_time, duration)
+        if not_before is not None and start <= not_before:
+            availability = Availability(Availability.PAST)
+        elif weekday_id(day) not in active_days:
+            availability = Availability(Availability.DAY_DISABLED)
+        elif not fits_working_hours(doctor_id, day, start_time, duration):
+            availability = Availability(Availability.OUTSIDE_WORKING_HOURS)
+        else:
+            conflicts = [
+                (appt_id, busy_start, busy_end)
+                for appt_id, busy_start, busy_end in busy.get(day, [])
+                if busy_start < end and start < busy_end
+            ]
+            if conflicts:
+                availability = Availability(Availability.OVERLAP, conflicts)
+            else:
+                availability = Availability(Availability.AVAILABLE)
+                # Las siguientes ocurrencias no pueden chocar con esta
+                busy.setdefault(day, []).append((None, start, end))
+        results.append((day, start_time, availability))
+    return results
+
+
+def book_series(doctor, patient, service, occurrences, skip_conflicts=False, description='', not_before=None):
+    """Crear una serie de citas en una transacción con ``bulk_create``.
+
+    Si alguna ocurrencia no está disponible no se crea nada, salvo que
+    ``skip_conflicts`` sea verdadero, en cuyo caso se crean las disponibles.
+    Regresa ``(citas_creadas, resultados)`` con los resultados de
+    ``check_series``. Como ``book_appointment``, solo un traslape se
+    convierte en ``SlotUnavailable``.
+    """
+    try:
+        with transaction.atomic():
+            list(Doctor.objects.select_for_update().filter(pk=doctor.pk).values_list('pk', flat=True))
+
+            results = check_series(doctor.pk, occurrences, service.duration, not_before=not_before)
+            if not skip_conflicts and not all(availability for _, _, availability in results):
+                return [], results
+
+            appointments = [
+                Appointment(
+                    date=day,
+                    time=start_time,
+                    doctor=doctor,
+                    patient=patient,
+                    service=service,
+                    description=description,
+                    status='scheduled'
+                )
+                for day, start_time, availability in results if availability
+            ]
+            for appointment in appointments:
+                appointment.sync_interval(service.duration)
+            created = Appointment.objects.bulk_create(appointments)
+            # bulk_create no dispara señales: registrar los cambios a mano
+            changes.record_bulk(created, AppointmentChange.CREATED)
+            stats.record_bulk(created)
+            return created, results
+    except IntegrityError as e:
+        if is_slot_conflict(e):
+            raise SlotUnavailable(Availability(Availability.OVERLAP))
+        raise
+
+
+def subtract_intervals(blocks, busy):
+    """Restar intervalos ocupados de bloques libres con un barrido lineal.
+
+    Ambas listas deben venir ordenadas por inicio; ``busy`` puede tener
+    traslapes entre sí. Regresa la lista ordenada de huecos libres.
+    """
+    free = []
+    i = 0
+    for block_start, block_end in blocks:
+        cursor = block_start
+        # Saltar ocupados que terminan antes del bloque
+        while i < len(busy) and busy[i][1] <= block_start:
+            i += 1
+        j = i
+        while j < len(busy) and busy[j][0] < block_end:
+            busy_start, busy_end = busy[j]
+            if busy_start > cursor:
+                free.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+            j += 1
+        if cursor < block_end:
+            free.append((cursor, block_end))
+    return free
+
+
+def find_free_slots(doctor_ids, start_date, end_date, duration, step=None, not_before=None):
+    """Todos los horarios libres de los doctores entre dos fechas (inclusive).
+
+    Los horarios laborales salen de la caché y las citas del rango de una
+    sola consulta; el resto es un barrido en memoria sobre intervalos
+    ordenados. Regresa tuplas ``(doctor_id, inicio, fin)`` ordenadas por inicio.
+    """
+    duration = normalize_duration(duration)
+    step = step or duration
+    doctor_ids = list(doctor_ids)
+    schedules = cache.get_schedules(doctor_ids)
+
+    # {(doctor_id, date): [(inicio, fin), ...]} ordenado por inicio
+    busy = {}
+    for doctor_id, appt_start, appt_end in overlapping(
+        Appointment.objects.filter(doctor_id__in=doctor_ids, status__in=ACTIVE_STATUSES),
+        *day_range(start_date, end_date),
+    ).order_by('starts_at').values_list('doctor_id', 'starts_at', 'ends_at'):
+        appt_start, appt_end = to_local(appt_start), to_local(appt_end)
+        busy.setdefault((doctor_id, appt_start.date()), []).append((appt_start, appt_end))
+
+    slots = []
+    day = start_date
+    while day <= end_date:
+        day_slots = []
+        for doctor_id in doctor_ids:
+            blocks = [
+                (datetime.combine(day, block_start), datetime.combine(day, block_end))
+                for block_start, block_end in schedules[doctor_id].get(weekday_id(day), ())
+            ]
+            if not blocks:
+                continue
+            for gap_start, gap_end in subtract_intervals(blocks, busy.get((doctor_id, day), [])):
+                # Alinear los horarios a la rejilla del bloque laboral
+                block_start = next(start for start, end in blocks if start <= gap_start < end)
+                offset = (gap_start - block_start) % step
+                slot_start = gap_start if not offset else gap_start + (step - offset)
+                while slot_start + duration <= gap_end:
+                    if not_before is None or slot_start > not_before:
+                        day_slots.append((doctor_id, slot_start, slot_start + duration))
+                    slot_start += step
+        day_slots.sort(key=lambda slot: (slot[1], slot[0]))
+        slots.extend(day_slots)
+        day += timedelta(days=1)
+    return slots
@@ -0,0 +1,66 @@
+"""Serialización de citas a eventos de FullCalendar.
+
+Las vistas no hidratan modelos: leen solo las columnas necesarias con
+``values(*EVENT_COLUMNS)`` (un JOIN con doctor, paciente y servicio) y
+``build_event`` arma el evento desde el diccionario. No se usa
+``values_list``: en Django 5.2 su ``aiterator()`` falla con
+``SynchronousOnlyOperation`` y el feed en streaming lo usa bajo ASGI. Los nombres salen de
+``Doctor.full_name`` y ``Patient.full_name``; inicio y fin salen de
+``starts_at``/``ends_at`` y se envían en hora local de la clínica. Las citas
+que aún no tienen intervalo (anteriores a esas columnas, antes de
+``sync_appointment_intervals``) usan fecha, hora y duración del servicio.
+"""
+from . import engine
+
+
+# Colores por estado, calculados una sola vez
+STATUS_COLORS = {
+    'scheduled': '#007bff',    # Azul para programadas
+    'completed': '#28a745',    # Verde para completadas
+    'cancelled': '#dc3545',    # Rojo para canceladas
+    'pending': '#ffc107',      # Amarillo para pendientes
+    'in_progress': '#17a2b8',  # Cian para en progreso
+    'no_show': '#6c757d',      # Gris para no presentados
+}
+DEFAULT_STATUS_COLOR = '#6c757d'
+
+EVENT_COLUMNS = (
+    'id', 'starts_at', 'ends_at', 'date', 'time', 'status',
+    'patient__full_name', 'doctor__full_name', 'service__name', 'service__duration',
+)
+
+
+def event_rows(queryset):
+    """Proyección de un queryset de citas lista para ``build_event``"""
+    return queryset.values(*EVENT_COLUMNS)
+
+
+def build_event(row):
+    """Convertir una fila de ``event_rows`` en un evento de FullCalendar"""
+    appt_id = row['id']
+    status = row['status']
+    patient_name = row['patient__full_name']
+    doctor_name = row['doctor__full_name']
+    service_name = row['service__name']
+    if row['starts_at'] and row['ends_at']:
+        start, end = engine.to_local(row['starts_at']), engine.to_local(row['ends_at'])
+    else:
+        start, end = engine.appointment_interval(row['date'], row['time'], row['service__duration'])
+    color = STATUS_COLORS.get(status, DEFAULT_STATUS_COLOR)
+    return {
+        'id': str(appt_id),
+        'title': f"{patient_name} - {doctor_name}",
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'backgroundColor': color,
+        'borderColor': color,
+        'textColor': '#ffffff',
+        'url': f"/admin/scheduler/appointment/{appt_id}/change/",
+        'extendedProps': {
+            'doctor': doctor_name,
+            'patient': patient_name,
+            'status': status,
+            'service': service_name or 'Consulta General',
+            'time': start.time().isoformat(timespec='minutes'),
+        }
+    }
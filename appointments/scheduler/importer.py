@@ -0,0 +1,439 @@
+"""Importación masiva de pacientes y citas históricas desde CSV o JSON Lines.
+
+Los archivos se leen por lotes. Las llaves foráneas (doctor, paciente,
+servicio) se resuelven con mapas en memoria armados una sola vez, por id o
+por llave natural:
+
+* doctor: ``doctor_id``, ``doctor_license`` o ``doctor`` (nombre completo)
+* paciente: ``patient_id``, ``patient_phone`` o ``patient`` (nombre completo)
+* servicio: ``service_id`` o ``service`` (nombre)
+
+Cada lote se inserta con ``bulk_create``; los pacientes, en PostgreSQL con
+psycopg 3, también con ``COPY``. Las filas inválidas se reportan con su número y sus errores
+sin detener el lote; si la base rechaza el lote completo (por ejemplo, dos
+citas activas en el mismo horario) se reintenta fila por fila para aislar
+las que fallan. El archivo de citas acepta las mismas columnas que genera
+``export_appointments``, incluido el historial clínico.
+
+Las inserciones no pasan por señales: las citas se suman a las estadísticas
+diarias con ``stats.record_bulk``, por eso siempre usan ``bulk_create``
+(``COPY`` no regresa los ids). No se registran en la bitácora de cambios:
+años de historial la inundarían y harían recargar cada calendario abierto
+una vez por cita. Al terminar, ``finish`` avisa una sola vez a los
+calendarios que recarguen su rango.
+"""
+import csv
+import gzip
+import json
+import os
+from datetime import datetime, time
+
+from django.contrib.auth.models import User
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
+
+from . import pubsub, stats
+from .models import Appointment, ClinicalHistory, Doctor, Patient, Service
+
+
+FORMATS = ('csv', 'jsonl')
+
+# Llave de un nombre repetido en los mapas de búsqueda
+AMBIGUOUS = object()
+
+
+class RowError(Exception):
+    """Fila inválida; ``errors`` es ``{campo: mensaje}``"""
+
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def detect_format(path):
+    name = path.removesuffix('.gz')
+    for fmt in FORMATS:
+        if name.endswith(f'.{fmt}'):
+            return fmt
+    return 'csv'
+
+
+def read_rows(path, fmt):
+    """Filas ``(número, dict)`` numeradas desde 1; ``None`` si la línea no es JSON"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            yield from enumerate(csv.DictReader(f), 1)
+            return
+        number = 0
+        for line in f:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                row = None
+            yield number, row if isinstance(row, dict) else None
+
+
+def copy_available():
+    """``COPY FROM STDIN`` solo con PostgreSQL y psycopg 3"""
+    if connection.vendor != 'postgresql':
+        return False
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+    return is_psycopg3
+
+
+def copy_insert(model, objects):
+    """Insertar con ``COPY``; más rápido que ``INSERT`` pero no regresa ids"""
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        with cursor.cursor.copy(f'COPY {quote(model._meta.db_table)} ({columns}) FROM STDIN') as copy:
+            for obj in objects:
+                copy.write_row([
+                    field.get_db_prep_save(field.pre_save(obj, True), connection) for field in fields
+                ])
+
+
+# ─────────────────────────────
+#   Limpieza de valores
+# ─────────────────────────────
+
+def text(row, column, max_length=None, required=False):
+    value = row.get(column)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise RowError({column: 'Campo requerido'})
+    if max_length and len(value) > max_length:
+        raise RowError({column: f'Máximo {max_length} caracteres'})
+    return value
+
+
+def date_value(row, column, required=False):
+    value = text(row, column, required=required)
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise RowError({column: f'Fecha inválida: {value}'})
+    return day
+
+
+def time_value(row, column):
+    value = text(row, column, required=True)
+    try:
+        parsed = parse_time(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise RowError({column: f'Hora inválida: {value}'})
+    return parsed
+
+
+def datetime_value(row, column):
+    """Fecha u hora con o sin zona; sin zona se toma la de la clínica"""
+    value = text(row, column)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None and parse_date(value):
+            parsed = datetime.combine(parse_date(value), time.min)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise RowError({column: f'Fecha inválida: {value}'})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_default_timezone())
+    return parsed
+
+
+def bool_value(row, column):
+    return text(row, column).lower() in ('1', 'true', 'yes', 'si', 'sí', 'x')
+
+
+def choice_value(row, column, choices, default=''):
+    value = text(row, column).lower() or default
+    if value and value not in choices:
+        raise RowError({column: f"Valor inválido: {value} (opciones: {', '.join(sorted(choices))})"})
+    return value
+
+
+def max_length(model, field_name):
+    return model._meta.get_field(field_name).max_length
+
+
+def lookup_map(pairs):
+    """``{llave: id}`` donde las llaves repetidas quedan como ``AMBIGUOUS``"""
+    result = {}
+    for key, pk in pairs:
+        if not key:
+            continue
+        result[key] = AMBIGUOUS if key in result and result[key] != pk else pk
+    return result
+
+
+# ─────────────────────────────
+#   Importadores
+# ─────────────────────────────
+
+class Importer:
+    """Base: valida filas, inserta lotes y aísla las filas que la base rechaza"""
+
+    model = None
+
+    def __init__(self, owner=None, use_copy=False):
+        self.owner = owner
+        self.use_copy = use_copy and copy_available()
+
+    def load_lookups(self):
+        """Armar los mapas de búsqueda (una vez por corrida)"""
+
+    def build(self, row):
+        """Objeto(s) a insertar para una fila; lanza ``RowError``"""
+        raise NotImplementedError
+
+    def insert(self, items):
+        raise NotImplementedError
+
+    def finish(self, imported):
+        """Al terminar la corrida, con ``imported`` filas guardadas"""
+
+    def import_batch(self, rows):
+        """Importar ``[(número, fila), ...]``; regresa ``(insertadas, errores)``.
+
+        Cada error es ``(número, {campo: mensaje}, fila)``.
+        """
+        valid = []
+        errors = []
+        for number, row in rows:
+            if row is None:
+                errors.append((number, {'__all__': 'Línea JSON inválida'}, None))
+                continue
+            try:
+                valid.append((number, row, self.build(row)))
+            except RowError as e:
+                errors.append((number, e.errors, row))
+
+        try:
+            with transaction.atomic():
+                self.insert([item for _, _, item in valid])
+            return len(valid), errors
+        except DatabaseError:
+            pass
+
+        # El lote falló completo: reintentar fila por fila
+        saved = 0
+        for number, row, item in valid:
+            try:
+                with transaction.atomic():
+                    self.insert([item])
+                saved += 1
+            except DatabaseError as e:
+                errors.append((number, {'__all__': str(e).strip()}, row))
+        errors.sort(key=lambda error: error[0])
+        return saved, errors
+
+
+class PatientImporter(Importer):
+    """Columnas: ``full_name`` (requerida), ``date_of_birth``, ``gender``,
+    ``phone``, ``address``, ``blood_type``"""
+
+    model = Patient
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.genders = {value for value, _ in Patient._meta.get_field('gender').choices}
+
+    def build(self, row):
+        errors = {}
+        values = {}
+        cleaners = {
+            'full_name': lambda: text(row, 'full_name', max_length(Patient, 'full_name'), required=True),
+            'date_of_birth': lambda: date_value(row, 'date_of_birth'),
+            'gender': lambda: choice_value(row, 'gender', self.genders),
+            'phone': lambda: text(row, 'phone', max_length(Patient, 'phone')),
+            'address': lambda: text(row, 'address') or None,
+            'blood_type': lambda: text(row, 'blood_type', max_length(Patient, 'blood_type')).upper(),
+        }
+        for field, clean in cleaners.items():
+            try:
+                values[field] = clean()
+            except RowError as e:
+                errors.update(e.errors)
+        if errors:
+            raise RowError(errors)
+        return Patient(user=self.owner, **values)
+
+    def insert(self, patients):
+        if self.use_copy:
+            copy_insert(Patient, patients)
+        else:
+            Patient.objects.bulk_create(patients)
+
+
+class AppointmentImporter(Importer):
+    """Columnas: ``date``, ``time``, doctor, paciente, servicio (ver el
+    módulo), ``status``, ``description`` y opcionalmente el historial
+    (``reason``, ``diagnosis``, ``treatment``, ``prescription``,
+    ``follow_up_needed``, ``follow_up_date``).
+
+    Sin ``status`` las citas pasadas quedan completadas y las futuras
+    programadas.
+    """
+
+    model = Appointment
+
+    def load_lookups(self):
+        doctors = list(Doctor.objects.values_list('id', 'license_number', 'full_name'))
+        self.doctor_ids = {pk for pk, _, _ in doctors}
+        self.doctors_by_license = lookup_map((license.casefold(), pk) for pk, license, _ in doctors)
+        self.doctors_by_name = lookup_map((name.casefold(), pk) for pk, _, name in doctors)
+
+        patients = Patient.objects.values_list('id', 'phone', 'full_name').iterator(chunk_size=10000)
+        self.patient_ids = set()
+        by_phone, by_name = [], []
+        for pk, phone, name in patients:
+            self.patient_ids.add(pk)
+            by_phone.append((phone, pk))
+            by_name.append((name.casefold(), pk))
+        self.patients_by_phone = lookup_map(by_phone)
+        self.patients_by_name = lookup_map(by_name)
+
+        self.services = {service.pk: service for service in Service.objects.all()}
+        self.services_by_name = lookup_map((service.name.casefold(), pk) for pk, service in self.services.items())
+        self.statuses = {value for value, _ in Appointment._meta.get_field('status').choices}
+        self.today = timezone.localdate()
+
+    def resolve(self, row, label, ids, by_key):
+        """Id de una llave foránea por ``<label>_id`` o por las llaves naturales"""
+        value = text(row, f'{label}_id')
+        if value:
+            if not value.isdigit() or int(value) not in ids:
+                raise RowError({f'{label}_id': f'No existe: {value}'})
+            return int(value)
+        for column, mapping in by_key:
+            value = text(row, column)
+            if not value:
+                continue
+            pk = mapping.get(value.casefold())
+            if pk is None:
+                raise RowError({column: f'No existe: {value}'})
+            if pk is AMBIGUOUS:
+                raise RowError({column: f'Hay varios con "{value}"; use {label}_id'})
+            return pk
+        raise RowError({label: 'Campo requerido'})
+
+    def build(self, row):
+        errors = {}
+
+        def collect(clean):
+            try:
+                return clean()
+            except RowError as e:
+                errors.update(e.errors)
+
+        day = collect(lambda: date_value(row, 'date', required=True))
+        start_time = collect(lambda: time_value(row, 'time'))
+        doctor_id = collect(lambda: self.resolve(row, 'doctor', self.doctor_ids, [
+            ('doctor_license', self.doctors_by_license), ('doctor', self.doctors_by_name),
+        ]))
+        patient_id = collect(lambda: self.resolve(row, 'patient', self.patient_ids, [
+            ('patient_phone', self.patients_by_phone), ('patient', self.patients_by_name),
+        ]))
+        service_id = collect(lambda: self.resolve(row, 'service', self.services, [
+            ('service', self.services_by_name),
+        ]))
+        status = collect(lambda: choice_value(row, 'status', self.statuses))
+        history = collect(lambda: self.build_history(row))
+        if errors:
+            raise RowError(errors)
+
+        appointment = Appointment(
+            doctor_id=doctor_id,
+            patient_id=patient_id,
+            service_id=service_id,
+            date=day,
+            time=start_time,
+            status=status or ('completed' if day < self.today else 'scheduled'),
+            description=text(row, 'description'),
+        )
+        appointment.sync_interval(self.services[service_id].duration)
+        if appointment.status == 'completed':
+            appointment.price = self.services[service_id].price
+        return appointment, history
+
+    def build_history(self, row):
+        reason = text(row, 'reason', max_length(ClinicalHistory, 'reason'))
+        if not reason:
+            return None
+        return ClinicalHistory(
+            reason=reason,
+            diagnosis=text(row, 'diagnosis') or None,
+            treatment=text(row, 'treatment') or None,
+            prescription=text(row, 'prescription') or None,
+            follow_up_needed=bool_value(row, 'follow_up_needed'),
+            follow_up_date=datetime_value(row, 'follow_up_date'),
+        )
+
+    def insert(self, items):
+        appointments = Appointment.objects.bulk_create([appointment for appointment, _ in items])
+        stats.record_bulk(appointments)
+        histories = [(appointment, history) for appointment, history in items if history]
+        for appointment, history in histories:
+            history.appointment_id = appointment.pk
+        ClinicalHistory.objects.bulk_create([history for _, history in histories])
+
+
+    def finish(self, imported):
+        if imported:
+            pubsub.publish_reload()
+
+
+IMPORTERS = {
+    'patients': PatientImporter,
+    'appointments': AppointmentImporter,
+}
+
+
+def import_owner(username='import'):
+    """Usuario dueño de los pacientes importados (FK obligatoria)"""
+    user, _ = User.objects.get_or_create(username=username, defaults={'is_active': False})
+    return user
+
+
+# ─────────────────────────────
+#   Punto de control
+# ─────────────────────────────
+
+def source_signature(path):
+    """Identifica el archivo: si cambia, el punto de control ya no aplica"""
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+def load_checkpoint(checkpoint_path, kind, source):
+    """Estado guardado si corresponde al mismo archivo y tipo, si no ``None``"""
+    try:
+        with open(checkpoint_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('kind') != kind or state.get('source') != source:
+        return None
+    return state
+
+
+def save_checkpoint(checkpoint_path, state):
+    """Escribir de forma atómica (archivo temporal + rename)"""
+    tmp_path = f'{checkpoint_path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, checkpoint_path)
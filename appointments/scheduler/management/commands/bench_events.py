@@ -0,0 +1,127 @@
+"""Micro-benchmark de la serialización de eventos del calendario.
+
+Compara la ruta anterior (``select_related`` + modelos completos +
+``get_full_name``) contra la proyección de ``scheduler.events`` sobre las
+mismas citas y reporta eventos por segundo en JSON. Si faltan citas, inserta
+las necesarias dentro de una transacción que se revierte al terminar::
+
+    python manage.py bench_events --rows 100000
+"""
+import json
+import random
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from scheduler import events
+from scheduler.models import Appointment, Doctor, Patient, Service
+
+
+def legacy_event(appt):
+    """Serialización por modelo completo, como la hacía el admin antes"""
+    start_iso = datetime.combine(appt.date, appt.time).isoformat()
+    duration = appt.service.duration if appt.service else timedelta(minutes=30)
+    end_iso = (datetime.combine(appt.date, appt.time) + duration).isoformat()
+    patient_name = appt.patient.user.get_full_name() or appt.patient.user.username
+    doctor_name = appt.doctor.user.get_full_name() or appt.doctor.user.username
+    status_colors = {
+        'scheduled': '#007bff',
+        'completed': '#28a745',
+        'cancelled': '#dc3545',
+        'pending': '#ffc107',
+        'in_progress': '#17a2b8',
+        'no_show': '#6c757d',
+    }
+    return {
+        'id': str(appt.id),
+        'title': f"{patient_name} - {doctor_name}",
+        'start': start_iso,
+        'end': end_iso,
+        'backgroundColor': status_colors.get(appt.status, '#6c757d'),
+        'borderColor': status_colors.get(appt.status, '#6c757d'),
+        'textColor': '#ffffff',
+        'url': f"/admin/scheduler/appointment/{appt.id}/change/",
+        'extendedProps': {
+            'doctor': doctor_name,
+            'patient': patient_name,
+            'status': appt.status,
+            'service': appt.service.name if appt.service else 'Consulta General',
+            'time': appt.time.strftime('%H:%M')
+        }
+    }
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Mide eventos/s de la serialización del calendario (modelos completos vs proyección)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Citas a serializar')
+        parser.add_argument('--repeat', type=int, default=3, help='Corridas por ruta (se toma la mejor)')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        try:
+            with transaction.atomic():
+                missing = rows - Appointment.objects.count()
+                if missing > 0:
+                    self.seed(missing)
+                report = self.run(rows, options['repeat'], options['chunk_size'])
+                raise Rollback
+        except Rollback:
+            pass
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def run(self, rows, repeat, chunk_size):
+        queryset = Appointment.objects.order_by('id')[:rows]
+
+        def legacy():
+            return [
+                legacy_event(appt) for appt in
+                queryset.select_related('patient__user', 'doctor__user', 'service').iterator(chunk_size=chunk_size)
+            ]
+
+        def projection():
+            return [events.build_event(row) for row in events.event_rows(queryset).iterator(chunk_size=chunk_size)]
+
+        report = {'rows': rows}
+        for name, serialize in (('legacy', legacy), ('projection', projection)):
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                count = len(serialize())
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            report[name] = {'events': count, 'seconds': round(best, 3), 'events_per_sec': round(count / best)}
+        report['speedup'] = round(report['projection']['events_per_sec'] / report['legacy']['events_per_sec'], 2)
+        return report
+
+    def seed(self, total):
+        """Citas sintéticas (no activas, para no chocar con la restricción única)"""
+        doctor_ids = list(Doctor.objects.values_list('id', flat=True))
+        patient_ids = list(Patient.objects.values_list('id', flat=True))
+        durations = dict(Service.objects.values_list('id', 'duration'))
+        if not (doctor_ids and patient_ids and durations):
+            raise CommandError('Se necesita al menos un doctor, un paciente y un servicio')
+
+        service_ids = list(durations)
+        start_day = date.today() - timedelta(days=365)
+        batch = []
+        for _ in range(total):
+            appointment = Appointment(
+                doctor_id=random.choice(doctor_ids),
+                patient_id=random.choice(patient_ids),
+                service_id=random.choice(service_ids),
+                date=start_day + timedelta(days=random.randrange(730)),
+                time=dt_time(random.randrange(8, 20), random.choice((0, 15, 30, 45))),
+                status=random.choice(('completed', 'cancelled')),
+            )
+            appointment.sync_interval(durations[appointment.service_id])
+            batch.append(appointment)
+        Appointment.objects.bulk_create(batch, batch_size=5000)
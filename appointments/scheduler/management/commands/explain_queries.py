@@ -0,0 +1,98 @@
+"""Mostrar el plan de ejecución de las consultas más frecuentes de citas.
+
+Se usa para comparar el plan antes y después de aplicar los índices de
+``Appointment``. Con ``--seed`` primero llena la tabla con citas sintéticas
+(por ejemplo ``--seed 1000000``) para que el planificador trabaje con un
+volumen realista.
+"""
+import random
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from scheduler import engine
+from scheduler.models import ACTIVE_STATUSES, Appointment, Doctor, Patient, Service
+
+
+class Command(BaseCommand):
+    help = 'Muestra EXPLAIN de las consultas de disponibilidad, calendario y changelist'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Número de citas sintéticas a insertar antes de explicar')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--analyze', action='store_true',
+                            help='Ejecutar las consultas (EXPLAIN ANALYZE, solo PostgreSQL)')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.seed(options['seed'], options['batch_size'])
+
+        sample = Appointment.objects.order_by('-id').values('doctor_id', 'date').first()
+        if not sample:
+            raise CommandError('No hay citas; use --seed para generar datos')
+        doctor_id, day = sample['doctor_id'], sample['date']
+        month_start = day.replace(day=1)
+        morning = (
+            engine.to_aware(datetime.combine(day, dt_time(9))),
+            engine.to_aware(datetime.combine(day, dt_time(12))),
+        )
+        month = engine.day_range(month_start, month_start + timedelta(days=30))
+
+        queries = {
+            'disponibilidad (doctor + rango de la mañana, citas activas)': engine.overlapping(
+                Appointment.objects.filter(doctor_id=doctor_id, status__in=ACTIVE_STATUSES), *morning
+            ).values_list('id', 'starts_at', 'ends_at'),
+            'calendario (rango de un mes)': engine.overlapping(Appointment.objects.all(), *month),
+            'calendario filtrado por doctor': engine.overlapping(
+                Appointment.objects.filter(doctor_id=doctor_id), *month
+            ),
+            'changelist filtrado por estado': Appointment.objects.filter(status='cancelled')[:100],
+            'changelist (primera página)': Appointment.objects.all()[:100],
+        }
+
+        explain_options = {}
+        if options['analyze'] and connection.vendor == 'postgresql':
+            explain_options = {'analyze': True, 'buffers': True}
+
+        for label, queryset in queries.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f'== {label}'))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write('')
+
+    def seed(self, total, batch_size):
+        """Insertar citas sintéticas en lotes con ``bulk_create``"""
+        doctor_ids = list(Doctor.objects.values_list('id', flat=True))
+        patient_ids = list(Patient.objects.values_list('id', flat=True))
+        durations = dict(Service.objects.values_list('id', 'duration'))
+        if not (doctor_ids and patient_ids and durations):
+            raise CommandError('Se necesita al menos un doctor, un paciente y un servicio')
+        service_ids = list(durations)
+
+        statuses = ['scheduled', 'completed', 'cancelled']
+        start_day = date.today() - timedelta(days=365 * 3)
+        started = time.perf_counter()
+        created = 0
+        while created < total:
+            batch = []
+            for _ in range(min(batch_size, total - created)):
+                appointment = Appointment(
+                    doctor_id=random.choice(doctor_ids),
+                    patient_id=random.choice(patient_ids),
+                    service_id=random.choice(service_ids),
+                    date=start_day + timedelta(days=random.randrange(365 * 4)),
+                    time=dt_time(random.randrange(8, 20), random.choice((0, 15, 30, 45))),
+                    # Las citas activas repetidas chocarían con la restricción única
+                    status=random.choice(statuses[1:]),
+                )
+                appointment.sync_interval(durations[appointment.service_id])
+                batch.append(appointment)
+            Appointment.objects.bulk_create(batch, batch_size=batch_size)
+            created += len(batch)
+            self.stdout.write(f'{created}/{total} citas insertadas', ending='\r')
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f'{created} citas insertadas en {time.perf_counter() - started:.1f}s'
+        ))
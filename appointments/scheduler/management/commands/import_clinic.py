@@ -0,0 +1,105 @@
+"""Importar pacientes o citas históricas desde CSV o JSON Lines.
+
+    python manage.py import_clinic patients pacientes.csv
+    python manage.py import_clinic appointments citas.jsonl.gz --batch-size 5000
+
+El archivo se lee por lotes y cada lote se guarda en su propia transacción.
+Después de cada lote se actualiza el punto de control (por defecto
+``<archivo>.checkpoint``): si la importación se interrumpe, la misma orden
+continúa desde el último lote guardado. Las filas con errores se escriben
+con su número en ``<archivo>.errors.jsonl`` y no detienen la importación.
+
+El archivo de citas puede ser una salida de ``export_appointments``; las
+columnas aceptadas están en ``scheduler/importer.py``.
+"""
+import json
+import time
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from scheduler import importer
+
+
+class Command(BaseCommand):
+    help = 'Importa pacientes o citas por lotes (CSV o JSONL, opcionalmente gzip), con reanudación'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(importer.IMPORTERS))
+        parser.add_argument('path', help='Archivo a importar (.csv, .jsonl, con .gz comprimido)')
+        parser.add_argument('--format', choices=importer.FORMATS, help='Por defecto según la extensión, o csv')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--checkpoint', help='Punto de control (por defecto <archivo>.checkpoint)')
+        parser.add_argument('--restart', action='store_true', help='Ignorar el punto de control y empezar de cero')
+        parser.add_argument('--errors', help='Filas rechazadas (por defecto <archivo>.errors.jsonl)')
+        parser.add_argument('--copy', action='store_true', help='Pacientes con COPY (PostgreSQL con psycopg 3)')
+        parser.add_argument('--owner', help='Usuario dueño de los pacientes (por defecto "import", inactivo)')
+
+    def handle(self, *args, **options):
+        kind, path = options['kind'], options['path']
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size debe ser mayor que cero')
+        try:
+            source = importer.source_signature(path)
+        except OSError as e:
+            raise CommandError(str(e))
+        fmt = options['format'] or importer.detect_format(path)
+        checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+        errors_path = options['errors'] or f'{path}.errors.jsonl'
+
+        state = None if options['restart'] else importer.load_checkpoint(checkpoint_path, kind, source)
+        if state and state['done']:
+            self.stderr.write(f'{path} ya se importó ({state["imported"]} filas); use --restart para repetir')
+            return
+        if state:
+            self.stderr.write(f'Continuando después de la fila {state["position"]}')
+        else:
+            state = {'kind': kind, 'source': source, 'position': 0, 'imported': 0, 'errors': 0, 'done': False}
+
+        if options['copy'] and not importer.copy_available():
+            self.stderr.write(self.style.WARNING('COPY requiere PostgreSQL con psycopg 3; se usa bulk_create'))
+        rows_importer = importer.IMPORTERS[kind](owner=self.get_owner(options['owner']), use_copy=options['copy'])
+        rows_importer.load_lookups()
+
+        rows = islice(importer.read_rows(path, fmt), state['position'], None)
+        started = time.perf_counter()
+        read = 0
+        with open(errors_path, 'a' if state['position'] else 'w', encoding='utf-8') as errors_file:
+            while batch := list(islice(rows, options['batch_size'])):
+                with transaction.atomic():
+                    saved, errors = rows_importer.import_batch(batch)
+                for number, fields, row in errors:
+                    errors_file.write(json.dumps({'row': number, 'errors': fields, 'data': row}, ensure_ascii=False, default=str) + '\n')
+                errors_file.flush()
+
+                read += len(batch)
+                state['position'] = batch[-1][0]
+                state['imported'] += saved
+                state['errors'] += len(errors)
+                importer.save_checkpoint(checkpoint_path, state)
+                elapsed = time.perf_counter() - started
+                self.stderr.write(
+                    f"{state['position']} filas leídas, {state['imported']} importadas, {state['errors']} con errores "
+                    f'({read / elapsed:,.0f} filas/s)', ending='\r'
+                )
+
+        state['done'] = True
+        importer.save_checkpoint(checkpoint_path, state)
+        rows_importer.finish(state['imported'])
+        elapsed = time.perf_counter() - started
+        self.stderr.write('')
+        self.stderr.write(self.style.SUCCESS(
+            f"{state['imported']} filas importadas en {elapsed:.1f}s ({read / elapsed if elapsed else 0:,.0f} filas/s)"
+        ))
+        if state['errors']:
+            self.stderr.write(self.style.WARNING(f"{state['errors']} filas con errores en {errors_path}"))
+
+    def get_owner(self, username):
+        if not username:
+            return importer.import_owner()
+        try:
+            return User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f'No existe el usuario {username}')
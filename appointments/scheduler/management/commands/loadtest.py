@@ -0,0 +1,129 @@
+"""Prueba de carga HTTP de las vistas JSON del calendario.
+
+Golpea un servidor ya levantado con muchos clientes concurrentes (hilos con
+conexión keep-alive) y reporta peticiones por segundo y latencias en JSON.
+Para comparar WSGI contra ASGI se corre la misma prueba contra cada modo::
+
+    gunicorn -c gunicorn.conf.py                    # WSGI
+    python manage.py loadtest --scenario events --label wsgi --output wsgi.json
+
+    SERVER_MODE=asgi gunicorn -c gunicorn.conf.py   # ASGI (uvicorn)
+    python manage.py loadtest --scenario events --label asgi --output asgi.json
+
+El escenario ``check`` solo consulta disponibilidad; ``create`` sí crea
+citas (cada una en un horario distinto) y no debe usarse en producción.
+"""
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from scheduler import benchmark
+
+
+BASE_PATH = '/admin/scheduler/appointment/'
+
+
+class Command(BaseCommand):
+    help = 'Mide peticiones/s y latencias (p50, p95, p99) de get-events, check-availability o create-appointment'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Servidor a probar')
+        parser.add_argument('--scenario', choices=['events', 'check', 'create'], default='events')
+        parser.add_argument('--requests', type=int, default=2000, help='Peticiones en total')
+        parser.add_argument('--concurrency', type=int, default=50, help='Clientes simultáneos')
+        parser.add_argument('--warmup', type=int, default=50, help='Peticiones iniciales que no se miden')
+        parser.add_argument('--doctor', type=int, default=1)
+        parser.add_argument('--patient', type=int, default=1)
+        parser.add_argument('--date', help='Día de las citas (YYYY-MM-DD), por defecto el próximo lunes')
+        parser.add_argument('--label', default='', help='Etiqueta del reporte, por ejemplo wsgi o asgi')
+        parser.add_argument('--output', help='Guardar el reporte JSON en este archivo')
+
+    def handle(self, *args, **options):
+        target = urlsplit(options['url'])
+        if target.scheme not in ('http', 'https') or not target.hostname:
+            raise CommandError(f"URL inválida: {options['url']}")
+        if options['date']:
+            try:
+                day = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError as e:
+                raise CommandError(str(e))
+        else:
+            today = date.today()
+            day = today + timedelta(days=7 - today.weekday())
+
+        build_request = self.get_scenario(options, day)
+        local = threading.local()
+
+        def send(number):
+            if not hasattr(local, 'conn'):
+                conn_class = http.client.HTTPSConnection if target.scheme == 'https' else http.client.HTTPConnection
+                local.conn = conn_class(target.hostname, target.port, timeout=30)
+            method, path, body = build_request(number)
+            headers = {'Content-Type': 'application/json'} if body else {}
+            started = time.perf_counter()
+            try:
+                local.conn.request(method, path, body=body, headers=headers)
+                response = local.conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                local.conn.close()
+                del local.conn
+                status = None
+            return status, time.perf_counter() - started
+
+        total = options['requests']
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            list(executor.map(send, range(-options['warmup'], 0)))
+            started = time.perf_counter()
+            results = list(executor.map(send, range(total)))
+            elapsed = time.perf_counter() - started
+
+        report = self.build_report(options, results, elapsed)
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
+
+    def get_scenario(self, options, day):
+        """Función ``número -> (método, ruta, cuerpo)`` para el escenario elegido"""
+        doctor, patient = options['doctor'], options['patient']
+
+        if options['scenario'] == 'events':
+            week_start = day - timedelta(days=day.weekday())
+            path = f'{BASE_PATH}get-events/?start={week_start}&end={week_start + timedelta(days=7)}'
+            return lambda number: ('GET', path, None)
+
+        if options['scenario'] == 'check':
+            def check(number):
+                # Recorre los horarios del día en pasos de 30 minutos
+                slot = datetime.combine(day, datetime.min.time()) + timedelta(minutes=30 * (number % 48))
+                body = {'date': str(day), 'time': slot.strftime('%H:%M'), 'doctor_id': doctor}
+                return 'POST', f'{BASE_PATH}check-availability/', json.dumps(body)
+            return check
+
+        def create(number):
+            # Un horario distinto por petición (un día por cada 48 medias horas)
+            slot = datetime.combine(day, datetime.min.time()) + timedelta(minutes=30 * number)
+            body = {
+                'date': slot.strftime('%Y-%m-%d'), 'time': slot.strftime('%H:%M'),
+                'doctor_id': doctor, 'patient_id': patient,
+            }
+            return 'POST', f'{BASE_PATH}create-appointment/', json.dumps(body)
+        return create
+
+    def build_report(self, options, results, elapsed):
+        return {
+            'label': options['label'],
+            'url': options['url'],
+            'scenario': options['scenario'],
+            'concurrency': options['concurrency'],
+            **benchmark.summarize(results, elapsed),
+        }
@@ -0,0 +1,23 @@
+"""Borrar entradas viejas de la bitácora de cambios de citas.
+
+Los calendarios con un cursor anterior al borrado simplemente recargan el
+rango visible completo.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from scheduler.models import AppointmentChange
+
+
+class Command(BaseCommand):
+    help = 'Borra cambios de citas más antiguos que --days días'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted, _ = AppointmentChange.objects.filter(changed_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'{deleted} cambios borrados'))
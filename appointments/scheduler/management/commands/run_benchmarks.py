@@ -0,0 +1,248 @@
+"""Suite de benchmarks del scheduler con salida JSON.
+
+Corre cada escenario en el proceso (``django.test.Client``, con todo el
+stack de middleware) desde varios hilos a la vez, cada uno con su conexión,
+y reporta peticiones/s, latencias y consultas SQL por petición::
+
+    python manage.py seed_clinic --doctors 20 --patients 50000 --years 3
+    python manage.py run_benchmarks --requests 300 --concurrency 8 --output bench.json
+
+Para comparar commits se guarda un JSON por commit (trae el hash de git) y
+se comparan los mismos escenarios. ``create_appointment`` crea citas a
+varios años en el futuro y las borra al terminar; con SQLite las escrituras
+concurrentes chocan (``database is locked``), así que ahí conviene medirlo
+con ``--concurrency 1``.
+"""
+import json
+import logging
+import platform
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max, Min
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from scheduler import benchmark, cache
+from scheduler.models import Appointment, ClinicalHistory, Doctor, Patient
+
+
+BASE_PATH = '/admin/scheduler/appointment/'
+SCENARIOS = [
+    'events_week', 'events_month', 'check_availability', 'find_slots',
+    'changelist_appointments', 'changelist_patients', 'changelist_history', 'create_appointment',
+]
+
+
+class Command(BaseCommand):
+    help = 'Mide feed del calendario, disponibilidad, horarios libres, changelists y creación de citas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Peticiones medidas por escenario')
+        parser.add_argument('--concurrency', type=int, default=4, help='Hilos simultáneos')
+        parser.add_argument('--warmup', type=int, default=10, help='Peticiones previas sin medir por escenario')
+        parser.add_argument('--only', help=f"Escenarios separados por coma ({', '.join(SCENARIOS)})")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Guardar el reporte JSON en este archivo')
+
+    def handle(self, *args, **options):
+        scenarios = options['only'].split(',') if options['only'] else SCENARIOS
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Escenarios desconocidos: {', '.join(sorted(unknown))}")
+
+        self.random = random.Random(options['seed'])
+        self.load_dataset()
+        self.user, created_user = User.objects.get_or_create(
+            username='benchmark', defaults={'is_staff': True, 'is_superuser': True}
+        )
+        self.created_ids = []
+        self.created_lock = threading.Lock()
+
+        report = {'meta': self.meta(options), 'dataset': self.dataset_counts(), 'scenarios': {}}
+        quiet = [logging.getLogger(name) for name in ('scheduler.metrics', 'scheduler.slow_queries', 'scheduler.admin', 'django.request')]
+        levels = [logger.level for logger in quiet]
+        try:
+            for logger in quiet:
+                logger.setLevel(logging.ERROR)
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                for name in scenarios:
+                    self.stdout.write(f'{name}...', ending=' ')
+                    self.stdout.flush()
+                    result = self.run_scenario(name, options)
+                    report['scenarios'][name] = result
+                    self.stdout.write(f"{result['rps']} req/s, p99 {result['latency_ms']['p99']} ms")
+        finally:
+            for logger, level in zip(quiet, levels):
+                logger.setLevel(level)
+            Appointment.objects.filter(pk__in=self.created_ids).delete()
+            if created_user:
+                self.user.delete()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
+
+    # ─────────────────────────────
+    #   Datos y metadatos
+    # ─────────────────────────────
+
+    def load_dataset(self):
+        self.doctor_ids = list(Doctor.objects.values_list('id', flat=True))
+        self.patient_ids = list(Patient.objects.values_list('id', flat=True)[:10000])
+        self.patient_names = list(Patient.objects.values_list('full_name', flat=True)[:500])
+        services = cache.get_services()
+        if not (self.doctor_ids and self.patient_ids and services):
+            raise CommandError('No hay datos; genere una clínica con seed_clinic')
+        self.service = min(services, key=lambda service: service.duration)
+        bounds = Appointment.objects.aggregate(first=Min('date'), last=Max('date'))
+        today = timezone.localdate()
+        self.first_day = bounds['first'] or today
+        self.last_day = bounds['last'] or today + timedelta(days=30)
+
+    def dataset_counts(self):
+        return {
+            'doctors': len(self.doctor_ids),
+            'patients': Patient.objects.count(),
+            'appointments': Appointment.objects.count(),
+            'clinical_histories': ClinicalHistory.objects.count(),
+            'first_day': self.first_day.isoformat(),
+            'last_day': self.last_day.isoformat(),
+        }
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=5
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            commit = None
+        return {
+            'commit': commit,
+            'timestamp': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+        }
+
+    # ─────────────────────────────
+    #   Escenarios
+    # ─────────────────────────────
+
+    def random_day(self):
+        return self.first_day + timedelta(days=self.random.randrange((self.last_day - self.first_day).days + 1))
+
+    def build_requests(self, name, total):
+        """Lista de ``(método, ruta, cuerpo)``; se arma antes de medir"""
+        items = []
+        if name == 'create_appointment':
+            return self.create_requests(total)
+        for _ in range(total):
+            if name in ('events_week', 'events_month'):
+                start = self.random_day()
+                end = start + timedelta(days=7 if name == 'events_week' else 35)
+                items.append(('GET', f'{BASE_PATH}get-events/?start={start}&end={end}', None))
+            elif name == 'check_availability':
+                moment = datetime.combine(timezone.localdate() + timedelta(days=self.random.randrange(1, 60)),
+                                          datetime.min.time()) + timedelta(minutes=15 * self.random.randrange(32, 80))
+                body = {'date': f'{moment:%Y-%m-%d}', 'time': f'{moment:%H:%M}',
+                        'doctor_id': self.random.choice(self.doctor_ids), 'service_id': self.service.pk}
+                items.append(('POST', f'{BASE_PATH}check-availability/', json.dumps(body)))
+            elif name == 'find_slots':
+                start = timezone.localdate() + timedelta(days=self.random.randrange(0, 30))
+                items.append(('GET', f'{BASE_PATH}find-slots/?doctor_id={self.random.choice(self.doctor_ids)}'
+                                     f'&service_id={self.service.pk}&start={start}&end={start + timedelta(days=14)}', None))
+            elif name == 'changelist_appointments':
+                items.append(('GET', f'{BASE_PATH}?p={self.random.randrange(1, 6)}', None))
+            elif name == 'changelist_patients':
+                term = self.random.choice(self.patient_names).split()[0]
+                items.append(('GET', f'/admin/scheduler/patient/?q={term}', None))
+            elif name == 'changelist_history':
+                items.append(('GET', f'/admin/scheduler/clinicalhistory/?p={self.random.randrange(1, 6)}', None))
+        return items
+
+    def create_requests(self, total):
+        """Horarios libres distintos, años después de la última cita"""
+        items = []
+        day = max(self.last_day, timezone.localdate()) + timedelta(days=365 * 2)
+        schedules = cache.get_schedules(self.doctor_ids)
+        if not any(schedules.values()):
+            raise CommandError('Ningún doctor tiene horario laboral')
+        while len(items) < total:
+            for doctor_id in self.doctor_ids:
+                for block_start, block_end in schedules[doctor_id].get(day.weekday() + 1, ()):
+                    slot = datetime.combine(day, block_start)
+                    while slot + self.service.duration <= datetime.combine(day, block_end) and len(items) < total:
+                        body = {'date': f'{day:%Y-%m-%d}', 'time': f'{slot:%H:%M}', 'doctor_id': doctor_id,
+                                'patient_id': self.random.choice(self.patient_ids), 'service_id': self.service.pk}
+                        items.append(('POST', f'{BASE_PATH}create-appointment/', json.dumps(body)))
+                        slot += self.service.duration
+            day += timedelta(days=1)
+        self.random.shuffle(items)
+        return items
+
+    def run_scenario(self, name, options):
+        warmup = [] if name == 'create_appointment' else self.build_requests(name, options['warmup'])
+        measured = self.build_requests(name, options['requests'])
+        local = threading.local()
+
+        def count_query(execute, sql, params, many, context):
+            local.queries += 1
+            return execute(sql, params, many, context)
+
+        def send(item):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+                local.client.force_login(self.user)
+            method, path, body = item
+            local.queries = 0
+            started = time.perf_counter()
+            try:
+                with connection.execute_wrapper(count_query):
+                    if method == 'GET':
+                        response = local.client.get(path)
+                    else:
+                        response = local.client.post(path, body, content_type='application/json')
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                status = response.status_code
+                if name == 'create_appointment' and status == 200:
+                    with self.created_lock:
+                        self.created_ids.append(json.loads(response.content)['appointment_id'])
+            except Exception:
+                status = None
+            return (status, time.perf_counter() - started), local.queries
+
+        def worker(items):
+            try:
+                return [send(item) for item in items]
+            finally:
+                connection.close()
+
+        def split(items):
+            return [items[i::options['concurrency']] for i in range(options['concurrency'])]
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            list(executor.map(worker, split(warmup)))
+            started = time.perf_counter()
+            outcomes = [outcome for chunk in executor.map(worker, split(measured)) for outcome in chunk]
+            elapsed = time.perf_counter() - started
+
+        queries = [count for _, count in outcomes]
+        return {
+            **benchmark.summarize([result for result, _ in outcomes], elapsed),
+            'db_queries_avg': round(sum(queries) / len(queries), 2) if queries else None,
+        }
@@ -0,0 +1,77 @@
+"""Prueba de estrés de reservas concurrentes sobre un mismo horario.
+
+Lanza muchas reservas simultáneas (hilos, cada uno con su conexión) para el
+mismo doctor, fecha y hora, y verifica que exactamente una gana y que ningún
+intento termina con error. Pensado para correr contra PostgreSQL (con SQLite
+las escrituras concurrentes fallan con ``database is locked``)::
+
+    python manage.py stress_booking --doctor 1 --patient 1 --service 1 \\
+        --date 2030-01-07 --time 10:00 --threads 300
+"""
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from scheduler import engine
+from scheduler.models import Doctor, Patient, Service
+
+
+class Command(BaseCommand):
+    help = 'Reserva el mismo horario desde muchos hilos y verifica que solo una reserva gane'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctor', type=int, required=True)
+        parser.add_argument('--patient', type=int, required=True)
+        parser.add_argument('--service', type=int, required=True)
+        parser.add_argument('--date', required=True, help='YYYY-MM-DD')
+        parser.add_argument('--time', required=True, help='HH:MM')
+        parser.add_argument('--threads', type=int, default=200)
+        parser.add_argument('--keep', action='store_true',
+                            help='No borrar la cita ganadora al terminar')
+
+    def handle(self, *args, **options):
+        try:
+            doctor = Doctor.objects.get(pk=options['doctor'])
+            patient = Patient.objects.get(pk=options['patient'])
+            service = Service.objects.get(pk=options['service'])
+            day = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            start_time = datetime.strptime(options['time'], '%H:%M').time()
+        except (Doctor.DoesNotExist, Patient.DoesNotExist, Service.DoesNotExist, ValueError) as e:
+            raise CommandError(str(e))
+
+        threads = options['threads']
+        barrier = threading.Barrier(threads)
+
+        def attempt(_):
+            try:
+                barrier.wait()
+                appointment = engine.book_appointment(doctor, patient, service, day, start_time)
+                return ('won', appointment.pk)
+            except engine.SlotUnavailable as e:
+                return (e.availability.reason, None)
+            except Exception as e:
+                return (f'error: {type(e).__name__}', None)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(attempt, range(threads)))
+
+        outcomes = Counter(outcome for outcome, _ in results)
+        for outcome, total in sorted(outcomes.items()):
+            self.stdout.write(f'{outcome}: {total}')
+
+        winners = [pk for outcome, pk in results if outcome == 'won']
+        if not options['keep'] and winners:
+            doctor.appointments.filter(pk__in=winners).delete()
+
+        errors = sum(total for outcome, total in outcomes.items() if outcome.startswith('error:'))
+        if errors:
+            raise CommandError(f'{errors} intentos terminaron con error; la prueba no es concluyente')
+        if len(winners) != 1:
+            raise CommandError(f'Se esperaba exactamente 1 reserva ganadora, hubo {len(winners)}')
+        self.stdout.write(self.style.SUCCESS(f'OK: 1 reserva ganadora de {threads} intentos'))
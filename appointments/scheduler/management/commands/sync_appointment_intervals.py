@@ -0,0 +1,35 @@
+"""Calcular ``starts_at``/``ends_at`` de las citas.
+
+``migrate`` ya llena las citas que no los tienen; este comando sirve para
+tablas grandes (con avance en pantalla) o para recalcular todas con
+``--all``, por ejemplo después de cambiar ``TIME_ZONE``.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from scheduler import engine
+from scheduler.models import Appointment
+
+
+class Command(BaseCommand):
+    help = 'Llena o recalcula el intervalo con zona horaria de las citas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recalcular todas, no solo las faltantes')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        queryset = Appointment.objects.all()
+        if not options['all']:
+            queryset = queryset.filter(starts_at__isnull=True)
+
+        started = time.perf_counter()
+        total = engine.sync_intervals(
+            queryset, batch_size=options['batch_size'],
+            progress=lambda count: self.stdout.write(f'{count} citas', ending='\r'),
+        )
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} citas actualizadas en {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,355 @@
+"""Métricas de rendimiento por petición y por vista.
+
+Por cada petición (``MetricsMiddleware``) y por cada vista del scheduler
+(``@instrument``) se mide el tiempo total, el número de consultas y el
+tiempo en base de datos. Los resultados:
+
+* se escriben como log estructurado en ``scheduler.metrics``;
+* se acumulan en histogramas del proceso que ``render_prometheus`` expone
+  en formato de texto de Prometheus (``/metrics/``);
+* las consultas que tardan más de ``SCHEDULER_SLOW_QUERY_MS`` se registran
+  en ``scheduler.slow_queries`` con la plantilla SQL y el número de
+  parámetros; los valores solo con ``SCHEDULER_SLOW_QUERY_LOG_PARAMS``
+  (datos de pacientes, solo para depurar).
+
+Las consultas se cuentan con un ``execute_wrapper`` instalado en cada
+conexión y una variable de contexto, así que funciona igual en vistas
+síncronas y asíncronas (el contexto viaja a los hilos de ``sync_to_async``).
+``SCHEDULER_METRICS_ENABLED = False`` lo desactiva todo.
+"""
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+
+logger = logging.getLogger('scheduler.metrics')
+slow_query_logger = logging.getLogger('scheduler.slow_queries')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+
+def enabled():
+    return getattr(settings, 'SCHEDULER_METRICS_ENABLED', True)
+
+
+def slow_query_seconds():
+    return getattr(settings, 'SCHEDULER_SLOW_QUERY_MS', 200) / 1000
+
+
+def log_query_params():
+    return getattr(settings, 'SCHEDULER_SLOW_QUERY_LOG_PARAMS', False)
+
+
+class Histogram:
+    """Histograma acumulativo por etiqueta, seguro entre hilos"""
+
+    def __init__(self, name, help_text, label, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_value, series in sorted(self._series.items()):
+                label = f'{self.label}="{label_value}"'
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{{label}}} {series["sum"]:.6f}')
+                lines.append(f'{self.name}_count{{{label}}} {series["count"]}')
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Family:
+    """Tiempo total, consultas y tiempo en base de datos de una etiqueta"""
+
+    def __init__(self, prefix, label, what):
+        self.duration = Histogram(f'{prefix}_duration_seconds', f'Tiempo total por {what}', label, DURATION_BUCKETS)
+        self.queries = Histogram(f'{prefix}_db_queries', f'Consultas SQL por {what}', label, QUERY_BUCKETS)
+        self.db_time = Histogram(f'{prefix}_db_seconds', f'Tiempo en base de datos por {what}', label, DURATION_BUCKETS)
+
+    def observe(self, label_value, sample):
+        self.duration.observe(label_value, sample.duration)
+        self.queries.observe(label_value, sample.queries)
+        self.db_time.observe(label_value, sample.db_time)
+
+    def histograms(self):
+        return (self.duration, self.queries, self.db_time)
+
+
+requests = Family('scheduler_http_request', 'route', 'petición')
+views = Family('scheduler_view', 'view', 'vista del scheduler')
+
+
+class Sample:
+    """Mediciones de una petición o vista en curso"""
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+
+    def add_query(self, elapsed):
+        sample = self
+        while sample is not None:
+            sample.queries += 1
+            sample.db_time += elapsed
+            sample = sample.parent
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+        return self
+
+
+_current = contextvars.ContextVar('scheduler_metrics_sample', default=None)
+
+
+# ─────────────────────────────
+#   Conteo de consultas
+# ─────────────────────────────
+
+def record_query(execute, sql, params, many, context):
+    """``execute_wrapper``: cuenta la consulta y registra las lentas"""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        sample = _current.get()
+        if sample is not None:
+            sample.add_query(elapsed)
+        if elapsed >= slow_query_seconds():
+            record = {
+                'duration_ms': round(elapsed * 1000, 2),
+                # Solo la plantilla: los parámetros traen nombres y teléfonos de pacientes
+                'sql': sql,
+                'param_count': len(params) if params is not None else 0,
+                'endpoint': sample.name if sample else None,
+            }
+            if log_query_params() and not many:
+                record['params'] = repr(params)
+            slow_query_logger.warning('slow query', extra={'metrics': record})
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """Receptor de ``connection_created``: instalar ``record_query`` una vez"""
+    if enabled() and record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder, dispatch_uid='scheduler_metrics_query_recorder')
+
+
+# ─────────────────────────────
+#   Middleware y decorador
+# ─────────────────────────────
+
+def _start(name):
+    sample = Sample(name, parent=_current.get())
+    token = _current.set(sample)
+    return sample, token
+
+
+def _finish(sample, family, label_value, status=None):
+    sample.finish()
+    family.observe(label_value, sample)
+    logger.info(label_value, extra={'metrics': {
+        'kind': 'request' if family is requests else 'view',
+        'name': label_value,
+        'status': status,
+        'duration_ms': round(sample.duration * 1000, 2),
+        'db_queries': sample.queries,
+        'db_ms': round(sample.db_time * 1000, 2),
+    }})
+
+
+def _finish_after_stream(response, sample, finish):
+    """Seguir midiendo mientras se envía una respuesta en streaming.
+
+    Las consultas del stream ocurren después de que la vista regresa, así
+    que la muestra se reactiva alrededor de cada bloque.
+    """
+    content = response.streaming_content
+    if response.is_async:
+        async def wrapped():
+            iterator = content.__aiter__()
+            try:
+                while True:
+                    token = _current.set(sample)
+                    try:
+                        chunk = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        _current.reset(token)
+                    yield chunk
+            finally:
+                finish()
+    else:
+        def wrapped():
+            iterator = iter(content)
+            try:
+                while True:
+                    token = _current.set(sample)
+                    try:
+                        chunk = next(iterator)
+                    except StopIteration:
+                        return
+                    finally:
+                        _current.reset(token)
+                    yield chunk
+            finally:
+                finish()
+    response.streaming_content = wrapped()
+    return response
+
+
+def _measure_response(response, sample, family, label_value):
+    finish = functools.partial(_finish, sample, family, label_value, getattr(response, 'status_code', None))
+    if getattr(response, 'streaming', False):
+        return _finish_after_stream(response, sample, finish)
+    finish()
+    return response
+
+
+def instrument(name):
+    """Decorador de vistas del scheduler (síncronas o asíncronas)"""
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(*args, **kwargs):
+                if not enabled():
+                    return await view(*args, **kwargs)
+                sample, token = _start(name)
+                try:
+                    response = await view(*args, **kwargs)
+                finally:
+                    _current.reset(token)
+                return _measure_response(response, sample, views, name)
+        else:
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if not enabled():
+                    return view(*args, **kwargs)
+                sample, token = _start(name)
+                try:
+                    response = view(*args, **kwargs)
+                finally:
+                    _current.reset(token)
+                return _measure_response(response, sample, views, name)
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    """Mide cada petición, etiquetada por el nombre de la URL resuelta"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not enabled():
+            return self.get_response(request)
+        sample, token = _start(request.path)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return _measure_response(response, sample, requests, self.route(request))
+
+    async def __acall__(self, request):
+        if not enabled():
+            return await self.get_response(request)
+        sample, token = _start(request.path)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return _measure_response(response, sample, requests, self.route(request))
+
+    def route(self, request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return 'unresolved'
+        return match.view_name or match.route
+
+
+# ─────────────────────────────
+#   Exposición
+# ─────────────────────────────
+
+def render_prometheus():
+    """Histogramas del proceso (y la caché de referencia) en formato de texto"""
+    from . import cache
+
+    lines = []
+    for family in (requests, views):
+        for histogram in family.histograms():
+            lines.extend(histogram.render())
+
+    lines.append('# HELP scheduler_cache_lookups_total Lecturas de la caché de referencia por resultado')
+    lines.append('# TYPE scheduler_cache_lookups_total counter')
+    for namespace, counts in sorted(cache.stats().items()):
+        for outcome in ('local', 'shared', 'miss'):
+            lines.append(f'scheduler_cache_lookups_total{{namespace="{namespace}",outcome="{outcome}"}} {counts[outcome]}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    for family in (requests, views):
+        for histogram in family.histograms():
+            histogram.reset()
+
+
+class JSONFormatter(logging.Formatter):
+    """Una línea JSON por registro, con los campos de ``extra={'metrics': ...}``"""
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        data.update(getattr(record, 'metrics', {}))
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
@@ -1,5 +1,8 @@
+from datetime import datetime
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 # ─────────────────────────────
@@ -51,6 +54,11 @@ class Patient(models.Model):
         verbose_name = "Patient"
         verbose_name_plural = "Pacientes"
         ordering = ['full_name']
+        indexes = [
+            # Autocompletado y búsqueda del admin
+            models.Index(fields=['full_name', 'id'], name='patient_full_name_idx'),
+            models.Index(fields=['phone'], name='patient_phone_idx'),
+        ]
 
 
 # ─────────────────────────────
@@ -107,6 +115,10 @@ class Service(models.Model):
 #           Citas
 # ─────────────────────────────
 
+# Estados que ocupan el horario del doctor
+ACTIVE_STATUSES = ('scheduled', 'pending')
+
+
 class Appointment(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='appointments')
     doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='appointments')
@@ -116,21 +128,105 @@ class Appointment(models.Model):
     time = models.TimeField()
     description = models.TextField(blank=True)
 
+    # Intervalo [inicio, fin) con zona horaria, derivado de fecha, hora y
+    # duración del servicio. Permite consultar traslapes como un solo rango.
+    starts_at = models.DateTimeField(null=True, editable=False)
+    ends_at = models.DateTimeField(null=True, editable=False)
+
     status = models.CharField(max_length=20, choices=[
         ('scheduled', 'Scheduled'),
         ('completed', 'Completed'),
         ('cancelled', 'Cancelled')
     ], default='scheduled')
+    # Precio del servicio al completarse la cita: los reportes de meses
+    # cerrados no cambian si después cambia el precio del servicio
+    price = models.DecimalField(max_digits=6, decimal_places=2, null=True, editable=False)
 
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.date} {self.time} - {self.patient} with {self.doctor}"
 
+    def sync_interval(self, duration=None):
+        """Calcular ``starts_at``/``ends_at`` en la zona horaria de la clínica.
+
+        ``bulk_create`` no pasa por ``save``: quien lo use debe llamarlo
+        antes, idealmente con la duración ya conocida.
+        """
+        if duration is None:
+            duration = self.service.duration
+        self.starts_at = timezone.make_aware(
+            datetime.combine(self.date, self.time), timezone.get_default_timezone()
+        )
+        self.ends_at = self.starts_at + duration
+
+    def save(self, *args, **kwargs):
+        self.sync_interval()
+        if self.status == 'completed' and self.price is None:
+            self.price = self.service.price
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            extra = set()
+            if {'date', 'time', 'service'} & set(update_fields):
+                extra |= {'starts_at', 'ends_at'}
+            if 'status' in update_fields:
+                extra.add('price')
+            kwargs['update_fields'] = {*update_fields, *extra}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Appointment"
         verbose_name_plural = "Citas"
         ordering = ['-date', '-time']
+        indexes = [
+            # Disponibilidad, creación y calendario filtrado por doctor
+            models.Index(fields=['doctor', 'date', 'time'], name='appt_doctor_date_time_idx'),
+            # Orden y paginación por llave del changelist
+            models.Index(fields=['-date', '-time', '-id'], name='appt_date_time_idx'),
+            # list_filter por estado
+            models.Index(fields=['status', '-date', '-time'], name='appt_status_date_idx'),
+            # Traslapes por rango: calendario, disponibilidad y reportes
+            models.Index(fields=['doctor', 'starts_at', 'ends_at'], name='appt_doctor_range_idx'),
+            models.Index(fields=['starts_at', 'ends_at'], name='appt_range_idx'),
+        ]
+        constraints = [
+            # Un doctor no puede tener dos citas activas que empiecen a la vez.
+            # El índice parcial también sirve a las consultas de disponibilidad.
+            models.UniqueConstraint(
+                fields=['doctor', 'date', 'time'],
+                condition=models.Q(status__in=ACTIVE_STATUSES),
+                name='appt_unique_active_slot',
+            ),
+        ]
+
+
+class AppointmentChange(models.Model):
+    """Bitácora de cambios de citas, solo de inserción.
+
+    Su ``id`` creciente sirve de cursor para la sincronización incremental
+    del calendario. No es FK para conservar los registros de citas borradas.
+    """
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+
+    appointment_id = models.BigIntegerField()
+    doctor_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=[
+        (CREATED, 'Created'),
+        (UPDATED, 'Updated'),
+        (DELETED, 'Deleted'),
+    ])
+    changed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"#{self.id} {self.action} cita {self.appointment_id}"
+
+    class Meta:
+        verbose_name = "Appointment Change"
+        verbose_name_plural = "Cambios de Citas"
+        ordering = ['id']
 
 
 # ─────────────────────────────
@@ -160,3 +256,42 @@ class ClinicalHistory(models.Model):
         verbose_name_plural = "Historiales Clínicos"
         ordering = ['-appointment__date']
 
+
+
+# ─────────────────────────────
+#   Estadísticas diarias
+# ─────────────────────────────
+
+class DailyStat(models.Model):
+    """Resumen por doctor, servicio y día para los reportes.
+
+    Lo mantienen las señales de ``Appointment`` (y ``stats.record_bulk`` en
+    las cargas masivas); ``rebuild_daily_stats`` lo recalcula desde las citas.
+    """
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='daily_stats')
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+
+    bookings = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+    # Minutos de las citas no canceladas
+    booked_minutes = models.IntegerField(default=0)
+    # Precio cobrado (``Appointment.price``) de las citas completadas
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.date} {self.doctor} - {self.service}"
+
+    class Meta:
+        verbose_name = "Daily Stat"
+        verbose_name_plural = "Estadísticas Diarias"
+        ordering = ['date']
+        indexes = [
+            # Reportes filtrados por doctor
+            models.Index(fields=['doctor', 'date'], name='dailystat_doctor_date_idx'),
+        ]
+        constraints = [
+            # Primero la fecha: los reportes por mes o año son un rango sobre ella
+            models.UniqueConstraint(fields=['date', 'doctor', 'service'], name='dailystat_unique_day'),
+        ]
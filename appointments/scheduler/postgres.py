@@ -0,0 +1,186 @@
+"""Objetos y controles de base de datos exclusivos de PostgreSQL.
+
+El resto de la app funciona en cualquier motor; lo que solo existe en
+PostgreSQL (extensiones, índices trigram, la restricción de exclusión de
+traslapes) se instala aquí después de cada ``migrate`` con sentencias
+idempotentes, y se omite en otros motores.
+
+También define los límites de tiempo por consulta (``statement_timeout``):
+uno corto para las vistas interactivas del calendario y otro largo para
+reportes y exportaciones. En otros motores son no-ops.
+"""
+import asyncio
+import functools
+import logging
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+
+
+logger = logging.getLogger(__name__)
+
+
+# Índices trigram para las búsquedas ``icontains`` del admin. Django las
+# traduce a ``UPPER(col) LIKE UPPER(%s)``, por eso el índice es sobre UPPER().
+TRIGRAM_INDEXES = [
+    ('scheduler_doctor', 'doctor_full_name_trgm_idx', 'full_name'),
+    ('scheduler_doctor', 'doctor_specialty_trgm_idx', 'specialty'),
+    ('scheduler_patient', 'patient_full_name_trgm_idx', 'full_name'),
+    ('scheduler_clinicalhistory', 'history_diagnosis_trgm_idx', 'diagnosis'),
+]
+
+# Dos citas activas del mismo doctor no pueden traslaparse. La restricción
+# única de Django solo impide que empiecen a la misma hora; esta compara los
+# intervalos completos (btree_gist permite mezclar ``=`` con ``&&``).
+OVERLAP_CONSTRAINT = 'appt_no_active_overlap'
+OVERLAP_CONSTRAINT_SQL = (
+    f'ALTER TABLE scheduler_appointment ADD CONSTRAINT {OVERLAP_CONSTRAINT} '
+    "EXCLUDE USING gist (doctor_id WITH =, tstzrange(starts_at, ends_at, '[)') WITH &&) "
+    "WHERE (status IN ('scheduled', 'pending') AND starts_at IS NOT NULL)"
+)
+
+
+def install_postgres_extras(using='default', **kwargs):
+    """Receptor de ``post_migrate``: crear extensiones e índices de PostgreSQL"""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+
+    tables = set(connection.introspection.table_names())
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table, index_name, column in TRIGRAM_INDEXES:
+            if table not in tables:
+                continue
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {index_name} '
+                f'ON {table} USING gin (UPPER({column}) gin_trgm_ops)'
+            )
+
+        if 'scheduler_appointment' in tables:
+            install_overlap_constraint(connection, cursor)
+
+
+def install_overlap_constraint(connection, cursor):
+    """Crear la restricción de exclusión si no existe.
+
+    Si ya hay citas activas traslapadas no se puede crear; se avisa en el
+    log y se reintenta en el siguiente ``migrate``.
+    """
+    cursor.execute('SELECT 1 FROM pg_constraint WHERE conname = %s', [OVERLAP_CONSTRAINT])
+    if cursor.fetchone():
+        return
+    cursor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    try:
+        with transaction.atomic(using=connection.alias):
+            cursor.execute(OVERLAP_CONSTRAINT_SQL)
+    except DatabaseError as e:
+        logger.warning('No se pudo crear %s (¿citas traslapadas?): %s', OVERLAP_CONSTRAINT, e)
+
+
+# ─────────────────────────────
+#   Límites de tiempo por consulta
+# ─────────────────────────────
+
+def interactive_timeout_ms():
+    """Límite de las vistas del calendario (ms, 0 = sin límite)"""
+    return getattr(settings, 'SCHEDULER_STATEMENT_TIMEOUT', 3000)
+
+
+def report_timeout_ms():
+    """Límite de reportes y exportaciones (ms, 0 = sin límite)"""
+    return getattr(settings, 'SCHEDULER_REPORT_STATEMENT_TIMEOUT', 120000)
+
+
+def set_statement_timeout(milliseconds, using=DEFAULT_DB_ALIAS):
+    """Fijar ``statement_timeout`` en la conexión (nivel sesión)"""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT set_config(%s, %s, false)', ['statement_timeout', str(int(milliseconds))])
+
+
+def reset_statement_timeout(using=DEFAULT_DB_ALIAS):
+    """Regresar ``statement_timeout`` al valor de la conexión.
+
+    Necesario con el pool: la conexión vuelve al pool con su configuración
+    de sesión y la recibe la siguiente petición.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql' or connection.connection is None:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SET statement_timeout TO DEFAULT')
+
+
+@contextmanager
+def statement_timeout(milliseconds, using=DEFAULT_DB_ALIAS):
+    """Ejecutar un bloque con otro ``statement_timeout``"""
+    set_statement_timeout(milliseconds, using)
+    try:
+        yield
+    finally:
+        reset_statement_timeout(using)
+
+
+def _close_after_stream(response, using):
+    """Restablecer el límite cuando termine de enviarse una respuesta en streaming"""
+    content = response.streaming_content
+    if response.is_async:
+        async def wrapped():
+            try:
+                async for chunk in content:
+                    yield chunk
+            finally:
+                await sync_to_async(reset_statement_timeout)(using)
+    else:
+        def wrapped():
+            try:
+                yield from content
+            finally:
+                reset_statement_timeout(using)
+    response.streaming_content = wrapped()
+    return response
+
+
+def with_statement_timeout(get_milliseconds, using=DEFAULT_DB_ALIAS):
+    """Decorador de vistas (síncronas o asíncronas) que aplica un límite.
+
+    Si la vista regresa una respuesta en streaming, el límite sigue vigente
+    mientras se envía y se restablece al terminar.
+    """
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(*args, **kwargs):
+                await sync_to_async(set_statement_timeout)(get_milliseconds(), using)
+                streaming = False
+                try:
+                    response = await view(*args, **kwargs)
+                    streaming = getattr(response, 'streaming', False)
+                    return _close_after_stream(response, using) if streaming else response
+                finally:
+                    if not streaming:
+                        await sync_to_async(reset_statement_timeout)(using)
+        else:
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                set_statement_timeout(get_milliseconds(), using)
+                streaming = False
+                try:
+                    response = view(*args, **kwargs)
+                    streaming = getattr(response, 'streaming', False)
+                    return _close_after_stream(response, using) if streaming else response
+                finally:
+                    if not streaming:
+                        reset_statement_timeout(using)
+        return wrapper
+    return decorator
+
+
+# Límites listos para usar en vistas
+interactive_timeout = with_statement_timeout(interactive_timeout_ms)
+report_timeout = with_statement_timeout(report_timeout_ms)
@@ -0,0 +1,136 @@
+"""Pub/sub de cambios de agenda para las conexiones SSE del calendario.
+
+El backend se elige con ``SCHEDULER_PUBSUB_BACKEND``:
+
+* ``scheduler.pubsub.LocalBroker`` (por defecto): en memoria, reparte los
+  mensajes entre las conexiones abiertas del mismo proceso.
+* ``scheduler.pubsub.RedisBroker``: usa Redis (o cualquier servidor
+  compatible) en ``SCHEDULER_PUBSUB_URL`` para repartir entre workers.
+  Requiere el paquete ``redis``.
+
+Publicar es síncrono (se llama desde señales y vistas síncronas); suscribirse
+es un iterador asíncrono, así cada conexión abierta no ocupa un hilo.
+"""
+import asyncio
+import json
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+CLINIC_CHANNEL = 'clinic'
+
+
+def doctor_channel(doctor_id):
+    return f'doctor:{doctor_id}'
+
+
+class LocalBroker:
+    """Broker en memoria del proceso"""
+
+    # Mensajes pendientes por conexión antes de descartar (cliente lento)
+    queue_size = 100
+
+    def __init__(self, **kwargs):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        data = json.dumps(message)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue, channels in subscribers:
+            if channel in channels:
+                try:
+                    loop.call_soon_threadsafe(self._deliver, queue, data)
+                except RuntimeError:
+                    # El loop de esa conexión ya se cerró
+                    pass
+
+    @staticmethod
+    def _deliver(queue, data):
+        try:
+            queue.put_nowait(data)
+        except asyncio.QueueFull:
+            pass
+
+    async def subscribe(self, channels):
+        """Iterar los mensajes (JSON) publicados en ``channels``"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        subscriber = (asyncio.get_running_loop(), queue, frozenset(channels))
+        with self._lock:
+            self._subscribers.add(subscriber)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+
+class RedisBroker:
+    """Broker sobre Redis PUBLISH/SUBSCRIBE, compartido entre workers"""
+
+    prefix = 'scheduler:'
+
+    def __init__(self, url=None, **kwargs):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('RedisBroker requiere el paquete "redis"')
+        self.url = url or 'redis://localhost:6379/0'
+        self._client = redis.Redis.from_url(self.url)
+
+    def publish(self, channel, message):
+        self._client.publish(self.prefix + channel, json.dumps(message))
+
+    async def subscribe(self, channels):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(*[self.prefix + channel for channel in channels])
+        try:
+            async for item in pubsub.listen():
+                if item['type'] == 'message':
+                    data = item['data']
+                    yield data.decode() if isinstance(data, bytes) else data
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Instancia única del broker configurado"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                backend = getattr(settings, 'SCHEDULER_PUBSUB_BACKEND', 'scheduler.pubsub.LocalBroker')
+                _broker = import_string(backend)(url=getattr(settings, 'SCHEDULER_PUBSUB_URL', None))
+    return _broker
+
+
+def publish_change(change):
+    """Avisar de un ``AppointmentChange`` a la clínica y al canal del doctor"""
+    message = {
+        'cursor': change.id,
+        'action': change.action,
+        'id': str(change.appointment_id),
+        'doctor_id': change.doctor_id,
+    }
+    broker = get_broker()
+    broker.publish(CLINIC_CHANNEL, message)
+    broker.publish(doctor_channel(change.doctor_id), message)
+
+
+def publish_reload():
+    """Pedir a los calendarios abiertos que recarguen su rango completo
+    (después de cargas masivas que no pasan por la bitácora)"""
+    get_broker().publish(CLINIC_CHANNEL, {'action': 'reload'})
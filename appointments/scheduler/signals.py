@@ -0,0 +1,162 @@
+import logging
+
+from django.db import connections
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import cache, changes, engine, stats
+from .models import Appointment, AppointmentChange, Doctor, Service, Weekday, WorkingHour
+
+logger = logging.getLogger(__name__)
+
+
+# ─────────────────────────────
+#   Invalidación de caché
+# ─────────────────────────────
+
+@receiver(pre_save, sender=WorkingHour)
+def remember_working_hour_doctor(sender, instance, **kwargs):
+    # Si el bloque cambia de doctor hay que invalidar también al anterior
+    if instance.pk:
+        instance._previous_doctor_id = (
+            WorkingHour.objects.filter(pk=instance.pk).values_list('doctor_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=WorkingHour)
+@receiver(post_delete, sender=WorkingHour)
+def invalidate_working_hour(sender, instance, **kwargs):
+    cache.invalidate_schedule(instance.doctor_id)
+    previous = getattr(instance, '_previous_doctor_id', None)
+    if previous and previous != instance.doctor_id:
+        cache.invalidate_schedule(previous)
+
+
+@receiver(post_save, sender=Weekday)
+@receiver(post_delete, sender=Weekday)
+def invalidate_weekday(sender, instance, **kwargs):
+    cache.invalidate_all_schedules()
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+def invalidate_doctor(sender, instance, **kwargs):
+    cache.invalidate_schedule(instance.pk)
+    cache.invalidate(cache.DOCTORS)
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def invalidate_services(sender, instance, **kwargs):
+    cache.invalidate(cache.SERVICES)
+
+
+# ─────────────────────────────
+#   Intervalo de las citas
+# ─────────────────────────────
+
+@receiver(pre_save, sender=Service)
+def remember_service_duration(sender, instance, **kwargs):
+    if instance.pk:
+        instance._previous_duration = (
+            Service.objects.filter(pk=instance.pk).values_list('duration', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Service)
+def sync_service_appointments(sender, instance, created, raw=False, **kwargs):
+    """Cambió la duración: recalcular el fin de las citas futuras del servicio.
+
+    Las citas pasadas conservan la duración con la que se atendieron. Si el
+    cambio traslapa citas activas, el formulario del admin lo rechaza antes
+    (``engine.duration_conflicts``); fuera del admin, en PostgreSQL, la
+    restricción ``appt_no_active_overlap`` aborta el guardado.
+    """
+    previous = getattr(instance, '_previous_duration', None)
+    if raw or created or previous is None or previous == instance.duration:
+        return
+    future = Appointment.objects.filter(service=instance, starts_at__gte=timezone.now())
+    appointments = list(future.only('id', 'doctor_id'))
+    if not appointments:
+        return
+    # updated_at cambia la versión (ETag) de get-events/; la bitácora avisa
+    # a changes/ y al stream SSE
+    future.filter(pk__in=[appointment.pk for appointment in appointments]).update(
+        ends_at=F('starts_at') + instance.duration, updated_at=timezone.now()
+    )
+    changes.record_bulk(appointments, AppointmentChange.UPDATED)
+
+
+def fill_missing_intervals(using='default', **kwargs):
+    """Receptor de ``post_migrate``: llenar ``starts_at``/``ends_at`` faltantes.
+
+    Hace las veces de migración de datos para las citas creadas antes de las
+    columnas; si no falta ninguna cuesta una consulta.
+    """
+    if Appointment._meta.db_table not in connections[using].introspection.table_names():
+        return
+    missing = Appointment.objects.using(using).filter(starts_at__isnull=True)
+    if missing.exists():
+        total = engine.sync_intervals(missing)
+        logger.info('Intervalos calculados para %s citas', total)
+
+
+# ─────────────────────────────
+#   Bitácora de cambios de citas
+# ─────────────────────────────
+
+@receiver(post_save, sender=Appointment)
+def log_appointment_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    changes.record_change(instance, AppointmentChange.CREATED if created else AppointmentChange.UPDATED)
+
+
+@receiver(post_delete, sender=Appointment)
+def log_appointment_deleted(sender, instance, **kwargs):
+    changes.record_change(instance, AppointmentChange.DELETED)
+
+
+# ─────────────────────────────
+#   Estadísticas diarias
+# ─────────────────────────────
+
+@receiver(pre_save, sender=Appointment)
+def remember_appointment_stats(sender, instance, raw=False, **kwargs):
+    # Aporte anterior de la cita, para aplicar solo la diferencia
+    instance._previous_stats = None
+    if instance.pk and not raw:
+        previous = Appointment.objects.filter(pk=instance.pk).values_list(
+            'doctor_id', 'service_id', 'date', 'status', 'starts_at', 'ends_at', 'price'
+        ).first()
+        if previous:
+            doctor_id, service_id, day, status, starts_at, ends_at, price = previous
+            instance._previous_stats = (
+                (doctor_id, service_id, day), stats.contribution(status, service_id, starts_at, ends_at, price)
+            )
+
+
+@receiver(post_save, sender=Appointment)
+def update_appointment_stats(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    stats.record_change(getattr(instance, '_previous_stats', None), stats.snapshot(instance))
+
+
+@receiver(post_delete, sender=Appointment)
+def remove_appointment_stats(sender, instance, **kwargs):
+    stats.record_change(stats.snapshot(instance), None)
+
+
+@receiver(post_save, sender=Service)
+def refresh_service_stats(sender, instance, created, raw=False, **kwargs):
+    # Cambió la duración: sync_service_appointments (antes) recalculó el fin
+    # de las citas futuras; sus filas se recalculan desde hoy. Las pasadas
+    # conservan sus minutos y un cambio de precio no afecta a las citas ya
+    # completadas, que guardan el precio cobrado.
+    previous = getattr(instance, '_previous_duration', None)
+    if raw or created or previous is None or previous == instance.duration:
+        return
+    stats.rebuild(start=timezone.localdate(), service_ids=[instance.pk])
@@ -0,0 +1,262 @@
+"""Estadísticas diarias pre-agregadas (``DailyStat``) para los reportes.
+
+Cada cita aporta a la fila de su doctor, servicio y día: una reserva, una
+completada o cancelada según su estado, sus minutos si no está cancelada y
+su precio si está completada. Los minutos salen del intervalo guardado de la
+cita y el precio del que se cobró al completarla (``Appointment.price``), no
+del servicio actual: cambiar la duración o el precio de un servicio no
+reescribe los meses cerrados. Las señales aplican la diferencia entre el
+aporte anterior y el nuevo con un ``UPDATE ... SET x = x + n``; las cargas
+masivas llaman a ``record_bulk`` y ``rebuild`` recalcula un rango desde las
+citas con la misma regla.
+
+Los reportes suman las filas del rango (a lo más doctores × servicios ×
+días) en lugar de recorrer las citas. Los minutos disponibles salen de los
+horarios laborales actuales (en caché), no de los que hubo en el pasado.
+"""
+from collections import Counter
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+
+from . import cache
+from .models import Appointment, DailyStat
+
+
+COUNTERS = ('bookings', 'completed', 'cancelled', 'booked_minutes', 'revenue')
+
+
+def contribution(status, service_id, starts_at=None, ends_at=None, price=None):
+    """Aporte de una cita con ``status`` y ``service_id`` a su fila.
+
+    Sin intervalo o sin precio (citas anteriores a esas columnas) se usan la
+    duración y el precio actuales del servicio.
+    """
+    service = cache.get_service(service_id)
+    delta = Counter(bookings=1)
+    if status == 'completed':
+        delta['completed'] = 1
+        if price is None and service:
+            price = service.price
+        if price is not None:
+            delta['revenue'] = price
+    elif status == 'cancelled':
+        delta['cancelled'] = 1
+    if status != 'cancelled':
+        if starts_at and ends_at:
+            duration = ends_at - starts_at
+        else:
+            duration = service.duration if service else None
+        if duration:
+            delta['booked_minutes'] = int(duration.total_seconds() // 60)
+    return delta
+
+
+def snapshot(appointment):
+    """``(llave, aporte)`` de una cita; la llave es ``(doctor, servicio, día)``"""
+    key = (appointment.doctor_id, appointment.service_id, appointment.date)
+    return key, contribution(
+        appointment.status, appointment.service_id, appointment.starts_at, appointment.ends_at, appointment.price
+    )
+
+
+def apply(key, delta):
+    """Sumar ``delta`` a la fila de ``key`` creándola si hace falta.
+
+    Si la fila no existe y el cambio no agrega reservas (una baja o un cambio
+    de estado de una cita anterior a las estadísticas) no se crea: esas
+    filas las arma ``rebuild``.
+    """
+    delta = {field: value for field, value in delta.items() if value}
+    if not delta:
+        return
+    doctor_id, service_id, day = key
+    rows = DailyStat.objects.filter(doctor_id=doctor_id, service_id=service_id, date=day)
+    increments = {field: F(field) + value for field, value in delta.items()}
+    if rows.update(**increments):
+        if delta.get('bookings', 0) < 0:
+            # Sin citas ese día: la fila ya no aporta nada
+            rows.filter(bookings__lte=0).delete()
+        return
+    if delta.get('bookings', 0) <= 0:
+        return
+    try:
+        with transaction.atomic():
+            DailyStat.objects.create(doctor_id=doctor_id, service_id=service_id, date=day, **delta)
+    except IntegrityError:
+        # Otra transacción creó la fila al mismo tiempo
+        rows.update(**increments)
+
+
+def record_change(previous, current):
+    """Aplicar el cambio de una cita entre dos ``snapshot`` (o ``None``)"""
+    deltas = {}
+    if previous:
+        key, values = previous
+        deltas[key] = Counter({field: -value for field, value in values.items()})
+    if current:
+        key, values = current
+        deltas.setdefault(key, Counter()).update(values)
+    for key, delta in deltas.items():
+        apply(key, delta)
+
+
+def record_bulk(appointments):
+    """Sumar citas creadas con ``bulk_create`` (que no dispara señales)"""
+    deltas = {}
+    for appointment in appointments:
+        key, values = snapshot(appointment)
+        deltas.setdefault(key, Counter()).update(values)
+    for key, delta in deltas.items():
+        apply(key, delta)
+
+
+# ─────────────────────────────
+#   Reconstrucción
+# ─────────────────────────────
+
+def aggregate(queryset):
+    """Filas de ``DailyStat`` calculadas desde las citas de ``queryset``"""
+    completed = Q(status='completed')
+    active = ~Q(status='cancelled')
+    rows = queryset.order_by().values('doctor_id', 'service_id', 'date').annotate(
+        total=Count('id'),
+        total_completed=Count('id', filter=completed),
+        total_cancelled=Count('id', filter=Q(status='cancelled')),
+        duration=Sum(Coalesce(F('ends_at') - F('starts_at'), F('service__duration')), filter=active),
+        total_revenue=Sum(Coalesce(F('price'), F('service__price')), filter=completed),
+    )
+    for row in rows.iterator(chunk_size=5000):
+        yield DailyStat(
+            doctor_id=row['doctor_id'],
+            service_id=row['service_id'],
+            date=row['date'],
+            bookings=row['total'],
+            completed=row['total_completed'],
+            cancelled=row['total_cancelled'],
+            booked_minutes=int(row['duration'].total_seconds() // 60) if row['duration'] else 0,
+            revenue=row['total_revenue'] or 0,
+        )
+
+
+def rebuild(start=None, end=None, service_ids=None, batch_size=2000):
+    """Recalcular las filas de un rango de días (inclusive) en una transacción.
+
+    Sin límites recalcula todo; ``service_ids`` limita a esos servicios (al
+    cambiar la duración de uno, desde hoy). Regresa cuántas filas se
+    escribieron.
+    """
+    lookups = {}
+    if start:
+        lookups['date__gte'] = start
+    if end:
+        lookups['date__lte'] = end
+    if service_ids is not None:
+        lookups['service_id__in'] = service_ids
+
+    written = 0
+    with transaction.atomic():
+        DailyStat.objects.filter(**lookups).delete()
+        batch = []
+        for stat in aggregate(Appointment.objects.filter(**lookups)):
+            batch.append(stat)
+            if len(batch) >= batch_size:
+                written += len(DailyStat.objects.bulk_create(batch))
+                batch = []
+        if batch:
+            written += len(DailyStat.objects.bulk_create(batch))
+    return written
+
+
+# ─────────────────────────────
+#   Reportes
+# ─────────────────────────────
+
+def period_range(year, month=None):
+    """Primer y último día de un mes o de un año"""
+    if month:
+        first = date(year, month, 1)
+        following = date(year + month // 12, month % 12 + 1, 1)
+        return first, following - timedelta(days=1)
+    return date(year, 1, 1), date(year, 12, 31)
+
+
+def available_minutes(doctor_ids, start, end):
+    """``{doctor_id: minutos}`` de horario laboral entre ``start`` y ``end``"""
+    # Cuántas veces aparece cada día de la semana (1 = lunes) en el rango
+    weekdays = Counter((start + timedelta(days=offset)).weekday() + 1
+                       for offset in range((end - start).days + 1))
+    minutes = {}
+    for doctor_id, schedule in cache.get_schedules(doctor_ids).items():
+        total = 0
+        for day_id, blocks in schedule.items():
+            block_minutes = sum(
+                (end_time.hour * 60 + end_time.minute) - (start_time.hour * 60 + start_time.minute)
+                for start_time, end_time in blocks
+            )
+            total += block_minutes * weekdays[day_id]
+        minutes[doctor_id] = total
+    return minutes
+
+
+def clean(row):
+    """Sumas con ceros en lugar de ``None`` y el ingreso como ``Decimal``"""
+    row = dict(row)
+    for field in COUNTERS:
+        row[field] = row[field] or 0
+    row['revenue'] = Decimal(row['revenue'])
+    return row
+
+
+def report(start, end, doctor_id=None, by_month=False):
+    """Totales del rango, por doctor, por servicio y por día (o por mes)"""
+    stats = DailyStat.objects.filter(date__gte=start, date__lte=end).order_by()
+    if doctor_id:
+        stats = stats.filter(doctor_id=doctor_id)
+    sums = {field: Sum(field) for field in COUNTERS}
+
+    doctors = {pk: name for pk, name, _ in cache.get_doctor_roster()}
+    doctor_ids = [doctor_id] if doctor_id else list(doctors)
+    available = available_minutes(doctor_ids, start, end)
+    by_doctor = []
+    for row in stats.values('doctor_id').annotate(**sums):
+        row = clean(row)
+        row['doctor'] = doctors.get(row['doctor_id'], row['doctor_id'])
+        row['available_minutes'] = available.get(row['doctor_id'], 0)
+        row['utilization'] = (
+            round(100 * row['booked_minutes'] / row['available_minutes'], 1) if row['available_minutes'] else None
+        )
+        by_doctor.append(row)
+    by_doctor.sort(key=lambda row: str(row['doctor']))
+
+    services = {service.pk: service.name for service in cache.get_services()}
+    by_service = []
+    for row in stats.values('service_id').annotate(**sums):
+        row = clean(row)
+        row['service'] = services.get(row['service_id'], row['service_id'])
+        by_service.append(row)
+    by_service.sort(key=lambda row: -row['revenue'])
+
+    if by_month:
+        series = stats.annotate(period=TruncMonth('date')).values('period')
+    else:
+        series = stats.annotate(period=F('date')).values('period')
+    series = [clean(row) for row in series.annotate(**sums).order_by('period')]
+
+    summary = clean(stats.aggregate(**sums))
+    summary['available_minutes'] = sum(available.values())
+    summary['utilization'] = (
+        round(100 * summary['booked_minutes'] / summary['available_minutes'], 1)
+        if summary['available_minutes'] else None
+    )
+    return {
+        'start': start,
+        'end': end,
+        'totals': summary,
+        'by_doctor': by_doctor,
+        'by_service': by_service,
+        'series': series,
+    }
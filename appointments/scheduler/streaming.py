@@ -0,0 +1,182 @@
+"""Respuestas JSON en streaming con memoria constante.
+
+En lugar de armar una lista completa y pasarla a ``JsonResponse``, las filas
+se leen por bloques (``iterator``/``aiterator`` con ``chunk_size``) y el JSON
+se escribe a medida que llegan, así la memoria del worker no depende del
+número de filas.
+
+El formato por defecto es el mismo de las respuestas normales::
+
+    {"success": true, "events": [...], "count": N, ...}
+
+y para exportaciones hay escritores de CSV y JSON Lines con la misma
+interfaz (``open``/``add``/``close``).
+
+Bajo ASGI se usa un iterador asíncrono y bajo WSGI uno síncrono: Django
+consume completo (en memoria) el iterador del tipo contrario.
+"""
+import csv
+import io
+import json
+
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+
+# Filas que se leen de la base por vuelta
+CHUNK_SIZE = 2000
+
+# Elementos que se codifican juntos antes de entregarlos al servidor
+FLUSH_SIZE = 200
+
+
+class JSONArrayWriter:
+    """Escribe ``{"success": true, "<key>": [ ... ], "count": N, ...}`` por partes"""
+
+    content_type = 'application/json'
+    extension = 'json'
+
+    def __init__(self, key, extra=None):
+        self.key = key
+        self.extra = extra or {}
+        self.count = 0
+        self._buffer = []
+        self._encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+    def open(self):
+        return f'{{"success": true, {json.dumps(self.key)}: ['.encode()
+
+    def add(self, item):
+        """Agregar un elemento; regresa bytes cuando hay un bloque listo"""
+        self._buffer.append(self._encoder.encode(item))
+        self.count += 1
+        if len(self._buffer) >= FLUSH_SIZE:
+            return self.flush()
+        return None
+
+    def flush(self):
+        if not self._buffer:
+            return b''
+        chunk = ', '.join(self._buffer)
+        if self.count > len(self._buffer):
+            chunk = ', ' + chunk
+        self._buffer = []
+        return chunk.encode()
+
+    def close(self):
+        tail = {'count': self.count, **self.extra}
+        fields = ''.join(f', {json.dumps(k)}: {self._encoder.encode(v)}' for k, v in tail.items())
+        return self.flush() + f']{fields}}}'.encode()
+
+
+class CSVWriter:
+    """CSV con encabezado; ``add`` recibe la lista de valores de una fila"""
+
+    content_type = 'text/csv; charset=utf-8'
+    extension = 'csv'
+
+    def __init__(self, header):
+        self.header = header
+        self.count = 0
+        self._pending = 0
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def open(self):
+        self._writer.writerow(self.header)
+        return self.flush()
+
+    def add(self, values):
+        self._writer.writerow(values)
+        self.count += 1
+        self._pending += 1
+        if self._pending >= FLUSH_SIZE:
+            return self.flush()
+        return None
+
+    def flush(self):
+        chunk = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._pending = 0
+        return chunk.encode()
+
+    def close(self):
+        return self.flush()
+
+
+class JSONLinesWriter:
+    """Un objeto JSON por línea con las llaves de ``header``"""
+
+    content_type = 'application/x-ndjson'
+    extension = 'jsonl'
+
+    def __init__(self, header):
+        self.header = header
+        self.count = 0
+        self._buffer = []
+        self._encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+    def open(self):
+        return b''
+
+    def add(self, values):
+        self._buffer.append(self._encoder.encode(dict(zip(self.header, values))))
+        self.count += 1
+        if len(self._buffer) >= FLUSH_SIZE:
+            return self.flush()
+        return None
+
+    def flush(self):
+        if not self._buffer:
+            return b''
+        chunk = '\n'.join(self._buffer) + '\n'
+        self._buffer = []
+        return chunk.encode()
+
+    def close(self):
+        return self.flush()
+
+
+def iter_rows(rows, transform, writer):
+    """Generador síncrono: filas transformadas escritas con ``writer``"""
+    yield writer.open()
+    for row in rows:
+        chunk = writer.add(transform(row))
+        if chunk:
+            yield chunk
+    yield writer.close()
+
+
+async def aiter_rows(rows, transform, writer):
+    """Generador asíncrono: filas transformadas escritas con ``writer``"""
+    yield writer.open()
+    async for row in rows:
+        chunk = writer.add(transform(row))
+        if chunk:
+            yield chunk
+    yield writer.close()
+
+
+def stream_queryset(request, queryset, transform, key='events', extra=None, filename=None,
+                    chunk_size=CHUNK_SIZE, writer=None):
+    """``StreamingHttpResponse`` con las filas de ``queryset``.
+
+    ``queryset`` debería ser una proyección con ``values`` (no
+    ``values_list``: su ``aiterator()`` falla en Django 5.2) y
+    ``transform`` convierte cada fila en el elemento a serializar. Por
+    defecto se escribe como arreglo JSON bajo ``key``; ``writer`` permite
+    otro formato (``CSVWriter``, ``JSONLinesWriter``). ``filename`` lo sirve
+    como descarga.
+    """
+    writer = writer or JSONArrayWriter(key, extra)
+    if isinstance(request, ASGIRequest):
+        content = aiter_rows(queryset.aiterator(chunk_size=chunk_size), transform, writer)
+    else:
+        content = iter_rows(queryset.iterator(chunk_size=chunk_size), transform, writer)
+
+    response = StreamingHttpResponse(content, content_type=writer.content_type)
+    if filename:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
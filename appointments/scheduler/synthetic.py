@@ -0,0 +1,214 @@
+"""Generador de una clínica sintética para pruebas de carga y benchmarks.
+
+Crea doctores con horario laboral, pacientes, servicios, años de citas y
+sus historiales clínicos con ``bulk_create`` por lotes, sin pasar por las
+señales. Con la misma semilla genera los mismos datos.
+
+Las citas se acomodan una tras otra dentro de los bloques laborales de cada
+doctor, así que nunca se traslapan; las pasadas quedan completadas o
+canceladas y las futuras programadas.
+"""
+import random
+from datetime import date, datetime, time, timedelta
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .models import Appointment, ClinicalHistory, Doctor, Patient, Service, Weekday, WorkingHour
+
+
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+FIRST_NAMES = [
+    'Ana', 'Luis', 'María', 'José', 'Carmen', 'Jorge', 'Lucía', 'Miguel', 'Sofía', 'Diego',
+    'Elena', 'Pablo', 'Laura', 'Andrés', 'Paula', 'Javier', 'Valeria', 'Raúl', 'Isabel', 'Tomás',
+]
+LAST_NAMES = [
+    'García', 'Martínez', 'López', 'Hernández', 'González', 'Pérez', 'Sánchez', 'Ramírez', 'Torres',
+    'Flores', 'Rivera', 'Gómez', 'Díaz', 'Cruz', 'Morales', 'Reyes', 'Ortiz', 'Castillo', 'Ruiz', 'Soto',
+]
+SPECIALTIES = ['Odontología general', 'Ortodoncia', 'Endodoncia', 'Periodoncia', 'Odontopediatría', 'Cirugía maxilofacial']
+SERVICES = [
+    ('Consulta', 30), ('Limpieza', 45), ('Resina', 60), ('Extracción', 45), ('Endodoncia', 90),
+    ('Ajuste de brackets', 30), ('Blanqueamiento', 60), ('Corona', 90), ('Radiografía', 15), ('Valoración', 30),
+]
+REASONS = ['Dolor', 'Revisión', 'Sensibilidad', 'Limpieza de rutina', 'Seguimiento', 'Inflamación de encías']
+DIAGNOSES = ['Caries', 'Gingivitis', 'Pulpitis', 'Maloclusión', 'Sin hallazgos', 'Fractura dental']
+
+# Bloques laborales de lunes a viernes (algunos doctores también el sábado)
+SHIFTS = [
+    ((time(9), time(13)), (time(15), time(19))),
+    ((time(8), time(14)),),
+    ((time(12), time(20)),),
+]
+
+
+class ClinicGenerator:
+    """Genera los datos de una clínica; ``progress(mensaje)`` informa el avance"""
+
+    def __init__(self, doctors=10, patients=5000, services=8, years=3, future_days=60,
+                 occupancy=0.7, history_ratio=0.6, batch_size=5000, seed=1, progress=None):
+        self.doctors = doctors
+        self.patients = patients
+        self.services = services
+        self.years = years
+        self.future_days = future_days
+        self.occupancy = occupancy
+        self.history_ratio = history_ratio
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.progress = progress or (lambda message: None)
+
+    def run(self):
+        owner = self.owner()
+        weekdays = self.weekdays()
+        doctor_ids = self.create_doctors(owner, weekdays)
+        patient_ids = self.create_patients(owner)
+        services = self.create_services()
+        appointments, histories = self.create_appointments(doctor_ids, patient_ids, services)
+        return {
+            'doctors': len(doctor_ids),
+            'patients': len(patient_ids),
+            'services': len(services),
+            'appointments': appointments,
+            'clinical_histories': histories,
+        }
+
+    def owner(self):
+        """Usuario dueño de los registros sintéticos (FK obligatoria)"""
+        user, _ = User.objects.get_or_create(username='synthetic', defaults={'is_active': False})
+        return user
+
+    def weekdays(self):
+        """Asegurar los 7 días (lunes a sábado habilitados)"""
+        existing = set(Weekday.objects.values_list('id', flat=True))
+        Weekday.objects.bulk_create([
+            Weekday(id=number, day=name, status=number < 7)
+            for number, name in enumerate(WEEKDAY_NAMES, 1) if number not in existing
+        ])
+        return set(Weekday.objects.filter(status=True).values_list('id', flat=True))
+
+    def full_name(self):
+        return f'{self.random.choice(FIRST_NAMES)} {self.random.choice(LAST_NAMES)} {self.random.choice(LAST_NAMES)}'
+
+    def create_doctors(self, owner, active_days):
+        start = Doctor.objects.count()
+        doctors = Doctor.objects.bulk_create([
+            Doctor(
+                user=owner,
+                full_name=self.full_name(),
+                specialty=self.random.choice(SPECIALTIES),
+                license_number=f'SYN-{start + number:06d}-{self.random.randrange(10 ** 6):06d}',
+            )
+            for number in range(self.doctors)
+        ])
+        doctor_ids = [doctor.pk for doctor in doctors]
+
+        hours = []
+        self.schedules = {}
+        for doctor_id in doctor_ids:
+            shift = self.random.choice(SHIFTS)
+            days = [1, 2, 3, 4, 5] + ([6] if self.random.random() < 0.3 else [])
+            days = [day for day in days if day in active_days]
+            self.schedules[doctor_id] = {day: shift for day in days}
+            for day in days:
+                for block_start, block_end in shift:
+                    hours.append(WorkingHour(doctor_id=doctor_id, day_id=day, start_time=block_start, end_time=block_end))
+        WorkingHour.objects.bulk_create(hours, batch_size=self.batch_size)
+        self.progress(f'{len(doctor_ids)} doctores con {len(hours)} bloques laborales')
+        return doctor_ids
+
+    def create_patients(self, owner):
+        patient_ids = []
+        for offset in range(0, self.patients, self.batch_size):
+            batch = [
+                Patient(
+                    user=owner,
+                    full_name=self.full_name(),
+                    gender=self.random.choice(['male', 'female', 'other']),
+                    phone=f'55{self.random.randrange(10 ** 8):08d}',
+                    date_of_birth=date(1940, 1, 1) + timedelta(days=self.random.randrange(365 * 80)),
+                )
+                for _ in range(min(self.batch_size, self.patients - offset))
+            ]
+            patient_ids.extend(patient.pk for patient in Patient.objects.bulk_create(batch))
+            self.progress(f'{len(patient_ids)}/{self.patients} pacientes')
+        return patient_ids
+
+    def create_services(self):
+        chosen = [SERVICES[number % len(SERVICES)] for number in range(self.services)]
+        return Service.objects.bulk_create([
+            Service(
+                name=name if number < len(SERVICES) else f'{name} {number // len(SERVICES) + 1}',
+                duration=timedelta(minutes=minutes),
+                price=minutes * 10,
+            )
+            for number, (name, minutes) in enumerate(chosen)
+        ])
+
+    def iter_appointments(self, doctor_ids, patient_ids, services):
+        """Citas de cada doctor, día por día, sin traslapes"""
+        today = timezone.localdate()
+        day = today - timedelta(days=365 * self.years)
+        last_day = today + timedelta(days=self.future_days)
+        while day <= last_day:
+            weekday = day.weekday() + 1
+            past = day < today
+            for doctor_id in doctor_ids:
+                for block_start, block_end in self.schedules[doctor_id].get(weekday, ()):
+                    cursor = datetime.combine(day, block_start)
+                    block_end = datetime.combine(day, block_end)
+                    while True:
+                        service = self.random.choice(services)
+                        if cursor + service.duration > block_end:
+                            break
+                        if self.random.random() < self.occupancy:
+                            if past:
+                                status = 'completed' if self.random.random() < 0.85 else 'cancelled'
+                            else:
+                                status = 'scheduled'
+                            appointment = Appointment(
+                                doctor_id=doctor_id,
+                                patient_id=self.random.choice(patient_ids),
+                                service_id=service.pk,
+                                date=day,
+                                time=cursor.time(),
+                                status=status,
+                            )
+                            appointment.sync_interval(service.duration)
+                            yield appointment
+                        cursor += service.duration
+            day += timedelta(days=1)
+
+    def create_appointments(self, doctor_ids, patient_ids, services):
+        total = histories = 0
+        batch = []
+        for appointment in self.iter_appointments(doctor_ids, patient_ids, services):
+            batch.append(appointment)
+            if len(batch) >= self.batch_size:
+                histories += self.flush(batch)
+                total += len(batch)
+                batch = []
+                self.progress(f'{total} citas')
+        if batch:
+            histories += self.flush(batch)
+            total += len(batch)
+        self.progress(f'{total} citas, {histories} historiales')
+        return total, histories
+
+    def flush(self, batch):
+        """Guardar un lote de citas y los historiales de las completadas"""
+        created = Appointment.objects.bulk_create(batch)
+        histories = [
+            ClinicalHistory(
+                appointment_id=appointment.pk,
+                reason=self.random.choice(REASONS),
+                diagnosis=self.random.choice(DIAGNOSES),
+                treatment='Tratamiento sintético',
+                follow_up_needed=self.random.random() < 0.2,
+            )
+            for appointment in created
+            if appointment.status == 'completed' and self.random.random() < self.history_ratio
+        ]
+        ClinicalHistory.objects.bulk_create(histories)
+        return len(histories)
@@ -1,3 +1,888 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache as django_cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from . import cache, changes, engine, events, importer, pagination, pubsub, stats
+from .admin import AppointmentAdmin
+from .models import Appointment, AppointmentChange, ClinicalHistory, DailyStat, Doctor, Patient, Service, Weekday, WorkingHour
+
+
+EVENTS_URL = '/admin/scheduler/appointment/get-events/'
+CHANGELIST_URL = '/admin/scheduler/appointment/'
+SERVICE_URL = '/admin/scheduler/service/{}/change/'
+
+
+def create_clinic(target):
+    """Clínica mínima en los atributos de ``target``: dos doctores con horario
+    de lunes a viernes, pacientes, un servicio de 30 minutos y citas el lunes
+    ``target.day``."""
+    target.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+    Weekday.objects.bulk_create([
+        Weekday(id=number, day=name, status=number < 6)
+        for number, name in enumerate(
+            ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'], 1)
+    ])
+    target.doctors = [
+        Doctor.objects.create(user=target.admin, full_name=name, specialty='General', license_number=f'L-{i}')
+        for i, name in enumerate(['Ana Pérez', 'Luis Gómez'])
+    ]
+    for doctor in target.doctors:
+        for day in range(1, 6):
+            WorkingHour.objects.create(doctor=doctor, day_id=day, start_time=time(9), end_time=time(17))
+    target.patients = [
+        Patient.objects.create(user=target.admin, full_name=f'Paciente {i}', phone=f'555000{i}')
+        for i in range(3)
+    ]
+    target.service = Service.objects.create(name='Consulta', duration=timedelta(minutes=30), price=500)
+    # Un lunes dentro de un año
+    today = date.today()
+    target.day = today + timedelta(days=364 - today.weekday())
+    target.appointments = [
+        Appointment.objects.create(
+            doctor=target.doctors[i % 2], patient=target.patients[i % 3], service=target.service,
+            date=target.day, time=time(9 + i), status='scheduled',
+        )
+        for i in range(4)
+    ]
+
+
+def clear_reference_cache():
+    # La caché de referencia sobrevive al rollback entre pruebas
+    for namespace in (cache.SCHEDULES, cache.WEEKDAYS, cache.SERVICES, cache.DOCTORS):
+        cache.invalidate(namespace)
+
+
+class ClinicTestCase(TestCase):
+    """Pruebas sobre la clínica de ``create_clinic``"""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_clinic(cls)
+
+    def setUp(self):
+        clear_reference_cache()
+
+    def events_url(self, **params):
+        query = '&'.join(f'{key}={value}' for key, value in {
+            'start': self.day.isoformat(), 'end': (self.day + timedelta(days=1)).isoformat(), **params,
+        }.items())
+        return f'{EVENTS_URL}?{query}'
+
+
+class EventsStreamingTests(ClinicTestCase):
+
+    async def test_stream_under_asgi(self):
+        """``stream=1`` con el cliente asíncrono (``ASGIRequest`` y ``aiterator``)"""
+        await self.async_client.aforce_login(self.admin)
+        response = await self.async_client.get(self.events_url(stream='1'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        data = json.loads(b''.join([chunk async for chunk in response.streaming_content]))
+        self.assertTrue(data['success'])
+        self.assertEqual(data['count'], 4)
+        self.assertEqual({event['id'] for event in data['events']}, {str(a.pk) for a in self.appointments})
+        self.assertEqual(data['events'][0]['extendedProps']['service'], 'Consulta')
+
+    async def test_feed_under_asgi(self):
+        await self.async_client.aforce_login(self.admin)
+        response = await self.async_client.get(self.events_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['count'], 4)
+
+    def test_stream_under_wsgi(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(self.events_url(stream='1'))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['count'], 4)
+
+
+class EventsWithoutIntervalTests(ClinicTestCase):
+    """Citas aún sin ``starts_at``/``ends_at`` (antes de llenarlos)"""
+
+    def test_falls_back_to_date_and_time(self):
+        appointment = self.appointments[1]
+        Appointment.objects.filter(pk=appointment.pk).update(starts_at=None, ends_at=None)
+        row = events.event_rows(Appointment.objects.filter(pk=appointment.pk)).get()
+        event = events.build_event(row)
+        self.assertEqual(event['start'], f'{self.day.isoformat()}T10:00:00')
+        self.assertEqual(event['end'], f'{self.day.isoformat()}T10:30:00')
+
+    def test_events_without_range(self):
+        Appointment.objects.filter(pk=self.appointments[1].pk).update(starts_at=None, ends_at=None)
+        self.client.force_login(self.admin)
+        response = self.client.get(EVENTS_URL)
+        self.assertEqual(response.status_code, 200)
+        starts = {event['id']: event['start'] for event in response.json()['events']}
+        self.assertEqual(len(starts), len(self.appointments))
+        self.assertEqual(starts[str(self.appointments[1].pk)], f'{self.day.isoformat()}T10:00:00')
+
+
+class ExportTests(ClinicTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        ClinicalHistory.objects.create(appointment=cls.appointments[0], reason='Dolor', diagnosis='Caries')
+
+    async def export(self, action):
+        await self.async_client.aforce_login(self.admin)
+        response = await self.async_client.post(CHANGELIST_URL, {
+            'action': action,
+            '_selected_action': [str(appointment.pk) for appointment in self.appointments],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    async def test_csv_under_asgi(self):
+        rows = list(csv.DictReader(io.StringIO(await self.export('export_csv'))))
+        self.assertEqual([int(row['id']) for row in rows], [a.pk for a in self.appointments])
+        self.assertEqual(rows[0]['reason'], 'Dolor')
+        self.assertEqual(rows[0]['duration_minutes'], '30')
+        self.assertEqual(rows[1]['reason'], '')
+
+    async def test_jsonl_under_asgi(self):
+        rows = [json.loads(line) for line in (await self.export('export_jsonl')).splitlines()]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0]['diagnosis'], 'Caries')
+        self.assertEqual(rows[0]['time'], '09:00')
+        self.assertEqual(rows[0]['service_id'], self.service.pk)
+
+
+class ServiceDurationTests(ClinicTestCase):
+    """Cambiar la duración de un servicio re-calcula las citas futuras"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.past = Appointment.objects.create(
+            doctor=cls.doctors[0], patient=cls.patients[0], service=cls.service,
+            date=date.today() - timedelta(days=30), time=time(9), status='completed',
+        )
+
+    def change_duration(self, minutes):
+        self.client.force_login(self.admin)
+        return self.client.post(SERVICE_URL.format(self.service.pk), {
+            'name': self.service.name, 'duration': f'00:{minutes}:00', 'price': '500',
+        })
+
+    def test_future_appointments_updated_and_logged(self):
+        before = AppointmentChange.objects.count()
+        response = self.change_duration(45)
+        self.assertEqual(response.status_code, 302)
+
+        appointment = Appointment.objects.get(pk=self.appointments[0].pk)
+        self.assertEqual(appointment.ends_at - appointment.starts_at, timedelta(minutes=45))
+        self.assertGreater(appointment.updated_at, self.appointments[0].updated_at)
+        self.assertEqual(AppointmentChange.objects.count() - before, len(self.appointments))
+
+        past = Appointment.objects.get(pk=self.past.pk)
+        self.assertEqual(past.ends_at - past.starts_at, timedelta(minutes=30))
+
+    def test_events_etag_changes(self):
+        self.client.force_login(self.admin)
+        first = self.client.get(self.events_url())
+        self.change_duration(45)
+        second = self.client.get(self.events_url(), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        events = {event['id']: event for event in json.loads(second.content)['events']}
+        event = events[str(self.appointments[0].pk)]
+        self.assertTrue(event['end'].startswith(f'{self.day}T09:45'))
+
+    def test_overlapping_duration_rejected(self):
+        # Las citas de cada doctor están a dos horas: 150 minutos las traslapa
+        response = self.change_duration(150)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('se traslapan', response.content.decode())
+        self.service.refresh_from_db()
+        self.assertEqual(self.service.duration, timedelta(minutes=30))
+
+
+class ChangelistQueryTests(ClinicTestCase):
+    """Los changelists hacen un número fijo de consultas, sin N+1 por fila"""
+
+    # (url, consultas): sesión, usuario, conteo, resultados y permisos del
+    # menú, más las opciones de list_filter (doctores; doctores y días)
+    CHANGELISTS = [
+        ('/admin/scheduler/appointment/', 7),
+        ('/admin/scheduler/doctor/', 7),
+        ('/admin/scheduler/patient/', 7),
+        ('/admin/scheduler/clinicalhistory/', 7),
+        ('/admin/scheduler/workinghour/', 9),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for appointment in cls.appointments:
+            ClinicalHistory.objects.create(appointment=appointment, reason='Revisión')
+
+    def add_rows(self, count):
+        """Más filas de cada modelo, con doctores y pacientes distintos"""
+        for i in range(count):
+            doctor = Doctor.objects.create(
+                user=self.admin, full_name=f'Doctor {i}', specialty='General', license_number=f'X-{i}'
+            )
+            patient = Patient.objects.create(user=self.admin, full_name=f'Extra {i}')
+            WorkingHour.objects.create(doctor=doctor, day_id=i % 5 + 1, start_time=time(9), end_time=time(13))
+            appointment = Appointment.objects.create(
+                doctor=doctor, patient=patient, service=self.service,
+                date=self.day + timedelta(days=1), time=time(9), status='scheduled',
+            )
+            ClinicalHistory.objects.create(appointment=appointment, reason='Revisión')
+
+    def assert_constant_queries(self):
+        self.client.force_login(self.admin)
+        for url, expected in self.CHANGELISTS:
+            # Primero con la caché de referencia fría; se mide ya caliente
+            self.client.get(url)
+            with self.subTest(url=url), self.assertNumQueries(expected):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_few_rows(self):
+        self.assert_constant_queries()
+
+    def test_many_rows(self):
+        self.add_rows(30)
+        self.assert_constant_queries()
+
+    def appointment_page(self, query=''):
+        response = self.client.get('/admin/scheduler/appointment/' + query)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    @mock.patch.object(AppointmentAdmin, 'list_per_page', 20)
+    def test_keyset_pages(self):
+        self.add_rows(30)
+        self.client.force_login(self.admin)
+        first = self.appointment_page()
+        self.assertTrue(first.keyset)
+        self.assertIsNotNone(first.next_url)
+        second = self.appointment_page(first.next_url)
+        self.assertIsNone(second.next_url)
+        self.assertEqual(second.first_url, '?')
+
+        first_ids = [a.pk for a in first.result_list]
+        second_ids = [a.pk for a in second.result_list]
+        self.assertEqual(len(first_ids), 20)
+        self.assertFalse(set(first_ids) & set(second_ids))
+        # Juntas recorren el orden por defecto completo, sin huecos
+        ordered = Appointment.objects.order_by('-date', '-time', '-pk').values_list('pk', flat=True)
+        self.assertEqual(first_ids + second_ids, list(ordered))
+
+    def test_invalid_cursor(self):
+        self.client.force_login(self.admin)
+        for query in ['?after=basura', '?after=2025-13-01,09:00:00,1']:
+            with self.subTest(query=query):
+                response = self.client.get('/admin/scheduler/appointment/' + query)
+                self.assertRedirects(response, '/admin/scheduler/appointment/?e=1', fetch_redirect_response=False)
+
+    def test_cursor_with_other_ordering(self):
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get('/admin/scheduler/appointment/', {'o': '1'}).status_code, 200)
+        cursor = pagination.format_cursor(self.appointments[-1])
+        response = self.client.get('/admin/scheduler/appointment/', {'after': cursor, 'o': '1'})
+        self.assertRedirects(response, '/admin/scheduler/appointment/?e=1', fetch_redirect_response=False)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Reservas concurrentes reales solo en PostgreSQL')
+class ConcurrentBookingTests(TransactionTestCase):
+    """Muchos hilos (cada uno con su conexión) reservan el mismo horario"""
+
+    def setUp(self):
+        create_clinic(self)
+        clear_reference_cache()
+
+    def test_exactly_one_winner(self):
+        output = io.StringIO()
+        call_command(
+            'stress_booking', doctor=self.doctors[0].pk, patient=self.patients[0].pk, service=self.service.pk,
+            date=(self.day + timedelta(days=7)).isoformat(), time='10:00', threads=30, stdout=output,
+        )
+        self.assertIn('OK: 1 reserva ganadora', output.getvalue())
+        self.assertNotIn('error:', output.getvalue())
+
+
+class BookingIntegrityTests(TransactionTestCase):
+    """Solo las restricciones de traslape se reportan como conflicto"""
+
+    def setUp(self):
+        create_clinic(self)
+        clear_reference_cache()
+
+    def test_slot_constraint_is_conflict(self):
+        # Otra reserva ganó entre la verificación y la inserción
+        available = engine.Availability(engine.Availability.AVAILABLE)
+        with mock.patch.object(engine, 'check_availability', return_value=available):
+            with self.assertRaises(engine.SlotUnavailable) as raised:
+                engine.book_appointment(self.doctors[0], self.patients[1], self.service, self.day, time(9))
+        self.assertTrue(raised.exception.conflict)
+
+    def test_missing_service_is_not_conflict(self):
+        service = Service.objects.create(name='Retirado', duration=timedelta(minutes=30), price=100)
+        Service.objects.filter(pk=service.pk).delete()
+        with self.assertRaises(IntegrityError):
+            engine.book_appointment(self.doctors[0], self.patients[1], service, self.day, time(14))
+        self.assertFalse(Appointment.objects.filter(time=time(14)).exists())
+
+    def test_series_missing_service_is_not_conflict(self):
+        service = Service.objects.create(name='Retirado', duration=timedelta(minutes=30), price=100)
+        Service.objects.filter(pk=service.pk).delete()
+        with self.assertRaises(IntegrityError):
+            engine.book_series(self.doctors[0], self.patients[1], service, [(self.day, time(14))])
+
+    def test_missing_service_returns_400(self):
+        # El servicio se borra después de que la vista lo encontró
+        service = Service.objects.create(name='Retirado', duration=timedelta(minutes=30), price=100)
+        Service.objects.filter(pk=service.pk).delete()
+        self.client.force_login(self.admin)
+        with mock.patch.object(cache, 'get_service', return_value=service), \
+                self.assertLogs('scheduler.admin', 'WARNING'):
+            response = self.client.post(CreateAppointmentTests.URL, json.dumps({
+                'date': self.day.isoformat(), 'time': '14:00', 'service_id': service.pk,
+                'doctor_id': self.doctors[0].pk, 'patient_id': self.patients[0].pk,
+            }), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn('conflict', response.json())
+
+
+class EventsFilterTests(ClinicTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def test_filters(self):
+        response = self.client.get(self.events_url(doctor_id=self.doctors[0].pk, status='scheduled,pending'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['count'], 2)
+
+    def test_invalid_filters(self):
+        for params in ({'doctor_id': 'abc'}, {'status': 'foo'}, {'status': 'scheduled,'}):
+            with self.subTest(**params):
+                response = self.client.get(self.events_url(**params))
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(json.loads(response.content)['success'])
+
+
+class EventsVersionTests(ClinicTestCase):
+    """El ETag de get-events/ cambia con lo que muestran los eventos"""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+        self.first = self.client.get(self.events_url())
+
+    def revalidate(self):
+        return self.client.get(self.events_url(), HTTP_IF_NONE_MATCH=self.first['ETag'])
+
+    def test_unchanged_range_is_not_modified(self):
+        self.assertEqual(self.revalidate().status_code, 304)
+
+    def test_patient_rename(self):
+        patient = self.patients[0]
+        patient.full_name = 'Paciente Renombrado'
+        patient.save()
+        response = self.revalidate()
+        self.assertEqual(response.status_code, 200)
+        titles = {event['title'] for event in json.loads(response.content)['events']}
+        self.assertIn('Paciente Renombrado - Ana Pérez', titles)
+
+    def test_doctor_rename(self):
+        doctor = self.doctors[1]
+        doctor.full_name = 'Luis Gómez Ruiz'
+        doctor.save()
+        self.assertEqual(self.revalidate().status_code, 200)
+
+    def test_service_rename(self):
+        self.service.name = 'Consulta general'
+        self.service.save()
+        response = self.revalidate()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['events'][0]['extendedProps']['service'], 'Consulta general')
+
+
+class ChangesCursorTests(ClinicTestCase):
+    """El cursor de changes/ no avanza sobre cambios recientes"""
+
+    def setUp(self):
+        super().setUp()
+        AppointmentChange.objects.all().delete()
+        settled = timezone.now() - changes.SETTLE_WINDOW - timedelta(seconds=1)
+        self.old = [
+            AppointmentChange.objects.create(appointment_id=a.pk, doctor_id=a.doctor_id, action='created')
+            for a in self.appointments[:2]
+        ]
+        AppointmentChange.objects.filter(pk__in=[c.pk for c in self.old]).update(changed_at=settled)
+        self.recent = AppointmentChange.objects.create(
+            appointment_id=self.appointments[2].pk, doctor_id=self.appointments[2].doctor_id, action='updated'
+        )
+
+    def test_recent_changes_delivered_but_not_passed(self):
+        rows, cursor, has_more = changes.changes_since(0, 100)
+        self.assertEqual([row[0] for row in rows], [c.pk for c in self.old] + [self.recent.pk])
+        self.assertEqual(cursor, self.old[-1].pk)
+        self.assertFalse(has_more)
+        # La siguiente consulta repite el cambio reciente
+        rows, _, _ = changes.changes_since(cursor, 100)
+        self.assertEqual([row[0] for row in rows], [self.recent.pk])
+
+    def test_late_commit_below_cursor_is_seen(self):
+        # Un cambio con id menor que el reciente pero confirmado después:
+        # se simula reservando el id y guardándolo hasta después de la consulta
+        late_id = self.recent.pk + 1
+        after = AppointmentChange.objects.create(
+            id=late_id + 1, appointment_id=self.appointments[3].pk, doctor_id=1, action='updated'
+        )
+        rows, cursor, _ = changes.changes_since(0, 100)
+        self.assertEqual(rows[-1][0], after.pk)
+        AppointmentChange.objects.create(
+            id=late_id, appointment_id=self.appointments[3].pk, doctor_id=1, action='created'
+        )
+        rows, _, _ = changes.changes_since(cursor, 100)
+        self.assertIn(late_id, [row[0] for row in rows])
+
+    async def test_events_cursor_is_settled(self):
+        self.assertEqual(await changes.asettled_cursor(), self.old[-1].pk)
+
+
+class CreateAppointmentTests(ClinicTestCase):
+    URL = '/admin/scheduler/appointment/create-appointment/'
+
+    async def test_invalid_doctor_creates_no_service(self):
+        # Sin servicios, una cita válida crearía el genérico; una inválida no
+        await Appointment.objects.all().adelete()
+        await Service.objects.all().adelete()
+        clear_reference_cache()
+        await self.async_client.aforce_login(self.admin)
+        response = await self.async_client.post(self.URL, json.dumps({
+            'date': self.day.isoformat(), 'time': '09:00', 'doctor_id': 999999, 'patient_id': self.patients[0].pk,
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(await Service.objects.aexists())
+
+
+class DailyStatsTests(ClinicTestCase):
+    """Estadísticas diarias: señales, cambios de servicio y reporte"""
+
+    REPORT_URL = '/admin/scheduler/appointment/report/'
+
+    def setUp(self):
+        super().setUp()
+        # Una cita atendida el mes pasado, con el precio y la duración de entonces
+        self.past_day = date.today().replace(day=1) - timedelta(days=20)
+        self.past = Appointment.objects.create(
+            doctor=self.doctors[0], patient=self.patients[0], service=self.service,
+            date=self.past_day, time=time(9), status='completed',
+        )
+
+    def stat_rows(self):
+        return sorted(DailyStat.objects.values_list(
+            'doctor_id', 'service_id', 'date', 'bookings', 'completed', 'cancelled', 'booked_minutes', 'revenue'))
+
+    def assertMatchesRebuild(self):
+        maintained = self.stat_rows()
+        stats.rebuild()
+        self.assertEqual(maintained, self.stat_rows())
+
+    def past_row(self):
+        return DailyStat.objects.get(date=self.past_day)
+
+    def test_signals_match_rebuild(self):
+        other = Service.objects.create(name='Limpieza', duration=timedelta(minutes=60), price=800)
+        first, second, third = self.appointments[:3]
+        first.status = 'completed'
+        first.save()
+        second.status = 'cancelled'
+        second.save(update_fields=['status'])
+        third.service = other
+        third.save()
+        self.appointments[3].delete()
+        Appointment.objects.create(
+            doctor=self.doctors[1], patient=self.patients[2], service=other,
+            date=self.day + timedelta(days=1), time=time(9),
+        )
+        self.assertMatchesRebuild()
+
+    def test_price_change_keeps_past_revenue(self):
+        self.service.price = 650
+        self.service.save()
+        self.assertEqual(self.past_row().revenue, 500)
+        future = self.appointments[0]
+        future.status = 'completed'
+        future.save()
+        self.assertEqual(DailyStat.objects.get(date=self.day, doctor=future.doctor).revenue, 650)
+        self.assertMatchesRebuild()
+        self.assertEqual(self.past_row().revenue, 500)
+
+    def test_duration_change_keeps_past_minutes(self):
+        self.service.duration = timedelta(minutes=45)
+        self.service.save()
+        self.assertEqual(self.past_row().booked_minutes, 30)
+        # Dos citas activas por doctor el lunes
+        self.assertEqual(
+            sorted(DailyStat.objects.filter(date=self.day).values_list('booked_minutes', flat=True)), [90, 90]
+        )
+        self.assertMatchesRebuild()
+        self.assertEqual(self.past_row().booked_minutes, 30)
+
+    def test_report(self):
+        self.service.price = 650
+        self.service.save()
+        self.client.force_login(self.admin)
+        response = self.client.get(self.REPORT_URL, {
+            'year': self.past_day.year, 'month': self.past_day.month, 'format': 'json',
+        })
+        self.assertEqual(response.status_code, 200)
+        totals = response.json()['totals']
+        self.assertEqual((totals['bookings'], totals['completed'], totals['booked_minutes']), (1, 1, 30))
+        self.assertEqual(float(totals['revenue']), 500)
+        response = self.client.get(self.REPORT_URL, {'year': self.day.year, 'month': self.day.month})
+        self.assertContains(response, 'Ana Pérez')
+
+
+class SlowQueryLogTests(ClinicTestCase):
+    """El log de consultas lentas no incluye los valores de los parámetros"""
+
+    def slow_query_records(self):
+        with self.assertLogs('scheduler.slow_queries', 'WARNING') as logs:
+            list(Patient.objects.filter(full_name='Paciente 1', phone='5550001'))
+        return [record.metrics for record in logs.records]
+
+    @override_settings(SCHEDULER_SLOW_QUERY_MS=0)
+    def test_params_are_not_logged(self):
+        metrics = self.slow_query_records()[-1]
+        self.assertEqual(metrics['param_count'], 2)
+        self.assertNotIn('params', metrics)
+        self.assertNotIn('Paciente 1', json.dumps(metrics))
+
+    @override_settings(SCHEDULER_SLOW_QUERY_MS=0, SCHEDULER_SLOW_QUERY_LOG_PARAMS=True)
+    def test_params_logged_when_enabled(self):
+        self.assertIn('Paciente 1', self.slow_query_records()[-1]['params'])
+
+
+class SeriesTests(ClinicTestCase):
+    URL = '/admin/scheduler/appointment/create-series/'
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def post(self, body):
+        return self.client.post(self.URL, json.dumps(body), content_type='application/json')
+
+    def series(self, **body):
+        return self.post({'doctor_id': self.doctors[0].pk, 'patient_id': self.patients[0].pk, **body})
+
+    def test_weekly_recurrence(self):
+        monday = self.day
+        # Lunes y miércoles cada dos semanas
+        self.assertEqual(
+            engine.expand_weekly_recurrence(monday, monday + timedelta(weeks=4), interval=2, weekdays=[3, 1]),
+            [monday + timedelta(days=offset) for offset in (0, 2, 14, 16, 28)],
+        )
+        # Por defecto el día de start; count corta la serie
+        self.assertEqual(
+            engine.expand_weekly_recurrence(monday, monday + timedelta(weeks=10), count=3),
+            [monday + timedelta(weeks=week) for week in range(3)],
+        )
+        with self.assertRaises(ValueError):
+            engine.expand_weekly_recurrence(monday, monday, weekdays=[8])
+
+    def test_recurrence_creates_all(self):
+        response = self.series(time='14:00', recurrence={
+            'start': self.day.isoformat(), 'until': (self.day + timedelta(weeks=2)).isoformat(), 'weekdays': [1, 3],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 5)
+        self.assertEqual(
+            sorted(Appointment.objects.filter(time=time(14)).values_list('date', flat=True)),
+            [self.day + timedelta(days=offset) for offset in (0, 2, 7, 9, 14)],
+        )
+
+    def test_conflict_creates_nothing(self):
+        before = Appointment.objects.count()
+        response = self.series(occurrences=[
+            {'date': self.day.isoformat(), 'time': '09:15'},
+            {'date': (self.day + timedelta(days=7)).isoformat(), 'time': '09:15'},
+            {'date': (self.day + timedelta(days=5)).isoformat(), 'time': '09:15'},
+        ])
+        self.assertEqual(response.status_code, 409)
+        data = response.json()
+        self.assertEqual((data['created'], data['conflicts']), (0, 2))
+        self.assertEqual(
+            [(item['status'], item.get('reason')) for item in data['occurrences']],
+            [('conflict', engine.Availability.OVERLAP), ('available', None),
+             ('conflict', engine.Availability.DAY_DISABLED)],
+        )
+        self.assertEqual(Appointment.objects.count(), before)
+
+    def test_skip_conflicts(self):
+        response = self.series(skip_conflicts=True, occurrences=[
+            {'date': self.day.isoformat(), 'time': '09:15'},
+            {'date': (self.day + timedelta(days=7)).isoformat(), 'time': '09:15'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['status'] for item in response.json()['occurrences']], ['conflict', 'created'])
+        self.assertTrue(Appointment.objects.filter(date=self.day + timedelta(days=7), time=time(9, 15)).exists())
+
+    def test_invalid_body(self):
+        for body in ([1], 'texto', None):
+            self.assertEqual(self.post(body).status_code, 400)
+        self.assertEqual(self.series(time='25:00', recurrence={'start': 'x'}).status_code, 400)
+
+
+class CacheInvalidationTests(ClinicTestCase):
+    """Lo que otro worker invalida se ve en la siguiente verificación"""
+
+    def check(self, start_time, duration=timedelta(minutes=30)):
+        return engine.check_availability(self.doctors[0].pk, self.day, start_time, duration).reason
+
+    def invalidated_elsewhere(self, namespace):
+        # Otro worker: cambia la generación compartida sin tocar nuestro LRU
+        django_cache.incr(cache._generation_key(namespace))
+
+    def test_working_hour_saved(self):
+        self.assertEqual(self.check(time(16)), engine.Availability.AVAILABLE)
+        hours = WorkingHour.objects.get(doctor=self.doctors[0], day_id=1)
+        hours.end_time = time(12)
+        hours.save()
+        self.assertEqual(self.check(time(16)), engine.Availability.OUTSIDE_WORKING_HOURS)
+
+    def test_working_hour_changed_in_other_worker(self):
+        self.assertEqual(self.check(time(16)), engine.Availability.AVAILABLE)
+        WorkingHour.objects.filter(doctor=self.doctors[0], day_id=1).update(end_time=time(12))
+        self.invalidated_elsewhere(cache.SCHEDULES)
+        self.assertEqual(self.check(time(16)), engine.Availability.OUTSIDE_WORKING_HOURS)
+
+    def test_service_changed_in_other_worker(self):
+        duration = cache.get_service(self.service.pk).duration
+        self.assertEqual(self.check(time(16, 30), duration), engine.Availability.AVAILABLE)
+        Service.objects.filter(pk=self.service.pk).update(duration=timedelta(minutes=45))
+        self.invalidated_elsewhere(cache.SERVICES)
+        duration = cache.get_service(self.service.pk).duration
+        self.assertEqual(self.check(time(16, 30), duration), engine.Availability.OUTSIDE_WORKING_HOURS)
+
+
+class AvailabilityTests(ClinicTestCase):
+    """Disponibilidad por intervalo completo, no solo por hora de inicio"""
+
+    def setUp(self):
+        super().setUp()
+        self.tuesday = self.day + timedelta(days=1)
+        self.long_service = Service.objects.create(name='Endodoncia', duration=timedelta(minutes=60), price=900)
+        Appointment.objects.create(
+            doctor=self.doctors[0], patient=self.patients[0], service=self.long_service,
+            date=self.tuesday, time=time(10),
+        )
+
+    def check(self, start_time, minutes=30, day=None):
+        return engine.check_availability(
+            self.doctors[0].pk, day or self.tuesday, start_time, timedelta(minutes=minutes)
+        )
+
+    def test_start_inside_existing_appointment(self):
+        availability = self.check(time(10, 15))
+        self.assertEqual(availability.reason, engine.Availability.OVERLAP)
+        self.assertEqual([start.time() for _, start, _ in availability.conflicts], [time(10)])
+
+    def test_end_inside_existing_appointment(self):
+        self.assertEqual(self.check(time(9, 45)).reason, engine.Availability.OVERLAP)
+
+    def test_back_to_back(self):
+        self.assertTrue(self.check(time(9, 30)))
+        self.assertTrue(self.check(time(11)))
+
+    def test_cancelled_does_not_block(self):
+        Appointment.objects.filter(date=self.tuesday).update(status='cancelled')
+        self.assertTrue(self.check(time(10, 15)))
+
+    def test_past_working_hours_end(self):
+        self.assertTrue(self.check(time(16, 30)))
+        self.assertEqual(self.check(time(16, 45)).reason, engine.Availability.OUTSIDE_WORKING_HOURS)
+        self.assertEqual(self.check(time(8, 45)).reason, engine.Availability.OUTSIDE_WORKING_HOURS)
+
+    def test_disabled_weekday(self):
+        saturday = self.day + timedelta(days=5)
+        self.assertEqual(self.check(time(10), day=saturday).reason, engine.Availability.DAY_DISABLED)
+
+    async def test_view_rejects_overlap(self):
+        response = await self.async_client.post('/admin/scheduler/appointment/check-availability/', json.dumps({
+            'date': self.tuesday.isoformat(), 'time': '10:15', 'doctor_id': self.doctors[0].pk,
+            'service_id': self.service.pk,
+        }), content_type='application/json')
+        data = response.json()
+        self.assertFalse(data['available'])
+        self.assertEqual(data['reason'], engine.Availability.OVERLAP)
+        self.assertIn('10:00 a 11:00', data['message'])
+
+
+class FreeSlotsTests(ClinicTestCase):
+    """Horarios libres: huecos entre citas, rejilla del servicio y paginación"""
+
+    URL = '/admin/scheduler/appointment/find-slots/'
+
+    def slots(self, minutes, step=None, days=0):
+        return [
+            (doctor_id, start.strftime('%a %H:%M'))
+            for doctor_id, start, _ in engine.find_free_slots(
+                [self.doctors[0].pk], self.day, self.day + timedelta(days=days), timedelta(minutes=minutes),
+                step=step and timedelta(minutes=step),
+            )
+        ]
+
+    def test_gaps_aligned_to_service_length(self):
+        # Ocupado 9:00-9:30 y 11:00-11:30; la rejilla de 60 minutos parte de las 9:00
+        doctor = self.doctors[0].pk
+        self.assertEqual(self.slots(60), [
+            (doctor, f'Mon {hour:02}:00') for hour in (10, 12, 13, 14, 15, 16)
+        ])
+
+    def test_step_inside_gaps(self):
+        times = [start for _, start in self.slots(30, step=30)]
+        self.assertEqual(times[:3], ['Mon 09:30', 'Mon 10:00', 'Mon 10:30'])
+        self.assertNotIn('Mon 11:00', times)
+        self.assertEqual(times[3], 'Mon 11:30')
+        self.assertEqual(times[-1], 'Mon 16:30')
+
+    def test_disabled_weekdays_excluded(self):
+        WorkingHour.objects.create(doctor=self.doctors[0], day_id=6, start_time=time(9), end_time=time(12))
+        tuesday = Weekday.objects.get(pk=2)
+        tuesday.status = False
+        tuesday.save()
+        days = {start[:3] for _, start in self.slots(60, days=6)}
+        self.assertEqual(days, {'Mon', 'Wed', 'Thu', 'Fri'})
+
+    def get(self, **params):
+        self.client.force_login(self.admin)
+        return self.client.get(self.URL, {
+            'doctor_id': self.doctors[0].pk, 'service_id': self.service.pk,
+            'start': self.day.isoformat(), 'end': self.day.isoformat(), 'step': 60, **params,
+        })
+
+    def test_pages(self):
+        first = self.get(page_size=2).json()
+        second = self.get(page_size=2, page=2).json()
+        self.assertEqual((first['page'], second['page'], first['num_pages']), (1, 2, 3))
+        times = [slot['time'] for slot in first['slots'] + second['slots']]
+        self.assertEqual(times, ['10:00', '12:00', '13:00', '14:00'])
+
+    def test_page_out_of_range(self):
+        response = self.get(page_size=2, page=999)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['num_pages'], 3)
+        self.assertEqual(self.get(page='x').status_code, 400)
+
+
+class ImportTests(ClinicTestCase):
+    """import_clinic: llaves naturales, errores por fila, lotes y reanudación"""
+
+    COLUMNS = ['date', 'time', 'doctor_license', 'doctor', 'patient_phone', 'patient', 'service', 'status', 'reason']
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.past = date.today() - timedelta(days=30)
+
+    def write(self, rows):
+        path = os.path.join(self.tmp, 'citas.csv')
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, self.COLUMNS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+        return path
+
+    def row(self, hour, **values):
+        return {
+            'date': self.past.isoformat(), 'time': f'{hour:02}:00', 'doctor_license': 'L-0',
+            'patient_phone': '5550001', 'service': 'consulta', **values,
+        }
+
+    def run_import(self, path, batch_size=2):
+        with mock.patch.object(pubsub, 'publish_reload') as reload:
+            call_command('import_clinic', 'appointments', path, batch_size=batch_size, stderr=io.StringIO())
+        with open(f'{path}.checkpoint') as f:
+            state = json.load(f)
+        with open(f'{path}.errors.jsonl') as f:
+            errors = [json.loads(line) for line in f]
+        return state, errors, reload
+
+    def imported(self):
+        return Appointment.objects.filter(date=self.past)
+
+    def test_lookups_and_row_errors(self):
+        Patient.objects.create(user=self.admin, full_name='Paciente 2', phone='5559999')
+        changes_before = AppointmentChange.objects.count()
+        path = self.write([
+            self.row(9, reason='Limpieza'),
+            self.row(10, doctor_license='', doctor='luis gómez', patient_phone='', patient='Paciente 0'),
+            self.row(11, patient_phone='', patient='Paciente 2'),
+            self.row(12, doctor_license='X-9', service='Nada'),
+            self.row(13, time='25:00'),
+        ])
+        state, errors, reload = self.run_import(path)
+
+        self.assertEqual((state['imported'], state['errors'], state['done']), (2, 3, True))
+        self.assertEqual(
+            sorted(self.imported().values_list('time', 'doctor_id', 'patient_id', 'status')),
+            [(time(9), self.doctors[0].pk, self.patients[1].pk, 'completed'),
+             (time(10), self.doctors[1].pk, self.patients[0].pk, 'completed')],
+        )
+        self.assertEqual([(error['row'], sorted(error['errors'])) for error in errors], [
+            (3, ['patient']), (4, ['doctor_license', 'service']), (5, ['time']),
+        ])
+        self.assertIn('varios', errors[0]['errors']['patient'])
+        self.assertTrue(ClinicalHistory.objects.filter(appointment__time=time(9), reason='Limpieza').exists())
+
+        # Sin bitácora por cita: un solo aviso de recarga al final
+        self.assertEqual(AppointmentChange.objects.count(), changes_before)
+        reload.assert_called_once_with()
+        # Las estadísticas sí, con el precio de la importación
+        row = DailyStat.objects.get(date=self.past, doctor=self.doctors[0])
+        self.assertEqual((row.bookings, row.completed, row.revenue), (1, 1, 500))
+
+    def test_rejected_batch_retried_row_by_row(self):
+        # Dos citas activas en el mismo horario: el lote falla y se aísla la fila
+        path = self.write([
+            self.row(9, date=self.day.isoformat(), time='14:00', status='scheduled'),
+            self.row(9, date=self.day.isoformat(), time='14:00', status='scheduled', patient_phone='5550002'),
+            self.row(15),
+        ])
+        state, errors, _ = self.run_import(path, batch_size=2)
+        self.assertEqual((state['imported'], state['errors'], state['position']), (2, 1, 3))
+        self.assertEqual([(error['row'], list(error['errors'])) for error in errors], [(2, ['__all__'])])
+        self.assertEqual(Appointment.objects.filter(date=self.day, time=time(14)).count(), 1)
+
+    def test_resume_from_checkpoint(self):
+        path = self.write([self.row(hour) for hour in range(9, 14)])
+        # Una corrida anterior guardó los dos primeros lotes de dos filas
+        importer.save_checkpoint(f'{path}.checkpoint', {
+            'kind': 'appointments', 'source': importer.source_signature(path),
+            'position': 4, 'imported': 4, 'errors': 0, 'done': False,
+        })
+        open(f'{path}.errors.jsonl', 'w').close()
+        state, _, _ = self.run_import(path)
+        self.assertEqual((state['imported'], state['position'], state['done']), (5, 5, True))
+        self.assertEqual(list(self.imported().values_list('time', flat=True)), [time(13)])
+
+        # Terminada: repetir la orden no importa nada
+        _, _, reload = self.run_import(path)
+        self.assertEqual(self.imported().count(), 1)
+        reload.assert_not_called()
@@ -1,3 +1,24 @@
-from django.shortcuts import render
+import hmac
 
-# Create your views here.
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+from . import metrics
+
+
+def metrics_view(request):
+    """Métricas del proceso en formato de texto de Prometheus.
+
+    Con ``SCHEDULER_METRICS_TOKEN`` se exige ``Authorization: Bearer <token>``
+    (para el scraper); sin él, solo usuarios del staff.
+    """
+    if not metrics.enabled():
+        raise Http404
+    token = getattr(settings, 'SCHEDULER_METRICS_TOKEN', '')
+    if token:
+        authorization = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(authorization, f'Bearer {token}'):
+            return HttpResponse('No autorizado', status=401, content_type='text/plain')
+    elif not (request.user.is_active and request.user.is_staff):
+        return HttpResponse('No autorizado', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')